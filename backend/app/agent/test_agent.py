@@ -1,16 +1,29 @@
 """AI测试生成Agent"""
 import os
 import asyncio
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from loguru import logger
 from uuid import uuid4
 
 from app.services.git_service import GitService
 from app.services.code_analyzer import get_analyzer
-from app.services.test_generator import get_test_generator
+from app.services.test_generator import get_test_generator, new_usage
 from app.services.test_executor import get_test_executor
+from app.services.coverage_guide import CoverageGuide, supplement_suffix
+from app.services.failure_clusters import apply_patch, cluster_failures, get_fix_pattern_cache, learn_patch
+from app.services.llm_batch import BatchSession
+from app.services.metrics import FIX_ATTEMPTS, TASKS, track_stage
+from app.services.tracing import (
+    bind_context,
+    current_trace_id,
+    mark_span_error,
+    set_span_attributes,
+    start_span
+)
 
 
 class TestGenerationAgent:
@@ -24,7 +37,8 @@ class TestGenerationAgent:
         project_id: str,
         project_config: Dict,
         task_id: str,
-        progress_callback=None
+        progress_callback=None,
+        artifact_store=None
     ) -> Dict:
         """
         执行完整的测试生成流程
@@ -34,156 +48,438 @@ class TestGenerationAgent:
             project_config: 项目配置
             task_id: 任务ID
             progress_callback: 进度回调函数
+            artifact_store: 生成产物存储（记录每个文件的生成结果，重试时跳过已成功的文件）
             
         Returns:
             任务执行结果
         """
-        logger.info(f"🚀 开始执行测试生成任务: {task_id}")
-        
+        with start_span("agent.execute", {
+            'task.id': task_id,
+            'project.id': project_id,
+            'project.language': project_config.get('language'),
+            'project.test_framework': project_config.get('test_framework')
+        }) as span:
+            result = await self._run_pipeline(project_id, project_config, task_id, progress_callback, artifact_store)
+            set_span_attributes(span, {
+                'task.success': result['success'],
+                'task.test_files': len(result['test_files'])
+            })
+            if not result['success'] and not result['batch']:
+                mark_span_error(span, result['error'] or "")
+            return result
+    
+    @contextmanager
+    def _stage(self, stage: str, language: str):
+        """记录阶段耗时指标，并为该阶段开启 trace span"""
+        with track_stage(stage, language), start_span(f"stage.{stage}", {'project.language': language}):
+            yield
+    
+    def new_result(self) -> Dict:
+        """任务执行结果的初始值"""
         result = {
             'success': False,
             'commit_hash': None,
             'test_files': [],
             'test_results': {},
             'coverage': {},
+            'llm_usage': {},
+            'batch': None,
+            'source_files': None,
+            'trace_id': current_trace_id(),
             'error': None
         }
+        if result['trace_id']:
+            logger.info(f"🔗 trace_id: {result['trace_id']}")
+        return result
+    
+    async def _run_pipeline(
+        self,
+        project_id: str,
+        project_config: Dict,
+        task_id: str,
+        progress_callback=None,
+        artifact_store=None
+    ) -> Dict:
+        """依次执行克隆、分析、生成、测试、修复、覆盖率和提交各阶段"""
+        logger.info(f"🚀 开始执行测试生成任务: {task_id}")
+        
+        result = self.new_result()
+        language = project_config.get('language', 'unknown')
         
         try:
-            # 1. 克隆/更新代码仓库
-            await self._update_progress(progress_callback, 10, "CLONING", "克隆代码仓库...")
+            # 1-2. 克隆代码仓库、分析代码
+            plan = await self.prepare(project_id, project_config, progress_callback, artifact_store)
+            result['commit_hash'] = plan['commit_hash']
+            result['source_files'] = plan['source_files']
+            
+            # 3. 生成测试
+            test_generator = self.create_test_generator(plan['repo_path'], project_config)
+            generated_results = await self.generate(
+                plan['test_tasks'],
+                test_generator,
+                Path(plan['test_dir']),
+                project_config,
+                progress_callback,
+                artifact_store
+            )
+            
+            batch_session = test_generator.batch_session
+            if batch_session is not None and batch_session.collecting and batch_session.requests:
+                return await self.defer_to_batch(
+                    result, batch_session.provider, batch_session.model, batch_session.pending_requests(), progress_callback
+                )
+            if batch_session is not None and not batch_session.collecting:
+                logger.info(f"📥 批处理结果: 命中 {batch_session.hits} 个请求，实时调用 {batch_session.misses} 个")
+            
+            result['llm_usage'] = dict(test_generator.usage)
+            self.log_llm_usage(test_generator.usage)
+            
+            # 4-7. 执行测试、修复、收集覆盖率、提交
+            return await self.finish(
+                project_id,
+                project_config,
+                task_id,
+                plan,
+                generated_results,
+                result,
+                test_generator,
+                progress_callback
+            )
+        
+        except Exception as e:
+            return await self.fail(result, language, e, progress_callback)
+    
+    async def prepare(
+        self,
+        project_id: str,
+        project_config: Dict,
+        progress_callback=None,
+        artifact_store=None
+    ) -> Dict:
+        """
+        克隆/更新代码仓库、分析代码，确定需要生成测试的源文件（智能跳过已有测试）
+        
+        Args:
+            artifact_store: 生成产物存储（本任务之前生成的测试文件不当作已有测试跳过）
+        
+        Returns:
+            执行计划（可序列化，分阶段执行时作为检查点保存）: {
+                'repo_path', 'commit_hash', 'source_files', 'test_dir',
+                'test_tasks': 需要生成测试的源文件（每个源文件一个任务）,
+                'existing_tests': 已有的测试文件,
+                'existing_analyses': {已有测试文件: 对应源文件的分析结果}
+            }
+        """
+        language = project_config.get('language', 'unknown')
+        
+        # 1. 克隆/更新代码仓库
+        await self._update_progress(progress_callback, 10, "CLONING", "克隆代码仓库...")
+        with self._stage("clone", language):
             repo_path = await self.git_service.clone_or_pull(
                 project_id,
                 project_config['git_url'],
                 project_config['git_branch']
             )
             
-            commit_info = await self.git_service.get_commit_info(repo_path)
-            result['commit_hash'] = commit_info['hash']
-            
-            logger.info(f"📁 代码仓库: {repo_path}")
-            
-            # 2. 分析代码
-            await self._update_progress(progress_callback, 30, "ANALYZING", "分析代码结构...")
-            analyzer = get_analyzer(project_config['language'])
+            # 批处理任务恢复时固定到收集请求时的 commit
+            if project_config.get('pinned_commit'):
+                await self.git_service.pin_commit(repo_path, project_config['pinned_commit'])
             
-            source_dir = Path(repo_path) / project_config.get('source_directory', '.')
+            commit_info = await self.git_service.get_commit_info(repo_path)
+        
+        logger.info(f"📁 代码仓库: {repo_path}")
+        
+        own_tests = set()
+        if artifact_store is not None:
+            await artifact_store.load(repo_path)
+            own_tests = artifact_store.generated_test_files()
+        
+        # 2. 分析代码
+        await self._update_progress(progress_callback, 30, "ANALYZING", "分析代码结构...")
+        analyzer = get_analyzer(project_config['language'])
+        
+        source_dir = Path(repo_path) / project_config.get('source_directory', '.')
+        with self._stage("analyze", language):
             analysis_results = analyzer.analyze_directory(str(source_dir))
-            
-            logger.info(f"🔍 发现 {len(analysis_results)} 个文件待测试")
-            
-            # 3. 生成测试（智能跳过已有测试）
-            await self._update_progress(progress_callback, 50, "GENERATING", "检查并生成测试代码...")
-            test_generator = get_test_generator(
+        
+        logger.info(f"🔍 发现 {len(analysis_results)} 个文件待测试")
+        
+        # 3. 确定需要生成测试的源文件（智能跳过已有测试）
+        await self._update_progress(progress_callback, 50, "GENERATING", "检查并生成测试代码...")
+        
+        existing_tests = []
+        existing_analyses = {}  # 已有测试对应的源文件分析结果，用于后续修复
+        test_dir = Path(repo_path) / project_config.get('test_directory', 'tests')
+        test_dir.mkdir(parents=True, exist_ok=True)
+        
+        # 按源文件分组准备测试任务
+        test_tasks = []  # 每个任务对应一个源文件
+        skipped_count = 0
+        supplement_count = 0
+        skip_existing = project_config.get('skip_existing_tests', True)
+        
+        # 覆盖率引导模式：根据上一次任务的函数级覆盖率，只为低覆盖率函数补充测试
+        coverage_guide = None
+        if project_config.get('coverage_guided_generation') and project_config.get('previous_files_coverage'):
+            coverage_guide = CoverageGuide(
+                project_config['previous_files_coverage'],
+                project_config.get('coverage_threshold', 80.0)
+            )
+        
+        for file_analysis in analysis_results:
+            # 检查该源文件的测试文件是否已存在
+            expected_test_file = self._get_expected_test_file_path(
+                test_dir,
+                file_analysis['file_path'],
                 project_config['language'],
-                project_config.get('ai_provider', 'openai'),
-                repo_path
+                project_config.get('test_framework')
             )
             
-            generated_tests = []
-            existing_tests = []
-            test_dir = Path(repo_path) / project_config.get('test_directory', 'tests')
-            test_dir.mkdir(parents=True, exist_ok=True)
-            
-            # 为每个源文件生成测试（一个源文件一个测试文件，包含所有函数的测试）
-            test_metadata = {}  # 存储测试元数据，用于后续修复
-            max_concurrent = project_config.get('max_concurrent_generations', 10)  # 最大并发数
-            
-            # 按源文件分组准备测试任务
-            test_tasks = []  # 每个任务对应一个源文件
-            skipped_count = 0
-            skip_existing = project_config.get('skip_existing_tests', True)
-            
-            for file_analysis in analysis_results:
-                # 检查该源文件的测试文件是否已存在
-                expected_test_file = self._get_expected_test_file_path(
-                    test_dir,
-                    file_analysis['file_path'],
-                    project_config['language'],
-                    project_config.get('test_framework')
-                )
+            if skip_existing and expected_test_file.exists() and str(expected_test_file) not in own_tests:
+                # 测试文件已存在，跳过整个文件
+                if str(expected_test_file) not in existing_tests:
+                    existing_tests.append(str(expected_test_file))
+                existing_analyses[str(expected_test_file)] = file_analysis
                 
-                if skip_existing and expected_test_file.exists():
-                    # 测试文件已存在，跳过整个文件
-                    if str(expected_test_file) not in existing_tests:
-                        existing_tests.append(str(expected_test_file))
-                    test_metadata[str(expected_test_file)] = {
-                        'file_analysis': file_analysis,
-                        'is_existing': True
-                    }
+                # 已有测试但覆盖率不足的函数，单独生成补充测试文件
+                uncovered_functions = None
+                if coverage_guide:
+                    uncovered_functions = coverage_guide.select_uncovered_functions(file_analysis, repo_path)
+                
+                if uncovered_functions:
+                    suffix = self._next_supplement_suffix(
+                        test_dir,
+                        file_analysis['file_path'],
+                        project_config['language'],
+                        project_config.get('test_framework'),
+                        own_tests
+                    )
+                    test_tasks.append({
+                        'file_analysis': {
+                            **file_analysis,
+                            'functions': uncovered_functions,
+                            'test_suffix': suffix
+                        }
+                    })
+                    supplement_count += 1
+                    logger.info(f"📈 {expected_test_file.name}: {len(uncovered_functions)}/{len(file_analysis['functions'])} 个函数覆盖率不足，补充测试 ({suffix})")
+                else:
                     skipped_count += 1
                     logger.info(f"⏭️  跳过已有测试: {expected_test_file.name}")
+            else:
+                # 需要为该源文件生成新测试
+                test_tasks.append({
+                    'file_analysis': file_analysis
+                })
+        
+        max_concurrent = project_config.get('max_concurrent_generations', 10)
+        logger.info(f"📊 跳过 {skipped_count} 个已有测试，准备并发生成 {len(test_tasks)} 个新测试（其中覆盖率补充 {supplement_count} 个，并发数：{max_concurrent}）")
+        
+        return {
+            'repo_path': repo_path,
+            'commit_hash': commit_info['hash'],
+            'source_files': [
+                os.path.relpath(file_analysis['file_path'], repo_path) for file_analysis in analysis_results
+            ],
+            'test_dir': str(test_dir),
+            'test_tasks': test_tasks,
+            'existing_tests': existing_tests,
+            'existing_analyses': existing_analyses
+        }
+    
+    def create_test_generator(self, repo_path: str, project_config: Dict, use_batch: bool = True):
+        """
+        创建测试生成器
+        
+        批处理模式下第一次执行只收集生成请求，批次结果返回后恢复执行时从结果中取回
+        
+        Args:
+            repo_path: 仓库路径
+            project_config: 项目配置
+            use_batch: 是否按项目配置启用批处理会话（只做修复时为 False）
+        """
+        test_generator = get_test_generator(
+            project_config['language'],
+            project_config.get('ai_provider', 'openai'),
+            repo_path
+        )
+        
+        if use_batch and project_config.get('batch_results') is not None:
+            test_generator.batch_session = BatchSession(
+                test_generator.ai_provider, test_generator.model, project_config['batch_results']
+            )
+        elif use_batch and project_config.get('batch_mode'):
+            test_generator.batch_session = BatchSession(test_generator.ai_provider, test_generator.model)
+        return test_generator
+    
+    async def generate(
+        self,
+        test_tasks: List[Dict],
+        test_generator,
+        test_dir: Path,
+        project_config: Dict,
+        progress_callback=None,
+        artifact_store=None
+    ) -> List[Dict]:
+        """
+        并发为源文件生成测试（含语法验证和自动修复）
+        
+        Args:
+            artifact_store: 生成产物存储（复用已验证通过的产物，记录新生成的结果）
+        
+        Returns:
+            每个源文件的生成结果: {'success', 'file_analysis', 'test_file', 'test_code', 'error'}
+        """
+        if not test_tasks:
+            return []
+        
+        language = project_config.get('language', 'unknown')
+        max_concurrent = project_config.get('max_concurrent_generations', 10)  # 最大并发数
+        total_files = len(test_tasks)
+        
+        # 更新进度：开始生成
+        await self._update_progress(
+            progress_callback, 
+            50, 
+            "GENERATING", 
+            f"开始生成测试代码: 0/{total_files} 个文件"
+        )
+        
+        # 重试 / 恢复的任务复用已验证通过的产物，只重新生成缺失或失败的文件
+        reused_results = []
+        pending_tasks = test_tasks
+        if artifact_store is not None:
+            pending_tasks = []
+            for task in test_tasks:
+                reused = artifact_store.reuse(task['file_analysis'])
+                if reused:
+                    reused_results.append(reused)
                 else:
-                    # 需要为该源文件生成新测试
-                    test_tasks.append({
-                        'file_analysis': file_analysis
-                    })
-            
-            logger.info(f"📊 跳过 {skipped_count} 个已有测试，准备并发生成 {len(test_tasks)} 个新测试（并发数：{max_concurrent}）")
-            
-            # 并发生成新测试
-            if test_tasks:
-                total_files = len(test_tasks)
+                    pending_tasks.append(task)
+            if reused_results:
+                logger.info(f"♻️ 复用 {len(reused_results)} 个已生成的测试，重新生成 {len(pending_tasks)} 个")
+        
+        with self._stage("generate", language):
+            generated_results = reused_results + await self._generate_tests_concurrently(
+                pending_tasks,
+                test_generator,
+                test_dir,
+                project_config,
+                max_concurrent,
+                progress_callback,  # 传递进度回调
+                artifact_store
+            )
+        
+        # 处理生成结果
+        generated_count = 0
+        for result_item in generated_results:
+            if result_item['success']:
+                generated_count += 1
                 
-                # 更新进度：开始生成
+                # 更新详细进度
+                progress_percent = 50 + int((generated_count / total_files) * 15)  # 50-65%
                 await self._update_progress(
-                    progress_callback, 
-                    50, 
-                    "GENERATING", 
-                    f"开始生成测试代码: 0/{total_files} 个文件"
-                )
-                
-                generated_results = await self._generate_tests_concurrently(
-                    test_tasks,
-                    test_generator,
-                    test_dir,
-                    project_config,
-                    max_concurrent,
-                    progress_callback  # 传递进度回调
+                    progress_callback,
+                    progress_percent,
+                    "GENERATING",
+                    f"生成测试代码: {generated_count}/{total_files} 个文件"
                 )
                 
-                # 处理生成结果
-                generated_count = 0
-                for result_item in generated_results:
-                    if result_item['success']:
-                        test_file = result_item['test_file']
-                        generated_tests.append(test_file)
-                        test_metadata[test_file] = {
-                            'file_analysis': result_item['file_analysis'],
-                            'test_code': result_item['test_code'],
-                            'is_existing': False
-                        }
-                        generated_count += 1
-                        
-                        # 更新详细进度
-                        progress_percent = 50 + int((generated_count / total_files) * 15)  # 50-65%
-                        await self._update_progress(
-                            progress_callback,
-                            progress_percent,
-                            "GENERATING",
-                            f"生成测试代码: {generated_count}/{total_files} 个文件"
-                        )
-                        
-                        logger.info(f"✅ 生成测试 ({generated_count}/{total_files}): {Path(test_file).name}")
-                    else:
-                        source_file = Path(result_item['file_analysis']['file_path']).name
-                        logger.warning(f"⚠️  为源文件 {source_file} 生成测试失败: {result_item['error']}")
-            
-            # 所有测试文件（新生成的 + 已存在的）
-            all_test_files = generated_tests + existing_tests
-            result['test_files'] = all_test_files
-            logger.info(f"📝 新生成 {len(generated_tests)} 个测试，已有 {len(existing_tests)} 个测试，共 {len(all_test_files)} 个测试文件")
-            
-            # 4. 执行测试并自动修复失败的测试
-            await self._update_progress(progress_callback, 68, "TESTING", "执行测试...")
-            test_executor = get_test_executor(
-                project_config['language'], 
-                repo_path,
-                project_config.get('test_framework')
-            )
-            
+                logger.info(f"✅ 生成测试 ({generated_count}/{total_files}): {Path(result_item['test_file']).name}")
+            else:
+                source_file = Path(result_item['file_analysis']['file_path']).name
+                logger.warning(f"⚠️  为源文件 {source_file} 生成测试失败: {result_item['error']}")
+        
+        return generated_results
+    
+    async def defer_to_batch(
+        self,
+        result: Dict,
+        provider: str,
+        model: str,
+        requests: List[Dict],
+        progress_callback=None
+    ) -> Dict:
+        """批处理模式：生成请求已收集，返回待提交的批次（任务等待批次结果后恢复）"""
+        result['batch'] = {'provider': provider, 'model': model, 'requests': requests}
+        await self._update_progress(
+            progress_callback,
+            50,
+            "GENERATING",
+            f"已收集 {len(requests)} 个生成请求，等待批处理结果"
+        )
+        logger.info(f"📮 批处理模式: 收集到 {len(requests)} 个生成请求，等待批次结果后继续")
+        return result
+    
+    def log_llm_usage(self, usage: Dict):
+        """LLM 用量统计"""
+        logger.info(
+            f"🧮 LLM 用量: {usage['requests']} 次请求, "
+            f"输入 {usage['prompt_tokens']} tokens, "
+            f"其中命中提示词缓存 {usage['cached_prompt_tokens']} tokens, "
+            f"输出 {usage['completion_tokens']} tokens, "
+            f"截断 {usage['truncated']} 次"
+        )
+    
+    async def finish(
+        self,
+        project_id: str,
+        project_config: Dict,
+        task_id: str,
+        plan: Dict,
+        generated_results: List[Dict],
+        result: Dict,
+        test_generator,
+        progress_callback=None
+    ) -> Dict:
+        """
+        执行测试并修复失败的测试，收集覆盖率，提交代码
+        
+        Args:
+            plan: prepare 返回的执行计划
+            generated_results: generate 返回的生成结果
+            result: 任务执行结果（原地更新）
+            test_generator: 测试生成器（修复失败的测试时使用）
+        """
+        language = project_config.get('language', 'unknown')
+        repo_path = plan['repo_path']
+        result['commit_hash'] = result['commit_hash'] or plan['commit_hash']
+        result['source_files'] = plan['source_files']
+        
+        # 存储测试元数据，用于后续修复
+        test_metadata = {
+            test_file: {'file_analysis': file_analysis, 'is_existing': True}
+            for test_file, file_analysis in plan['existing_analyses'].items()
+        }
+        generated_tests = []
+        for result_item in generated_results:
+            if result_item['success']:
+                test_file = result_item['test_file']
+                generated_tests.append(test_file)
+                test_metadata[test_file] = {
+                    'file_analysis': result_item['file_analysis'],
+                    'test_code': result_item['test_code'],
+                    'is_existing': False
+                }
+        existing_tests = plan['existing_tests']
+        
+        # 所有测试文件（新生成的 + 已存在的）
+        all_test_files = generated_tests + existing_tests
+        result['test_files'] = all_test_files
+        logger.info(f"📝 新生成 {len(generated_tests)} 个测试，已有 {len(existing_tests)} 个测试，共 {len(all_test_files)} 个测试文件")
+        
+        # 4. 执行测试并自动修复失败的测试
+        await self._update_progress(progress_callback, 68, "TESTING", "执行测试...")
+        test_executor = get_test_executor(
+            project_config['language'], 
+            repo_path,
+            project_config.get('test_framework')
+        )
+        
+        try:
             # 首次执行测试
-            test_results = test_executor.execute_tests(generated_tests)
+            with self._stage("test_execution", language):
+                test_results = test_executor.execute_tests(generated_tests)
             result['test_results'] = test_results
             
             logger.info(f"🧪 测试结果: {test_results['passed_count']}/{test_results['total']} 通过")
@@ -195,21 +491,23 @@ class TestGenerationAgent:
             if enable_auto_fix and not test_results['passed'] and test_results['failed_count'] > 0:
                 logger.info(f"🔧 检测到 {test_results['failed_count']} 个测试失败，开始自动修复...")
                 
-                fixed_tests = await self._fix_failed_tests(
-                    test_executor,
-                    test_generator,
-                    generated_tests,
-                    test_metadata,
-                    test_results,
-                    project_config,
-                    max_retry,
-                    progress_callback
-                )
+                with self._stage("fix", language):
+                    fixed_tests = await self._fix_failed_tests(
+                        test_executor,
+                        test_generator,
+                        generated_tests,
+                        test_metadata,
+                        test_results,
+                        project_config,
+                        max_retry,
+                        progress_callback
+                    )
                 
                 if fixed_tests > 0:
                     logger.info(f"✅ 成功修复 {fixed_tests} 个测试")
                     # 重新执行所有测试
-                    test_results = test_executor.execute_tests(generated_tests)
+                    with self._stage("test_execution", language):
+                        test_results = test_executor.execute_tests(generated_tests)
                     result['test_results'] = test_results
                     logger.info(f"🧪 修复后测试结果: {test_results['passed_count']}/{test_results['total']} 通过")
             elif not enable_auto_fix and test_results['failed_count'] > 0:
@@ -219,24 +517,30 @@ class TestGenerationAgent:
             await self._update_progress(progress_callback, 85, "COLLECTING_COVERAGE", "收集覆盖率...")
             
             if test_results.get('coverage_file'):
-                coverage_data = test_executor.collect_coverage(test_results['coverage_file'])
+                with self._stage("coverage", language):
+                    coverage_data = test_executor.collect_coverage(test_results['coverage_file'])
                 result['coverage'] = coverage_data
                 logger.info(f"📊 代码覆盖率: {coverage_data.get('line_coverage', 0)}%")
             
-            # 7. 提交代码
-            if project_config.get('auto_commit', True):
-                await self._update_progress(progress_callback, 95, "COMMITTING", "提交测试代码...")
-                
-                branch_name = f"aitest/add-tests-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-                commit_message = f"""Add unit tests generated by AI Test Agent
+        finally:
+            # 落盘的测试输出只在执行和修复期间使用
+            test_executor.cleanup_output()
+        
+        # 7. 提交代码
+        if project_config.get('auto_commit', True):
+            await self._update_progress(progress_callback, 95, "COMMITTING", "提交测试代码...")
+            
+            branch_name = f"aitest/add-tests-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+            commit_message = f"""Add unit tests generated by AI Test Agent
 
 Generated {len(generated_tests)} test files
 Coverage: {result['coverage'].get('line_coverage', 0):.2f}%
 
 Task ID: {task_id}
 """
-                
-                try:
+            
+            try:
+                with self._stage("commit", language):
                     commit_hash = await self.git_service.commit_and_push(
                         repo_path,
                         generated_tests,
@@ -255,23 +559,26 @@ Task ID: {task_id}
                             commit_message,
                             project_config['git_branch']
                         )
-                
-                except Exception as e:
-                    logger.warning(f"提交代码失败: {e}")
-                    # 提交失败不影响整体成功
-            
-            # 8. 完成
-            await self._update_progress(progress_callback, 100, "COMPLETED", "任务完成!")
-            result['success'] = True
             
-            logger.info(f"🎉 任务完成: {task_id}")
-            return result
+            except Exception as e:
+                logger.warning(f"提交代码失败: {e}")
+                # 提交失败不影响整体成功
         
-        except Exception as e:
-            logger.error(f"❌ 任务执行失败: {e}")
-            result['error'] = str(e)
-            await self._update_progress(progress_callback, 0, "FAILED", f"失败: {e}")
-            return result
+        # 8. 完成
+        await self._update_progress(progress_callback, 100, "COMPLETED", "任务完成!")
+        result['success'] = True
+        TASKS.labels(language=language, status="completed").inc()
+        
+        logger.info(f"🎉 任务完成: {task_id}")
+        return result
+    
+    async def fail(self, result: Dict, language: str, error: Exception, progress_callback=None) -> Dict:
+        """记录任务失败"""
+        logger.error(f"❌ 任务执行失败: {error}")
+        result['error'] = str(error)
+        TASKS.labels(language=language, status="failed").inc()
+        await self._update_progress(progress_callback, 0, "FAILED", f"失败: {error}")
+        return result
     
     async def _generate_tests_concurrently(
         self,
@@ -280,10 +587,11 @@ Task ID: {task_id}
         test_dir: Path,
         project_config: Dict,
         max_concurrent: int,
-        progress_callback=None
+        progress_callback=None,
+        artifact_store=None
     ) -> List[Dict]:
         """
-        并发生成多个测试（每个任务对应一个源文件）
+        并发生成多个测试（每个任务对应一个源文件，每个文件完成后立即记录到产物存储）
         
         Args:
             test_tasks: 测试任务列表（每个任务包含一个源文件的所有函数）
@@ -292,13 +600,17 @@ Task ID: {task_id}
             project_config: 项目配置
             max_concurrent: 最大并发数
             progress_callback: 进度回调函数
+            artifact_store: 生成产物存储
             
         Returns:
             生成结果列表
         """
         semaphore = asyncio.Semaphore(max_concurrent)
+        batch_session = test_generator.batch_session
+        # 批处理收集阶段的请求没有真正执行，不记录产物
+        record_artifacts = artifact_store is not None and not (batch_session is not None and batch_session.collecting)
         
-        async def generate_test_for_file(task):
+        async def generate_test_for_file(task, file_usage):
             """为一个源文件的所有函数生成测试（含语法验证和自动修复）"""
             async with semaphore:
                 try:
@@ -310,16 +622,26 @@ Task ID: {task_id}
                     
                     # 生成测试代码并自动验证修复
                     def generate_and_validate_with_hybrid():
-                        return test_generator.generate_and_validate(
-                            file_analysis,
-                            project_config['language'],
-                            project_config['test_framework'],
-                            test_dir=test_dir,
-                            use_hybrid_mode=True,
-                            max_fix_attempts=3  # 最多尝试修复3次
-                        )
+                        with test_generator.usage_scope(file_usage):
+                            return test_generator.generate_and_validate(
+                                file_analysis,
+                                project_config['language'],
+                                project_config['test_framework'],
+                                test_dir=test_dir,
+                                use_hybrid_mode=True,
+                                max_fix_attempts=3  # 最多尝试修复3次
+                            )
                     
-                    result = await loop.run_in_executor(None, generate_and_validate_with_hybrid)
+                    with start_span("generate.file", {
+                        'code.file': file_analysis['file_path'],
+                        'code.functions': len(file_analysis.get('functions', [])),
+                        'test.suffix': file_analysis.get('test_suffix')
+                    }) as span:
+                        result = await loop.run_in_executor(None, bind_context(generate_and_validate_with_hybrid))
+                        set_span_attributes(span, {
+                            'validation.success': result['success'],
+                            'validation.attempts': result['attempts']
+                        })
                     
                     # 检查生成和验证是否成功
                     if not result['success']:
@@ -329,7 +651,8 @@ Task ID: {task_id}
                             'success': False,
                             'file_analysis': file_analysis,
                             'error': error_msg,
-                            'validation_errors': result['validation_errors']
+                            'validation_errors': result['validation_errors'],
+                            'validation_attempts': result['attempts']
                         }
                     
                     test_code = result['test_code']
@@ -346,7 +669,8 @@ Task ID: {task_id}
                         file_analysis['file_path'],
                         test_code,
                         project_config['language'],
-                        project_config.get('test_framework')
+                        project_config.get('test_framework'),
+                        suffix=file_analysis.get('test_suffix', '')
                     )
                     
                     return {
@@ -365,8 +689,16 @@ Task ID: {task_id}
                         'error': str(e)
                     }
         
+        async def generate_and_record(task):
+            """生成完成后立即记录产物（任务中途失败时已完成的文件不会丢失）"""
+            file_usage = new_usage()
+            item = await generate_test_for_file(task, file_usage)
+            if record_artifacts:
+                await artifact_store.record(item, file_usage)
+            return item
+        
         # 并发执行所有任务
-        results = await asyncio.gather(*[generate_test_for_file(task) for task in test_tasks])
+        results = await asyncio.gather(*[generate_and_record(task) for task in test_tasks])
         return results
     
     def _get_expected_test_file_path(
@@ -374,9 +706,10 @@ Task ID: {task_id}
         test_dir: Path,
         source_file: str,
         language: str,
-        test_framework: str = None
+        test_framework: str = None,
+        suffix: str = ''
     ) -> Path:
-        """获取预期的测试文件路径（一个源文件对应一个测试文件）"""
+        """获取预期的测试文件路径（一个源文件对应一个测试文件，补充测试带额外后缀）"""
         # 根据语言确定文件扩展名
         extensions = {
             'golang': '_test.go',
@@ -384,26 +717,51 @@ Task ID: {task_id}
             'c': '_test.c'
         }
         
-        # 生成测试文件名：源文件名 + 测试后缀
+        # 生成测试文件名：源文件名 + [补充后缀] + 测试后缀
         source_name = Path(source_file).stem
+        if suffix:
+            source_name = f"{source_name}_{suffix}"
         test_file_name = f"{source_name}{extensions.get(language, '_test.txt')}"
         
         return test_dir / test_file_name
     
+    def _next_supplement_suffix(
+        self,
+        test_dir: Path,
+        source_file: str,
+        language: str,
+        test_framework: str,
+        own_tests
+    ) -> str:
+        """
+        本轮覆盖率补充测试的文件后缀：之前各轮的补充测试文件保留，使用第一个未被占用的后缀
+
+        本任务之前的尝试（重试或恢复）已生成的补充文件属于本轮，沿用其后缀
+        """
+        round_number = 1
+        while True:
+            suffix = supplement_suffix(round_number)
+            test_file = self._get_expected_test_file_path(test_dir, source_file, language, test_framework, suffix)
+            if not test_file.exists() or str(test_file) in own_tests:
+                return suffix
+            round_number += 1
+    
     def _save_test_file(
         self,
         test_dir: Path,
         source_file: str,
         test_code: str,
         language: str,
-        test_framework: str = None
+        test_framework: str = None,
+        suffix: str = ''
     ) -> str:
         """保存测试文件并自动修复"""
         test_file_path = self._get_expected_test_file_path(
             test_dir,
             source_file,
             language,
-            test_framework
+            test_framework,
+            suffix
         )
         
         # 检查是否有大小写冲突的文件
@@ -463,7 +821,17 @@ Task ID: {task_id}
         progress_callback
     ) -> int:
         """
-        自动修复失败的测试
+        并发修复失败的测试
+        
+        1. 根据一次完整执行的结果找出失败的测试文件（不再逐个文件重新执行）
+        2. 按验证单元（Go 按包，C/C++ 按文件）并发调度：单元内的失败文件并发调用 AI 修复，
+           写回后立即验证该单元，不等待其他单元
+        3. 仍然失败的文件进入下一轮，最多 max_retry 轮
+        
+        开启失败聚类时，每轮先把编译错误相同的文件聚成簇：每簇只让 AI 修复簇首文件，
+        修复前后的差异作为补丁应用到簇内其他文件；验证通过的补丁缓存起来供后续任务复用
+        
+        AI 修复和验证都在线程池中执行，不阻塞事件循环
         
         Args:
             test_executor: 测试执行器
@@ -478,84 +846,186 @@ Task ID: {task_id}
         Returns:
             成功修复的测试数量
         """
-        fixed_count = 0
-        retry_count = 0
+        language = project_config['language']
+        fix_concurrency = project_config.get(
+            'max_concurrent_fixes',
+            project_config.get('max_concurrent_generations', 10)
+        )
+        fix_semaphore = asyncio.Semaphore(fix_concurrency)
+        # 验证会启动编译器/go test，并发数不超过 CPU 核数
+        verify_semaphore = asyncio.Semaphore(max(1, min(fix_concurrency, os.cpu_count() or 4)))
+        loop = asyncio.get_event_loop()
         
-        while retry_count < max_retry and test_results.get('failed_count', 0) > 0:
-            retry_count += 1
-            logger.info(f"🔄 第 {retry_count}/{max_retry} 次修复尝试")
-            
-            await self._update_progress(
-                progress_callback,
-                70 + retry_count * 3,
-                "FIXING",
-                f"修复失败的测试 (第{retry_count}次尝试)..."
-            )
-            
-            # 逐个测试文件执行，找出失败的测试
-            for test_file in test_files:
+        def with_metadata(failures: Dict[str, str]) -> Dict[str, str]:
+            for test_file in failures:
+                if test_file not in test_metadata:
+                    logger.warning(f"⚠️  找不到测试元数据: {test_file}")
+            return {f: output for f, output in failures.items() if f in test_metadata}
+        
+        failing = with_metadata(test_executor.find_failing_files(test_files, test_results))
+        fixed_files = set()
+        
+        clustering = project_config.get('failure_clustering', False)
+        pattern_cache = get_fix_pattern_cache() if clustering else None
+        # 本轮已通过聚类写回的文件: {文件: 所在簇的补丁信息}（同簇文件共享同一个字典）
+        cluster_fixed: Dict[str, Dict] = {}
+        
+        async def ai_fix_file(test_file: str, failure_output: str, round_no: int) -> Optional[Tuple[str, str]]:
+            """调用 AI 修复单个测试文件并写回，返回 (修复前代码, 修复后代码)，失败时返回 None"""
+            metadata = test_metadata[test_file]
+            async with fix_semaphore:
                 try:
-                    # 单独执行这个测试文件
-                    single_result = test_executor.execute_tests([test_file])
+                    with open(test_file, 'r', encoding='utf-8') as f:
+                        current_test_code = f.read()
                     
-                    # 如果这个测试失败了
-                    if not single_result['passed'] and single_result['failed_count'] > 0:
-                        logger.info(f"🔍 分析失败测试: {test_file}")
-                        
-                        # 获取测试元数据
-                        if test_file not in test_metadata:
-                            logger.warning(f"⚠️  找不到测试元数据: {test_file}")
-                            continue
-                        
-                        metadata = test_metadata[test_file]
-                        
-                        # 读取当前测试代码
-                        with open(test_file, 'r', encoding='utf-8') as f:
-                            current_test_code = f.read()
-                        
-                        # 使用AI修复测试
-                        try:
-                            fixed_test_code = test_generator.fix_test(
-                                current_test_code,
-                                single_result['output'],
-                                metadata['file_analysis'],
-                                project_config['language'],
-                                project_config['test_framework']
-                            )
-                            
-                            # 保存修复后的测试
-                            with open(test_file, 'w', encoding='utf-8') as f:
-                                f.write(fixed_test_code)
-                            
-                            # 更新元数据
-                            metadata['test_code'] = fixed_test_code
-                            
-                            # 验证修复后的测试
-                            verify_result = test_executor.execute_tests([test_file])
-                            if verify_result['passed']:
-                                logger.info(f"✅ 测试修复成功: {test_file}")
-                                fixed_count += 1
-                            else:
-                                logger.warning(f"⚠️  测试修复后仍然失败: {test_file}")
-                        
-                        except Exception as e:
-                            logger.error(f"❌ 修复测试失败: {test_file}, 错误: {e}")
-                            continue
+                    with start_span("fix.file", {'test.file': test_file, 'fix.round': round_no}):
+                        fixed_test_code = await loop.run_in_executor(None, bind_context(partial(
+                            test_generator.fix_test,
+                            current_test_code,
+                            failure_output,
+                            metadata['file_analysis'],
+                            language,
+                            project_config['test_framework']
+                        )))
+                    
+                    with open(test_file, 'w', encoding='utf-8') as f:
+                        f.write(fixed_test_code)
+                    metadata['test_code'] = fixed_test_code
+                    return current_test_code, fixed_test_code
                 
                 except Exception as e:
-                    logger.error(f"❌ 执行测试失败: {test_file}, 错误: {e}")
+                    logger.error(f"❌ 修复测试失败: {test_file}, 错误: {e}")
+                    FIX_ATTEMPTS.labels(language=language, kind="test", outcome="error").inc()
+                    return None
+        
+        async def fix_file(test_file: str, failure_output: str, round_no: int) -> bool:
+            """修复单个测试文件，返回是否已写回（本轮已由聚类补丁写回的文件直接返回）"""
+            if test_file in cluster_fixed:
+                return True
+            return await ai_fix_file(test_file, failure_output, round_no) is not None
+        
+        async def fix_cluster(cluster: Dict, round_no: int):
+            """修复一个失败簇：有缓存的补丁时直接应用到所有文件，否则 AI 修复簇首文件后把补丁应用到其他文件"""
+            files = cluster['files']
+            hunks = pattern_cache.get(language, cluster['signature'])
+            patch_info = {
+                'signature': cluster['signature'],
+                'messages': cluster['messages'],
+                'hunks': hunks or [],
+                'from_cache': bool(hunks),
+                'settled': False
+            }
+            
+            if not hunks:
+                if len(files) < 2:
+                    return
+                leader, files = files[0], files[1:]
+                fixed = await ai_fix_file(leader, failing[leader], round_no)
+                if fixed is None:
+                    return
+                cluster_fixed[leader] = patch_info
+                patch_info['hunks'] = learn_patch(*fixed)
+                if not patch_info['hunks']:
+                    logger.debug(f"簇首文件修改过多，无法提炼补丁: {leader}")
+                    return
+            
+            applied = 0
+            for test_file in files:
+                with open(test_file, 'r', encoding='utf-8') as f:
+                    current_test_code = f.read()
+                patched = apply_patch(current_test_code, patch_info['hunks'])
+                if patched is None or patched == current_test_code:
                     continue
+                with open(test_file, 'w', encoding='utf-8') as f:
+                    f.write(patched)
+                test_metadata[test_file]['test_code'] = patched
+                cluster_fixed[test_file] = patch_info
+                applied += 1
+            
+            source = "缓存的" if patch_info['from_cache'] else "簇首文件的"
+            logger.info(f"🧩 {source}补丁已应用到 {applied}/{len(files)} 个文件: {cluster['messages'][0]}")
+        
+        async def fix_unit(unit_files: List[str], round_no: int) -> Dict[str, str]:
+            """修复一个验证单元内的失败文件并验证，返回该单元仍然失败的文件"""
+            targets = [f for f in unit_files if f in failing]
+            written = await asyncio.gather(*[fix_file(f, failing[f], round_no) for f in targets])
+            if not any(written):
+                return {f: failing[f] for f in targets}
+            
+            async with verify_semaphore:
+                with start_span("verify.unit", {'test.files': len(unit_files), 'fix.round': round_no}):
+                    verify_result = await loop.run_in_executor(
+                        None, bind_context(test_executor.verify_tests), unit_files
+                    )
             
-            # 重新执行所有测试查看整体情况
-            test_results = test_executor.execute_tests(test_files)
-            logger.info(f"📊 当前测试状态: {test_results['passed_count']}/{test_results['total']} 通过")
+            still_failing = test_executor.find_failing_files(unit_files, verify_result)
+            for test_file, was_written in zip(targets, written):
+                if not was_written:
+                    continue
+                if test_file in still_failing:
+                    logger.warning(f"⚠️  测试修复后仍然失败: {test_file}")
+                else:
+                    logger.info(f"✅ 测试修复成功: {test_file}")
+                    fixed_files.add(test_file)
+                FIX_ATTEMPTS.labels(
+                    language=language,
+                    kind="test",
+                    outcome="failed" if test_file in still_failing else "fixed"
+                ).inc()
+                
+                # 补丁首次验证通过时缓存，缓存的补丁验证失败时删除
+                patch_info = cluster_fixed.get(test_file)
+                if patch_info and patch_info['hunks'] and not patch_info['settled']:
+                    if test_file not in still_failing and not patch_info['from_cache']:
+                        pattern_cache.put(language, patch_info['signature'], patch_info['hunks'], patch_info['messages'])
+                        patch_info['settled'] = True
+                    elif test_file in still_failing and patch_info['from_cache']:
+                        pattern_cache.discard(language, patch_info['signature'])
+                        patch_info['settled'] = True
             
-            # 如果所有测试都通过了，提前退出
-            if test_results['passed']:
-                logger.info("🎉 所有测试都通过了！")
+            # 写回失败的文件保留原来的失败信息；同一单元内被连带影响的文件也进入下一轮
+            remaining = with_metadata(still_failing)
+            for test_file, was_written in zip(targets, written):
+                if not was_written:
+                    remaining[test_file] = failing[test_file]
+            return remaining
+        
+        for round_no in range(1, max_retry + 1):
+            if not failing:
                 break
+            
+            logger.info(f"🔄 第 {round_no}/{max_retry} 次修复尝试: {len(failing)} 个失败的测试文件 (并发数: {fix_concurrency})")
+            await self._update_progress(
+                progress_callback,
+                70 + round_no * 3,
+                "FIXING",
+                f"并发修复 {len(failing)} 个失败的测试文件 (第{round_no}次尝试)..."
+            )
+            
+            cluster_fixed.clear()
+            if clustering:
+                clusters = cluster_failures(failing)
+                if clusters:
+                    clustered = sum(len(cluster['files']) for cluster in clusters)
+                    logger.info(f"🧩 {clustered} 个编译失败的测试文件聚成 {len(clusters)} 簇")
+                    await asyncio.gather(*[fix_cluster(cluster, round_no) for cluster in clusters])
+            
+            units = [
+                unit for unit in test_executor.group_for_verification(test_files)
+                if any(f in failing for f in unit)
+            ]
+            unit_results = await asyncio.gather(*[fix_unit(unit, round_no) for unit in units])
+            
+            failing = {}
+            for remaining in unit_results:
+                failing.update(remaining)
+            
+            if failing:
+                logger.info(f"📊 第 {round_no} 轮修复后仍有 {len(failing)} 个测试文件失败")
+            else:
+                logger.info("🎉 所有失败的测试都已修复！")
         
-        return fixed_count
+        return len(fixed_files - set(failing))
     
     async def _update_progress(
         self,
@@ -1,4 +1,5 @@
 """仪表板API"""
+import asyncio
 from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
@@ -6,6 +7,7 @@ from datetime import datetime, timedelta
 
 from app.database import get_db, Project, Task, CoverageReport
 from app.database import TaskStatus
+from app.services.rate_limiter import get_rate_limit_snapshot
 
 
 router = APIRouter()
@@ -113,3 +115,9 @@ async def get_recent_tasks(
         for task in tasks
     ]
 
+
+@router.get("/llm-rate-limits")
+async def get_llm_rate_limits():
+    """获取 LLM 限流状态（配额、桶余量、当前每分钟用量、各 worker 的自适应并发上限）"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, get_rate_limit_snapshot)
@@ -2,11 +2,12 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import List
+from typing import List, Optional
 from uuid import uuid4
 
 from app.database import get_db, Project, Task
-from app.schemas import ProjectCreate, ProjectUpdate, ProjectResponse, TaskResponse
+from app.services.scheduler import is_valid_cron
+from app.schemas import ProjectCreate, ProjectUpdate, ProjectResponse, TaskCreate, TaskResponse
 
 
 router = APIRouter()
@@ -18,6 +19,9 @@ async def create_project(
     db: AsyncSession = Depends(get_db)
 ):
     """创建新项目"""
+    if project_data.schedule_cron and not is_valid_cron(project_data.schedule_cron):
+        raise HTTPException(status_code=400, detail=f"Invalid schedule_cron: {project_data.schedule_cron}")
+    
     project = Project(
         id=str(uuid4()),
         name=project_data.name,
@@ -95,6 +99,8 @@ async def update_project(
     
     # 更新字段
     update_data = project_data.model_dump(exclude_unset=True)
+    if update_data.get('schedule_cron') and not is_valid_cron(update_data['schedule_cron']):
+        raise HTTPException(status_code=400, detail=f"Invalid schedule_cron: {update_data['schedule_cron']}")
     for field, value in update_data.items():
         setattr(project, field, value)
     
@@ -127,10 +133,11 @@ async def delete_project(
 @router.post("/{project_id}/tasks", response_model=TaskResponse, status_code=201)
 async def create_task(
     project_id: str,
+    options: Optional[TaskCreate] = None,
     db: AsyncSession = Depends(get_db)
 ):
     """为项目创建测试任务"""
-    from app.worker import run_test_generation_task
+    from app.services.task_routing import dispatch_generation_task
     
     # 验证项目存在
     result = await db.execute(
@@ -151,8 +158,8 @@ async def create_task(
     await db.commit()
     await db.refresh(task)
     
-    # 异步执行任务
-    run_test_generation_task.delay(task.id)
+    # 按任务规模投递到 interactive / bulk 队列
+    await dispatch_generation_task(db, task.id, project_id, batch_mode=bool(options and options.batch_mode))
     
     return task
 
@@ -1,5 +1,6 @@
 """任务管理API"""
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import List
@@ -10,7 +11,8 @@ from app.schemas import (
     TaskLogResponse, 
     CoverageReportResponse,
     TestFixRequest,
-    TestFixResponse
+    FixJobResponse,
+    FixJobEventsResponse
 )
 
 
@@ -61,6 +63,37 @@ async def cancel_task(
     return {"message": "Task cancelled successfully"}
 
 
+@router.post("/{task_id}/retry", response_model=TaskResponse)
+async def retry_task(
+    task_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """重试失败或已取消的任务（已验证通过的文件不再重新生成，分阶段执行时从最后保存的检查点继续）"""
+    from app.database import TaskStatus
+    from app.services.task_routing import dispatch_generation_task
+    
+    result = await db.execute(
+        select(Task).where(Task.id == task_id)
+    )
+    task = result.scalar_one_or_none()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if task.status not in (TaskStatus.FAILED, TaskStatus.CANCELLED):
+        raise HTTPException(status_code=400, detail="Only failed or cancelled tasks can be retried")
+    
+    task.status = TaskStatus.PENDING
+    task.error_message = None
+    task.completed_at = None
+    await db.commit()
+    await db.refresh(task)
+    
+    await dispatch_generation_task(db, task.id, task.project_id)
+    
+    return task
+
+
 @router.get("/{task_id}/logs", response_model=List[TaskLogResponse])
 async def get_task_logs(
     task_id: str,
@@ -97,20 +130,27 @@ async def get_task_coverage(
     return coverage
 
 
-@router.post("/fix-tests", response_model=TestFixResponse)
+@router.post("/fix-tests", response_model=FixJobResponse, status_code=202)
 async def fix_tests(
-    fix_request: TestFixRequest
+    fix_request: TestFixRequest,
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    修复已生成的测试代码（异步并发版本）
+    修复已生成的测试代码（后台任务）
     
     用于修复之前生成的测试文件中的语法错误，支持：
     - 清理 markdown 标记
     - 修复括号不匹配
     - 修复其他语法错误
     - 异步并发处理多个文件，大幅提升速度
+    
+    请求立即返回修复任务，修复在 Celery worker 中执行。通过以下接口获取进度和结果：
+    - GET /fix-jobs/{job_id}: 任务状态、进度计数，完成后包含完整结果
+    - GET /fix-jobs/{job_id}/events?offset=N: 增量读取逐文件结果
+    - GET /fix-jobs/{job_id}/stream: NDJSON 流式返回逐文件结果，任务结束后关闭
     """
-    from app.services.test_fixer import TestFixer
+    from app.services.fix_jobs import create_fix_job
+    from app.worker import run_fix_tests_job
     from loguru import logger
     
     logger.info(f"🔧 收到测试修复请求:")
@@ -119,28 +159,89 @@ async def fix_tests(
     logger.info(f"   语言: {fix_request.language}")
     logger.info(f"   框架: {fix_request.test_framework}")
     
-    try:
-        # 创建修复器
-        fixer = TestFixer(
-            language=fix_request.language,
-            test_framework=fix_request.test_framework
-        )
-        
-        # 执行异步并发修复
-        result = await fixer.fix_tests_in_directory_async(
-            workspace_path=fix_request.workspace_path,
-            test_directory=fix_request.test_directory,
-            max_fix_attempts=fix_request.max_fix_attempts,
-            max_concurrent=10,  # 最大并发数：10个文件同时处理
-            auto_git_commit=fix_request.auto_git_commit,
-            git_username=fix_request.git_username,
-            git_branch_name=fix_request.git_branch_name,
-            git_commit_message=fix_request.git_commit_message
-        )
-        
-        return TestFixResponse(**result)
-        
-    except Exception as e:
-        logger.error(f"❌ 测试修复失败: {e}")
-        raise HTTPException(status_code=500, detail=f"修复失败: {str(e)}")
+    job = await create_fix_job(db, fix_request.model_dump(mode='json'))
+    run_fix_tests_job.apply_async((job.id,))
+    logger.info(f"📬 修复任务已投递: {job.id}")
+    
+    return job
+
+
+async def _get_fix_job(db: AsyncSession, job_id: str):
+    from app.services.fix_jobs import load_fix_job
+    
+    job = await load_fix_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Fix job not found")
+    return job
+
+
+@router.get("/fix-jobs/{job_id}", response_model=FixJobResponse)
+async def get_fix_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_db)
+):
+    """获取修复任务状态（完成后包含完整的修复结果）"""
+    return await _get_fix_job(db, job_id)
+
+
+@router.get("/fix-jobs/{job_id}/events", response_model=FixJobEventsResponse)
+async def get_fix_job_events(
+    job_id: str,
+    offset: int = 0,
+    limit: int = 500,
+    db: AsyncSession = Depends(get_db)
+):
+    """增量读取修复任务事件（started / file / completed / failed），下次从 next_offset 继续读取"""
+    from app.services.fix_jobs import TERMINAL_EVENTS, read_events
+    
+    job = await _get_fix_job(db, job_id)
+    events = await read_events(job, offset, limit)
+    return FixJobEventsResponse(
+        job_id=job.id,
+        status=job.status,
+        events=events,
+        next_offset=offset + len(events),
+        finished=any(event['type'] in TERMINAL_EVENTS for event in events)
+    )
+
+
+@router.get("/fix-jobs/{job_id}/stream")
+async def stream_fix_job_events(
+    job_id: str,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db)
+):
+    """以 NDJSON 流式返回修复任务事件（每行一个事件），任务结束后关闭连接"""
+    import asyncio
+    import json
+    from app.config import get_settings
+    from app.database import AsyncSessionLocal, FixJobStatus
+    from app.services.fix_jobs import TERMINAL_EVENTS, load_fix_job, read_events
+    
+    job = await _get_fix_job(db, job_id)
+    poll_interval = get_settings().fix_job_stream_poll_interval
+    
+    async def event_stream():
+        position = offset
+        current = job
+        while True:
+            events = await read_events(current, position)
+            for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+            position += len(events)
+            if any(event['type'] in TERMINAL_EVENTS for event in events):
+                return
+            
+            await asyncio.sleep(poll_interval)
+            # 事件写入失败时以数据库状态为准，避免一直等待
+            async with AsyncSessionLocal() as session:
+                current = await load_fix_job(session, job_id)
+            if current is None:
+                return
+            if current.status in (FixJobStatus.COMPLETED, FixJobStatus.FAILED):
+                for event in await read_events(current, position):
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+                return
+    
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
 
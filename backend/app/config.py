@@ -1,6 +1,7 @@
 """应用配置"""
 import os
 from functools import lru_cache
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
@@ -29,7 +30,7 @@ class Settings(BaseSettings):
     celery_result_backend: str = "redis://localhost:6379/0"
     
     # AI配置
-    ai_provider: str = "openai"  # openai, anthropic, local
+    ai_provider: str = "openai"  # openai, anthropic, local, mock
     openai_api_key: str = ""
     openai_model: str = "gpt-4"
     openai_base_url: str = "https://api.openai.com/v1"
@@ -39,6 +40,18 @@ class Settings(BaseSettings):
     
     local_model_url: str = "http://localhost:8080/v1"
     local_model_name: str = "codellama"
+    local_model_api_key: str = ""  # 本地模型服务需要鉴权时填写（如 vLLM --api-key）
+    local_model_concurrency: int = 16  # 本地模型服务的并发请求数/连接池大小（连续批处理服务可适当调大）
+    local_model_cache_prompt: bool = True  # 请求 llama.cpp server 复用相同前缀的 KV 缓存
+    local_model_seed: Optional[int] = 0  # 固定随机种子，便于结果复现（为空表示不固定）
+    
+    # 模拟提供商（ai_provider=mock，用于基准测试，不产生 API 费用）
+    mock_llm_mode: str = "synthetic"  # synthetic / record / replay
+    mock_llm_cassette: str = ""  # 录制文件路径（record / replay 模式）
+    mock_llm_record_provider: str = "openai"  # 录制模式下实际调用的提供商
+    mock_llm_latency_ms: float = 0  # 合成回复的首 token 延迟（毫秒）
+    mock_llm_tokens_per_second: float = 0  # 合成回复的输出速度（0 表示不限速）
+    mock_llm_strict_replay: bool = False  # 回放时遇到未录制的请求是否报错（否则使用合成回复）
     
     # Git配置
     git_username: str = ""
@@ -52,6 +65,16 @@ class Settings(BaseSettings):
     # 日志
     log_level: str = "INFO"
     
+    # 监控指标（Prometheus）
+    metrics_worker_port: int = 9100  # Celery worker 导出 /metrics 的端口（0 表示不启动）
+    metrics_multiproc_dir: str = ""  # 多进程模式的指标目录（Celery prefork / uvicorn 多 worker 时必需）
+    
+    # 分布式追踪（OpenTelemetry）
+    tracing_exporter: str = "none"  # none / file / otlp
+    tracing_file: str = "/app/logs/traces.jsonl"  # file 模式的输出文件（JSONL，每行一个 span）
+    tracing_otlp_endpoint: str = "http://localhost:4318/v1/traces"  # otlp 模式的收集器地址（OTLP/HTTP）
+    tracing_sample_ratio: float = 1.0  # 采样比例（按 trace 采样，子 span 跟随父 span）
+    
     # 覆盖率阈值
     default_coverage_threshold: float = 80.0
     
@@ -59,12 +82,77 @@ class Settings(BaseSettings):
     max_test_fix_retries: int = 3  # AI自动修复测试的最大重试次数
     enable_auto_fix: bool = True  # 是否启用自动修复功能
     max_concurrent_generations: int = 10  # 并发生成测试的最大数量
+    max_concurrent_fixes: int = 10  # 测试执行失败后，并发修复的测试文件数上限
+    rule_fix_enabled: bool = True  # 调用 AI 修复前先用规则处理机械性的编译错误（导入、包名、截断的括号等）
+    failure_clustering: bool = True  # 相同编译错误的失败文件聚成一簇，只调用一次 AI 修复，补丁应用到簇内其他文件
+    fix_pattern_cache_ttl: int = 604800  # 验证通过的修复补丁缓存时间（秒），后续任务遇到相同错误直接复用
+    test_output_tail_bytes: int = 65536  # 测试/编译输出在内存中只保留末尾的字符数（结果中的 output 和日志），完整输出写入磁盘
+    test_output_spool_max_bytes: int = 268435456  # 单次测试执行写入磁盘的输出上限，超过后丢弃最早的部分
+    test_output_excerpt_bytes: int = 16384  # 修复提示词中每个测试文件的失败输出摘录上限（只摘录与该文件相关的片段）
+    batch_generation_concurrency: int = 8  # 大文件分批生成时，单个文件内的并发请求数
+    max_concurrent_llm_requests: int = 20  # 单个进程内同时进行的 LLM 请求上限（所有任务共享）
+    batch_group_token_budget: int = 6000  # 分批生成时每组函数的 token 上限（函数体 + 预期输出）
+    batch_group_max_functions: int = 8  # 分批生成时每组最多包含的函数数
+    
+    # LLM 限流配置（所有 worker 通过 Redis 共享配额）
+    llm_requests_per_minute: int = 0  # 每个提供商/模型每分钟请求数上限（0 表示不限制）
+    llm_tokens_per_minute: int = 0  # 每个提供商/模型每分钟 token 数上限（0 表示不限制）
+    llm_min_concurrency: int = 2  # 自适应并发的下限（收到 429 时最多降到该值）
+    llm_latency_target_seconds: float = 120.0  # 单次请求延迟超过该值时降低并发（0 表示不根据延迟调整）
+    llm_rate_limit_cooldown_seconds: float = 10.0  # 收到 429 且没有 Retry-After 时，所有进程暂停的秒数
+    
+    # LLM 请求执行策略（重试/对冲/备用模型）
+    llm_request_timeout: float = 300.0  # 单次请求超时（秒）
+    llm_max_retries: int = 3  # 超时、连接错误、429、5xx 等瞬时错误的最大重试次数
+    llm_retry_base_delay: float = 1.0  # 指数退避的基础延迟（秒），实际延迟带随机抖动
+    llm_retry_max_delay: float = 30.0  # 单次重试的最大延迟（秒）
+    llm_hedging_enabled: bool = False  # 请求耗时超过历史 p95 时发起对冲请求
+    llm_hedge_min_samples: int = 20  # 计算 p95 所需的最少样本数
+    llm_hedge_max_ratio: float = 0.1  # 对冲请求占总请求数的上限比例
+    llm_fallback_enabled: bool = False  # 主模型重试耗尽后切换到本地模型（local_model_url / local_model_name）
+    llm_streaming_enabled: bool = False  # 流式接收输出，生成跑偏时提前中止并立即重试
+    llm_stream_prose_limit: int = 800  # 代码开始前允许的最多说明文字字符数，超过视为跑偏
+    llm_stream_syntax_check: bool = True  # 流式接收时用 tree-sitter 增量检查已输出代码的语法
+    llm_patch_fix_enabled: bool = True  # 修复大测试文件时只发送出错区域，让模型返回 SEARCH/REPLACE 修改块
+    llm_patch_fix_min_lines: int = 150  # 测试文件达到该行数才使用补丁模式（小文件整文件修复更稳妥）
+    llm_patch_fix_context_lines: int = 12  # 每个出错行前后发送的上下文行数
+    llm_patch_fix_max_ratio: float = 0.6  # 出错区域超过文件的该比例时直接整文件修复
+    llm_prompt_cache_enabled: bool = True  # 把系统提示词和框架规则等固定前缀标记为可缓存（Anthropic cache_control；OpenAI 按前缀自动缓存）
+    prompt_template_dir: str = ""  # 提示词模板覆盖目录（<模板名>.tmpl，优先于内置模板）
+    prompt_project_overrides: bool = False  # 允许项目仓库中的 .aitest/prompts/*.tmpl 覆盖提示词模板（默认关闭，被测仓库内容不可信）
+    prompt_template_reload_interval: int = 30  # 覆盖模板修改后多久生效（秒）
+    llm_batch_mode: bool = False  # 所有任务默认使用批处理模式（生成请求通过提供商的异步批处理接口提交，适合夜间批量任务）
+    llm_batch_window_seconds: int = 300  # 批处理收集窗口（秒），同一提供商/模型窗口内各任务的请求合并为一个批次提交
+    llm_batch_poll_interval: int = 60  # 提交到期请求、查询批次状态的间隔（秒）
+    llm_batch_max_requests: int = 10000  # 单个批次的最大请求数
+    llm_batch_completion_window: str = "24h"  # OpenAI 批处理的完成时限
     skip_existing_tests: bool = True  # 是否跳过已存在的测试文件，直接运行和修复
+    coverage_guided_generation: bool = False  # 已有测试时，根据上次覆盖率只为低于阈值的函数补充测试
+    
+    # LLM Token 预算配置
+    llm_context_window: int = 0  # 模型上下文窗口（0 表示根据模型名自动识别）
+    llm_max_output_tokens: int = 65536  # 单次请求允许的最大输出 tokens（DeepSeek API 最大支持 65536）
+    llm_tokens_per_test_case: int = 200  # 估算输出时每个测试用例的平均 tokens
+    
+    # 定时调度（Project.schedule_cron，按 UTC 计算）
+    scheduler_tick_seconds: int = 60  # 检查各项目 cron 的间隔（秒）
+    scheduler_spread_seconds: int = 1800  # 同时触发的项目在该窗口内错峰启动（秒）
+    scheduler_jitter_seconds: int = 60  # 在错峰位置上再加的随机抖动上限（秒）
     
     # 并发配置
     max_concurrent_tasks: int = 5
     celery_worker_concurrency: int = 4
     
+    # Celery 队列路由（interactive / bulk / llm / build / maintenance）
+    celery_interactive_max_files: int = 30  # 手动触发的任务预计源文件数不超过该值时进入 interactive 队列（按上次任务估算）
+    celery_interactive_time_limit: int = 1800  # interactive 队列任务的超时时间（秒）
+    celery_bulk_time_limit: int = 7200  # bulk 队列任务的超时时间（秒）
+    celery_staged_pipeline: bool = False  # 分阶段执行测试生成任务（准备 / 逐文件生成 / 测试提交拆成多个子任务，保存检查点，重试时从最后完成的阶段继续）
+    
+    # 测试修复后台任务
+    fix_job_event_ttl: int = 86400  # 修复任务逐文件事件在 Redis 中的保留时间（秒），过期后从数据库中的最终结果读取
+    fix_job_stream_poll_interval: float = 1.0  # NDJSON 流式接口轮询新事件的间隔（秒）
+    
     @property
     def database_url(self) -> str:
         """获取数据库连接URL"""
@@ -7,13 +7,17 @@ from typing import Optional
 import enum
 
 from app.config import get_settings
+from app.services import analysis_model
 
 
 # 创建异步引擎
 engine = create_async_engine(
     get_settings().database_url,
     echo=True,
-    future=True
+    future=True,
+    # JSON 列中的函数分析结果（检查点中的执行计划等）只保存函数体的字节区间
+    json_serializer=analysis_model.dumps,
+    json_deserializer=analysis_model.loads
 )
 
 # 创建会话工厂
@@ -61,6 +65,25 @@ class TestFramework(str, enum.Enum):
     UNITY = "unity"
 
 
+class BatchStatus(str, enum.Enum):
+    COLLECTING = "collecting"  # 等待收集窗口到期后合并提交
+    SUBMITTED = "submitted"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class FixJobStatus(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class ArtifactStatus(str, enum.Enum):
+    VALIDATED = "validated"  # 生成并通过语法验证
+    FAILED = "failed"
+
+
 # 模型定义
 class Project(Base):
     """项目模型"""
@@ -185,6 +208,109 @@ class TaskLog(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
+class ProjectSchedule(Base):
+    """项目定时调度状态"""
+    __tablename__ = "project_schedules"
+    
+    project_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    schedule_cron: Mapped[Optional[str]] = mapped_column(String(100))  # 计算 last_fire_at 时使用的 cron（修改后重新计算）
+    last_fire_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    last_task_id: Mapped[Optional[str]] = mapped_column(String(36))
+    last_skip_reason: Mapped[Optional[str]] = mapped_column(String(50))  # skipped_unchanged / skipped_active
+    
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class LLMBatch(Base):
+    """LLM 批处理记录（一个任务收集到的生成请求及其结果）"""
+    __tablename__ = "llm_batches"
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    task_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    
+    provider: Mapped[str] = mapped_column(String(50), nullable=False)
+    model: Mapped[str] = mapped_column(String(100), nullable=False)
+    status: Mapped[BatchStatus] = mapped_column(Enum(BatchStatus), default=BatchStatus.COLLECTING)
+    provider_batch_id: Mapped[Optional[str]] = mapped_column(String(100))  # 提供商批次ID（多个任务可能合并在同一批次）
+    
+    # 收集请求时的 commit（恢复时固定到该 commit）
+    commit_hash: Mapped[Optional[str]] = mapped_column(String(40))
+    
+    request_count: Mapped[int] = mapped_column(Integer, default=0)
+    requests: Mapped[Optional[list]] = mapped_column(JSON)
+    results: Mapped[Optional[dict]] = mapped_column(JSON)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    submitted_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class TaskCheckpoint(Base):
+    """任务阶段检查点（分阶段执行时保存各阶段的中间结果，重试时从最后完成的阶段继续）"""
+    __tablename__ = "task_checkpoints"
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    task_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    stage: Mapped[str] = mapped_column(String(50), nullable=False)  # prepare / generate
+    
+    data: Mapped[Optional[dict]] = mapped_column(JSON)
+    
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+
+class GeneratedArtifact(Base):
+    """生成产物（任务为每个源文件生成的测试，生成完成即记录，重试时跳过已成功的文件）"""
+    __tablename__ = "generated_artifacts"
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    task_id: Mapped[str] = mapped_column(String(36), nullable=False)
+    
+    # 源文件（相对仓库根目录）及测试文件后缀（覆盖率补充测试）
+    source_file: Mapped[str] = mapped_column(String(500), nullable=False)
+    test_suffix: Mapped[str] = mapped_column(String(50), default="")
+    source_hash: Mapped[Optional[str]] = mapped_column(String(64))  # 源文件内容变化后不再复用
+    
+    status: Mapped[ArtifactStatus] = mapped_column(Enum(ArtifactStatus), nullable=False)
+    test_file: Mapped[Optional[str]] = mapped_column(String(500))
+    code_path: Mapped[Optional[str]] = mapped_column(String(500))  # 工作目录中保存的测试代码副本
+    attempts: Mapped[int] = mapped_column(Integer, default=0)  # 语法验证尝试次数
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    
+    # 生成成本
+    requests: Mapped[int] = mapped_column(Integer, default=0)
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    cached_prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class FixJob(Base):
+    """测试修复任务（后台执行，逐个文件的结果以事件形式写入 Redis）"""
+    __tablename__ = "fix_jobs"
+    
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    status: Mapped[FixJobStatus] = mapped_column(Enum(FixJobStatus), default=FixJobStatus.PENDING)
+    request: Mapped[dict] = mapped_column(JSON, nullable=False)  # TestFixRequest
+    
+    # 进度
+    total_files: Mapped[int] = mapped_column(Integer, default=0)
+    processed_files: Mapped[int] = mapped_column(Integer, default=0)
+    fixed_files: Mapped[int] = mapped_column(Integer, default=0)
+    failed_files: Mapped[int] = mapped_column(Integer, default=0)
+    skipped_files: Mapped[int] = mapped_column(Integer, default=0)
+    
+    # 完成后的完整结果（TestFixResponse）
+    result: Mapped[Optional[dict]] = mapped_column(JSON)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
 # 数据库初始化
 async def init_db():
     """初始化数据库表"""
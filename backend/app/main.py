@@ -1,7 +1,7 @@
 """FastAPI应用入口"""
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
 from loguru import logger
 import sys
@@ -9,6 +9,9 @@ import sys
 from app.config import get_settings
 from app.database import init_db
 from app.api import projects, tasks, dashboard
+from app.services.metrics import register_queue_collector, render_metrics
+from app.services.task_routing import ALL_QUEUES
+from app.services.tracing import extract_context, init_tracing, start_span
 
 
 # 配置日志
@@ -25,10 +28,15 @@ async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     logger.info("🚀 启动 AI Test Agent...")
     
+    init_tracing("aitest-api")
+    
     # 初始化数据库
     await init_db()
     logger.info("✅ 数据库初始化完成")
     
+    # 采集 Celery 队列长度
+    register_queue_collector(ALL_QUEUES)
+    
     yield
     
     logger.info("👋 关闭 AI Test Agent...")
@@ -52,6 +60,22 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """为每个 HTTP 请求开启 span（上游带 traceparent 时接入上游 trace）"""
+    if request.url.path in ("/metrics", "/health"):
+        return await call_next(request)
+    
+    with start_span(
+        f"{request.method} {request.url.path}",
+        {'http.method': request.method, 'http.target': request.url.path},
+        context=extract_context(dict(request.headers))
+    ) as span:
+        response = await call_next(request)
+        span.set_attribute('http.status_code', response.status_code)
+        return response
+
+
 # WebSocket连接管理器
 class ConnectionManager:
     def __init__(self):
@@ -98,6 +122,13 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 指标"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 @app.websocket("/ws/tasks/{task_id}")
 async def websocket_task_stream(websocket: WebSocket, task_id: str):
     """WebSocket实时任务进度推送"""
@@ -34,6 +34,13 @@ class TestFramework(str, Enum):
     UNITY = "unity"
 
 
+class FixJobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
 # 项目相关Schema
 class ProjectCreate(BaseModel):
     name: str
@@ -96,6 +103,14 @@ class ProjectResponse(BaseModel):
 
 
 # 任务相关Schema
+class TaskCreate(BaseModel):
+    """创建任务请求（可选）"""
+    batch_mode: bool = Field(
+        False,
+        description="批处理模式：生成请求通过提供商的异步批处理接口提交，结果返回后任务自动继续（适合夜间批量任务）"
+    )
+
+
 class TaskResponse(BaseModel):
     id: str
     project_id: str
@@ -214,3 +229,30 @@ class TestFixResponse(BaseModel):
     message: str
     git_result: Optional[GitOperationResult] = None
 
+
+class FixJobResponse(BaseModel):
+    """测试修复任务（完成后 result 为完整的修复结果）"""
+    id: str
+    status: FixJobStatus
+    total_files: int
+    processed_files: int
+    fixed_files: int
+    failed_files: int
+    skipped_files: int
+    result: Optional[TestFixResponse] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+
+class FixJobEventsResponse(BaseModel):
+    """修复任务事件（按偏移量增量读取）"""
+    job_id: str
+    status: FixJobStatus
+    events: List[dict]
+    next_offset: int = Field(..., description="下次读取的偏移量")
+    finished: bool = Field(..., description="任务是否已结束（已读到 completed / failed 事件）")
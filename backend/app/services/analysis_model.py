@@ -0,0 +1,244 @@
+"""代码分析结果的紧凑表示
+
+原来每个函数的分析结果是一个 dict，其中 body 保存解码后的函数体字符串；整个列表随 test_metadata、
+提示词构建、检查点一路传递，上万个函数的仓库中函数体被重复持有，序列化也要写出全部源码。
+
+现在 Go 函数的分析结果是 FunctionInfo（__slots__ 数据类）：
+- 函数体只记录在源文件中的字节区间，同一文件的所有函数共享一个只读内存映射（SourceBuffer）
+- 只有提示词真正需要 body 时才切片解码，用完即释放
+- FunctionInfo 实现 Mapping 接口，原有的 func['name'] / func.get('body', '') 等用法不变
+- 序列化（数据库 JSON 列、Celery 消息）时只写出字节区间和源文件路径（带类型标记），反序列化时重新映射源文件；
+  源文件在此期间被修改时重新分析该文件取得函数体（每个文件版本只分析一次）
+- 源文件不可读或函数已不存在时保留原引用，访问 body 时抛出 SourceUnavailable，不会静默变成空函数体
+"""
+
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from loguru import logger
+
+
+# 进程内缓存的源文件映射数
+SOURCE_BUFFER_CACHE_SIZE = 256
+
+# 序列化后的 FunctionInfo 的类型标记和引用字段
+TYPE_KEY = "__function_info__"
+SPAN_KEY = "body_span"
+SOURCE_KEY = "source_file"
+STAMP_KEY = "source_stamp"
+
+
+class SourceUnavailable(Exception):
+    """反序列化后的函数体无法取得（源文件不可读或函数已不存在）"""
+
+    def __init__(self, path: str, name: str, reason: str):
+        super().__init__(f"无法取得 {name} 的函数体: {path} ({reason})")
+        self.path = path
+        self.name = name
+        self.reason = reason
+
+
+class SourceBuffer:
+    """源文件内容的只读内存映射（同一文件的所有函数共享）"""
+
+    __slots__ = ('path', 'stamp', '_data')
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            # 修改时间 + 大小，用于判断反序列化时源文件是否已变化
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            # 空文件不能映射
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+
+    def read(self) -> bytes:
+        """完整内容（供 tree-sitter 解析，解析后即可释放）"""
+        return bytes(self._data)
+
+    def slice(self, start: int, end: int) -> str:
+        return self._data[start:end].decode('utf-8', errors='replace')
+
+
+_buffers: "OrderedDict[str, SourceBuffer]" = OrderedDict()
+_buffers_lock = threading.Lock()
+
+
+def source_buffer(path: str) -> SourceBuffer:
+    """
+    获取源文件的内存映射（按路径缓存，文件修改后重新映射）
+
+    已淘汰或已过期的映射仍被引用它的 FunctionInfo 持有，不会影响已有的分析结果
+    """
+    stat = os.stat(path)
+    with _buffers_lock:
+        buffer = _buffers.get(path)
+        if buffer is not None and buffer.stamp == (stat.st_mtime_ns, stat.st_size):
+            _buffers.move_to_end(path)
+            return buffer
+
+    buffer = SourceBuffer(path)
+    with _buffers_lock:
+        _buffers[path] = buffer
+        _buffers.move_to_end(path)
+        while len(_buffers) > SOURCE_BUFFER_CACHE_SIZE:
+            _buffers.popitem(last=False)
+    return buffer
+
+
+@dataclass(slots=True, eq=False)
+class FunctionInfo(Mapping):
+    """
+    单个函数/方法的分析结果
+
+    作为 Mapping 使用时的键与原来的 dict 相同：name、type、params、return_type、body、start_line、end_line、
+    complexity、executable_lines，方法还有 receiver
+    """
+
+    name: str
+    type: str = 'function'
+    params: List[str] = field(default_factory=list)
+    return_type: str = ""
+    start_line: int = 0
+    end_line: int = 0
+    complexity: int = 1
+    executable_lines: int = 0
+    receiver: Optional[str] = None
+    # 函数体在源文件中的字节区间
+    source: Optional[SourceBuffer] = None
+    body_start: int = 0
+    body_end: int = 0
+    # 没有源文件映射时（如旧格式的检查点）直接保存的函数体
+    body_text: Optional[str] = None
+    # 反序列化时无法解析的源文件引用（原样写回，访问 body 时报错）
+    unresolved: Optional[Dict] = None
+    unresolved_reason: str = ""
+
+    KEYS = ('name', 'type', 'params', 'return_type', 'body', 'start_line', 'end_line', 'complexity', 'executable_lines')
+
+    @property
+    def body(self) -> str:
+        """函数体（每次访问时从源文件映射中切片）"""
+        if self.body_text is not None:
+            return self.body_text
+        if self.unresolved is not None:
+            raise SourceUnavailable(self.unresolved[SOURCE_KEY], self.name, self.unresolved_reason)
+        if self.source is None:
+            return ""
+        return self.source.slice(self.body_start, self.body_end)
+
+    def _keys(self) -> Tuple[str, ...]:
+        return self.KEYS + ('receiver',) if self.receiver is not None else self.KEYS
+
+    def __getitem__(self, key: str) -> Any:
+        if key == 'body':
+            return self.body
+        if key in self._keys():
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == 'body':
+            self.body_text = value
+        elif key in self.KEYS or key == 'receiver':
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def __repr__(self) -> str:
+        return f"FunctionInfo(name={self.name!r}, type={self.type!r}, lines={self.start_line}-{self.end_line})"
+
+    def to_json(self) -> Dict:
+        """可 JSON 序列化的表示（有源文件映射时只写出函数体的字节区间）"""
+        data = {key: getattr(self, key) for key in self._keys() if key != 'body'}
+        data[TYPE_KEY] = True
+        if self.body_text is not None:
+            data['body'] = self.body_text
+        elif self.unresolved is not None:
+            data.update(self.unresolved)
+        elif self.source is not None:
+            data[SOURCE_KEY] = self.source.path
+            data[STAMP_KEY] = list(self.source.stamp)
+            data[SPAN_KEY] = [self.body_start, self.body_end]
+        else:
+            data['body'] = self.body
+        return data
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "FunctionInfo":
+        """由 to_json 的结果（或原来的函数 dict）还原"""
+        info = cls(**{key: data[key] for key in cls.KEYS + ('receiver',) if key in data and key != 'body'})
+        if SPAN_KEY not in data:
+            info.body_text = data.get('body', "")
+            return info
+
+        path = data[SOURCE_KEY]
+        try:
+            buffer = source_buffer(path)
+        except OSError as e:
+            logger.warning(f"⚠️ 源文件不可读，保留 {info.name} 的函数体引用: {path} ({e})")
+            return info._unresolve(data, str(e))
+
+        if list(buffer.stamp) == list(data.get(STAMP_KEY) or []):
+            info.source = buffer
+            info.body_start, info.body_end = data[SPAN_KEY]
+            return info
+
+        current = _reanalyzed_functions(path, buffer.stamp).get((info.name, info.receiver))
+        if current is None:
+            return info._unresolve(data, "源文件已修改，函数已不存在")
+        info.source = current.source
+        info.body_start, info.body_end = current.body_start, current.body_end
+        info.body_text = current.body_text
+        return info
+
+    def _unresolve(self, data: Dict, reason: str) -> "FunctionInfo":
+        self.unresolved = {key: data[key] for key in (SOURCE_KEY, STAMP_KEY, SPAN_KEY) if key in data}
+        self.unresolved_reason = reason
+        return self
+
+
+@lru_cache(maxsize=SOURCE_BUFFER_CACHE_SIZE)
+def _reanalyzed_functions(path: str, stamp: Tuple[int, int]) -> Dict[Tuple[str, Optional[str]], FunctionInfo]:
+    """重新分析已修改的源文件（按路径和文件版本缓存，同一文件的所有函数只分析一次）"""
+    from app.services.code_analyzer import get_analyzer
+
+    logger.info(f"🔄 {path} 在分析后被修改，重新分析取得函数体")
+    analysis = get_analyzer('golang').analyze_file(path)
+    return {(func['name'], func.get('receiver')): func for func in analysis['functions']}
+
+
+def json_default(obj: Any) -> Any:
+    """json.dumps 的 default：FunctionInfo 写出紧凑表示"""
+    if isinstance(obj, FunctionInfo):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_object_hook(data: Dict) -> Any:
+    """json.loads 的 object_hook：还原带类型标记的 FunctionInfo（兼容不带标记的旧紧凑表示）"""
+    if data.get(TYPE_KEY) or (SPAN_KEY in data and SOURCE_KEY in data):
+        return FunctionInfo.from_json(data)
+    return data
+
+
+def dumps(obj: Any) -> str:
+    """数据库 JSON 列的序列化函数"""
+    return json.dumps(obj, default=json_default)
+
+
+def loads(text: str) -> Any:
+    """数据库 JSON 列的反序列化函数"""
+    return json.loads(text, object_hook=json_object_hook)
@@ -0,0 +1,166 @@
+"""生成产物存储
+
+任务为每个源文件生成测试后立即记录产物（generated_artifacts 表 + 工作目录中的代码副本），
+包括生成的代码、语法验证结果和该文件消耗的 token。任务失败后重试（或批处理恢复）时：
+- 已验证通过且源文件未变化的产物直接复用（测试文件被清理时按副本恢复），不再调用 LLM
+- 没有产物或上次失败的文件重新生成
+
+代码副本保存在 {workspace_dir}/artifacts/{task_id}/ 下，不受仓库 checkout / reset 影响
+"""
+
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+from uuid import uuid4
+from loguru import logger
+
+from app.config import get_settings
+
+
+ARTIFACT_DIR = "artifacts"
+
+
+def source_hash(file_path: str) -> Optional[str]:
+    """源文件内容的哈希（文件不存在时返回 None）"""
+    try:
+        return hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+class ArtifactStore:
+    """单个任务的生成产物"""
+
+    def __init__(self, db, task_id: str):
+        """
+        Args:
+            db: 数据库会话（并发记录时内部加锁）
+            task_id: 任务ID
+        """
+        self.db = db
+        self.task_id = task_id
+        self.repo_path = None
+        self.directory = Path(get_settings().workspace_dir) / ARTIFACT_DIR / task_id
+        self.artifacts: Dict[Tuple[str, str], object] = {}
+        self._lock = asyncio.Lock()
+
+    async def load(self, repo_path: str) -> int:
+        """
+        读取任务已有的产物
+
+        Args:
+            repo_path: 仓库路径（源文件按相对路径对应）
+
+        Returns:
+            已有产物数
+        """
+        from sqlalchemy import select
+        from app.database import ArtifactStatus, GeneratedArtifact
+
+        self.repo_path = repo_path
+        result = await self.db.execute(
+            select(GeneratedArtifact).where(GeneratedArtifact.task_id == self.task_id)
+        )
+        self.artifacts = {
+            (artifact.source_file, artifact.test_suffix or ""): artifact for artifact in result.scalars().all()
+        }
+        if self.artifacts:
+            validated = sum(1 for artifact in self.artifacts.values() if artifact.status == ArtifactStatus.VALIDATED)
+            logger.info(f"📦 任务 {self.task_id} 已有 {len(self.artifacts)} 个生成产物（验证通过 {validated} 个）")
+        return len(self.artifacts)
+
+    def _key(self, file_analysis: Dict) -> Tuple[str, str]:
+        return (
+            os.path.relpath(file_analysis['file_path'], self.repo_path),
+            file_analysis.get('test_suffix') or ""
+        )
+
+    def generated_test_files(self) -> Set[str]:
+        """本任务之前生成的测试文件（不应被当作仓库中已有的测试跳过）"""
+        return {artifact.test_file for artifact in self.artifacts.values() if artifact.test_file}
+
+    def reuse(self, file_analysis: Dict) -> Optional[Dict]:
+        """
+        复用已验证通过的产物
+
+        Returns:
+            与生成结果相同格式的结果；没有可复用的产物时返回 None
+        """
+        from app.database import ArtifactStatus
+
+        artifact = self.artifacts.get(self._key(file_analysis))
+        if artifact is None or artifact.status != ArtifactStatus.VALIDATED or not artifact.code_path:
+            return None
+        if artifact.source_hash != source_hash(file_analysis['file_path']):
+            logger.info(f"🔄 {artifact.source_file} 已修改，重新生成测试")
+            return None
+
+        try:
+            test_code = Path(artifact.code_path).read_text(encoding='utf-8')
+            test_file = Path(artifact.test_file)
+            if not test_file.exists():
+                test_file.parent.mkdir(parents=True, exist_ok=True)
+                test_file.write_text(test_code, encoding='utf-8')
+        except OSError as e:
+            logger.warning(f"⚠️ 读取生成产物失败，重新生成: {artifact.source_file} ({e})")
+            return None
+
+        return {
+            'success': True,
+            'test_file': artifact.test_file,
+            'file_analysis': file_analysis,
+            'test_code': test_code,
+            'validation_attempts': artifact.attempts,
+            'reused': True
+        }
+
+    async def record(self, item: Dict, usage: Dict) -> None:
+        """
+        记录一个源文件的生成结果（记录失败不影响生成）
+
+        Args:
+            item: 生成结果 {'success', 'file_analysis', 'test_file', 'test_code', 'error', 'validation_attempts'}
+            usage: 该文件的 LLM 用量
+        """
+        from app.database import ArtifactStatus, GeneratedArtifact
+
+        file_analysis = item['file_analysis']
+        source_file, test_suffix = self._key(file_analysis)
+
+        async with self._lock:
+            try:
+                code_path = None
+                if item['success']:
+                    name = hashlib.sha1(f"{source_file}{test_suffix}".encode('utf-8')).hexdigest()[:16]
+                    code_path = self.directory / f"{name}{Path(item['test_file']).suffix}"
+                    code_path.parent.mkdir(parents=True, exist_ok=True)
+                    code_path.write_text(item['test_code'], encoding='utf-8')
+
+                artifact = self.artifacts.get((source_file, test_suffix))
+                if artifact is None:
+                    artifact = GeneratedArtifact(
+                        id=str(uuid4()),
+                        task_id=self.task_id,
+                        source_file=source_file,
+                        test_suffix=test_suffix
+                    )
+                    self.db.add(artifact)
+                    self.artifacts[(source_file, test_suffix)] = artifact
+
+                artifact.source_hash = source_hash(file_analysis['file_path'])
+                artifact.status = ArtifactStatus.VALIDATED if item['success'] else ArtifactStatus.FAILED
+                artifact.test_file = item.get('test_file')
+                artifact.code_path = str(code_path) if code_path else None
+                artifact.attempts = item.get('validation_attempts') or 0
+                artifact.error = item.get('error')
+                artifact.requests = usage.get('requests', 0)
+                artifact.prompt_tokens = usage.get('prompt_tokens', 0)
+                artifact.cached_prompt_tokens = usage.get('cached_prompt_tokens', 0)
+                artifact.completion_tokens = usage.get('completion_tokens', 0)
+                await self.db.commit()
+
+            except Exception as e:
+                logger.warning(f"⚠️ 记录生成产物失败: {source_file} ({e})")
+                await self.db.rollback()
@@ -0,0 +1,66 @@
+"""任务阶段检查点
+
+分阶段执行（celery_staged_pipeline）时，测试生成任务拆成多个 Celery 子任务：
+1. prepare: 克隆、分析、确定需要生成测试的源文件，执行计划保存为 prepare 检查点
+2. generate: 每个源文件一个子任务（chord 并发分布到各 worker），结果汇总后保存为 generate 检查点
+3. finish: 执行测试、修复、收集覆盖率、提交
+
+worker 崩溃或回收后子任务重新投递（acks_late），任务重试时从最后一个检查点继续，
+已完成的阶段不再重复执行。任务成功后清除检查点
+"""
+
+from typing import Any, Optional
+from uuid import uuid4
+from loguru import logger
+
+
+STAGE_PREPARE = "prepare"
+STAGE_GENERATE = "generate"
+
+
+async def save_checkpoint(db, task_id: str, stage: str, data: Any) -> None:
+    """
+    保存阶段检查点（同一阶段只保留最新一份）
+
+    Args:
+        db: 数据库会话
+        task_id: 任务ID
+        stage: 阶段名称
+        data: 阶段结果（必须可 JSON 序列化）
+    """
+    from sqlalchemy import delete
+    from app.database import TaskCheckpoint
+
+    await db.execute(
+        delete(TaskCheckpoint).where(TaskCheckpoint.task_id == task_id, TaskCheckpoint.stage == stage)
+    )
+    db.add(TaskCheckpoint(id=str(uuid4()), task_id=task_id, stage=stage, data={'value': data}))
+    await db.commit()
+    logger.info(f"💾 任务 {task_id} 保存检查点: {stage}")
+
+
+async def load_checkpoint(db, task_id: str, stage: str) -> Optional[Any]:
+    """读取阶段检查点（不存在时返回 None）"""
+    from sqlalchemy import select
+    from app.database import TaskCheckpoint
+
+    result = await db.execute(
+        select(TaskCheckpoint)
+        .where(TaskCheckpoint.task_id == task_id, TaskCheckpoint.stage == stage)
+        .order_by(TaskCheckpoint.created_at.desc())
+        .limit(1)
+    )
+    checkpoint = result.scalar_one_or_none()
+    return checkpoint.data['value'] if checkpoint else None
+
+
+async def clear_checkpoints(db, task_id: str, stage: Optional[str] = None) -> None:
+    """清除任务的检查点（不指定阶段时清除全部）"""
+    from sqlalchemy import delete
+    from app.database import TaskCheckpoint
+
+    statement = delete(TaskCheckpoint).where(TaskCheckpoint.task_id == task_id)
+    if stage:
+        statement = statement.where(TaskCheckpoint.stage == stage)
+    await db.execute(statement)
+    await db.commit()
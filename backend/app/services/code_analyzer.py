@@ -6,6 +6,8 @@ from loguru import logger
 import tree_sitter_languages
 from tree_sitter import Language, Parser
 
+from app.services.analysis_model import FunctionInfo, SourceBuffer, source_buffer
+
 
 class CodeAnalyzer:
     """代码分析器基类"""
@@ -39,14 +41,14 @@ class GolangAnalyzer(CodeAnalyzer):
         Returns:
             {
                 'file_path': str,
-                'functions': List[Dict],
+                'functions': List[FunctionInfo],  # 函数体引用源文件映射，按需切片
                 'structs': List[Dict],
                 'interfaces': List[Dict]
             }
         """
         try:
-            with open(file_path, 'rb') as f:
-                code = f.read()
+            source = source_buffer(file_path)
+            code = source.read()
             
             tree = self.parser.parse(code)
             root_node = tree.root_node
@@ -58,10 +60,10 @@ class GolangAnalyzer(CodeAnalyzer):
             # 遍历AST节点
             for node in root_node.children:
                 if node.type == 'function_declaration':
-                    func_info = self._extract_function(node, code)
+                    func_info = self._extract_function(node, code, source)
                     functions.append(func_info)
                 elif node.type == 'method_declaration':
-                    method_info = self._extract_method(node, code)
+                    method_info = self._extract_method(node, code, source)
                     functions.append(method_info)
                 elif node.type == 'type_declaration':
                     # 可能是struct或interface
@@ -97,8 +99,8 @@ class GolangAnalyzer(CodeAnalyzer):
                     return code[package_name.start_byte:package_name.end_byte].decode()
         return ""
     
-    def _extract_function(self, node, code: bytes) -> Dict:
-        """提取函数信息"""
+    def _extract_function(self, node, code: bytes, source: Optional[SourceBuffer] = None) -> FunctionInfo:
+        """提取函数信息（函数体只记录字节区间，复杂度等统计在提取时计算）"""
         name_node = node.child_by_field_name('name')
         name = code[name_node.start_byte:name_node.end_byte].decode() if name_node else ""
         
@@ -115,29 +117,35 @@ class GolangAnalyzer(CodeAnalyzer):
             return_type = code[result_node.start_byte:result_node.end_byte].decode()
         
         body_node = node.child_by_field_name('body')
-        body = code[body_node.start_byte:body_node.end_byte].decode() if body_node else ""
-        
-        return {
-            'name': name,
-            'type': 'function',
-            'params': params,
-            'return_type': return_type,
-            'body': body,
-            'start_line': node.start_point[0],
-            'end_line': node.end_point[0],
-            'complexity': self._calculate_complexity(body),
-            'executable_lines': self._count_executable_lines(body)
-        }
+        body_start, body_end = (body_node.start_byte, body_node.end_byte) if body_node else (0, 0)
+        body = code[body_start:body_end].decode(errors='replace')
+        
+        func_info = FunctionInfo(
+            name=name,
+            type='function',
+            params=params,
+            return_type=return_type,
+            start_line=node.start_point[0],
+            end_line=node.end_point[0],
+            complexity=self._calculate_complexity(body),
+            executable_lines=self._count_executable_lines(body),
+            source=source,
+            body_start=body_start,
+            body_end=body_end
+        )
+        if source is None:
+            func_info.body_text = body
+        return func_info
     
-    def _extract_method(self, node, code: bytes) -> Dict:
+    def _extract_method(self, node, code: bytes, source: Optional[SourceBuffer] = None) -> FunctionInfo:
         """提取方法信息"""
-        func_info = self._extract_function(node, code)
-        func_info['type'] = 'method'
+        func_info = self._extract_function(node, code, source)
+        func_info.type = 'method'
         
         # 提取接收者
         receiver_node = node.child_by_field_name('receiver')
         if receiver_node:
-            func_info['receiver'] = code[receiver_node.start_byte:receiver_node.end_byte].decode()
+            func_info.receiver = code[receiver_node.start_byte:receiver_node.end_byte].decode()
         
         return func_info
     
@@ -0,0 +1,110 @@
+"""覆盖率引导生成模块
+
+根据上一次任务的函数级覆盖率（CoverageReport.files_coverage），
+筛选出覆盖率低于项目阈值的函数，只为这些函数补充测试
+"""
+
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+from loguru import logger
+
+
+# 覆盖率补充测试文件的后缀（例如 user.go -> user_coverage_test.go）
+COVERAGE_TEST_SUFFIX = "coverage"
+
+
+def supplement_suffix(round_number: int) -> str:
+    """
+    第 round_number 轮覆盖率补充测试的文件后缀
+
+    每轮补充测试写入单独的文件（user_coverage_test.go、user_coverage_2_test.go ...），
+    不覆盖之前各轮为未覆盖代码生成的测试；测试函数名也带同样的后缀，不会重复声明
+    """
+    return COVERAGE_TEST_SUFFIX if round_number <= 1 else f"{COVERAGE_TEST_SUFFIX}_{round_number}"
+
+
+class CoverageGuide:
+    """覆盖率引导器"""
+
+    # go tool cover -func 的条目格式: github.com/org/repo/internal/biz/user.go:25:
+    _ENTRY_PATTERN = re.compile(r'^(?P<path>.+?):(?P<line>\d+)(?::\d+)?:?$')
+
+    def __init__(self, files_coverage: Dict[str, float], threshold: float = 80.0):
+        """
+        初始化覆盖率引导器
+
+        Args:
+            files_coverage: 上一次任务解析出的覆盖率数据（键为 "文件路径:行号:"，值为百分比）
+            threshold: 覆盖率阈值（百分比），低于该值的函数需要补充测试
+        """
+        self.threshold = threshold
+        self._index = self._build_index(files_coverage or {})
+        logger.info(f"📈 覆盖率引导已启用: {len(self._index)} 个文件有历史覆盖率数据，阈值 {threshold}%")
+
+    def _build_index(self, files_coverage: Dict[str, float]) -> Dict[str, Dict[int, float]]:
+        """
+        构建 文件路径 -> {函数起始行号: 覆盖率} 的索引
+
+        Args:
+            files_coverage: 原始覆盖率数据
+
+        Returns:
+            覆盖率索引
+        """
+        index: Dict[str, Dict[int, float]] = {}
+
+        for entry, coverage in files_coverage.items():
+            match = self._ENTRY_PATTERN.match(entry.strip())
+            if not match:
+                continue
+
+            try:
+                line = int(match.group('line'))
+                value = float(coverage)
+            except (TypeError, ValueError):
+                continue
+
+            index.setdefault(match.group('path'), {})[line] = value
+
+        return index
+
+    def _find_file_entries(self, relative_path: str) -> Optional[Dict[int, float]]:
+        """按相对路径查找文件的覆盖率条目（覆盖率中的路径带有模块前缀）"""
+        relative_path = relative_path.replace('\\', '/')
+        for path, entries in self._index.items():
+            if path == relative_path or path.endswith('/' + relative_path):
+                return entries
+        return None
+
+    def select_uncovered_functions(self, file_analysis: Dict, repo_path: str) -> Optional[List[Dict]]:
+        """
+        筛选出覆盖率低于阈值的函数
+
+        Args:
+            file_analysis: 文件分析结果
+            repo_path: 仓库根目录（用于计算相对路径）
+
+        Returns:
+            需要补充测试的函数列表；如果没有该文件的历史覆盖率数据则返回 None
+        """
+        file_path = file_analysis.get('file_path', '')
+        try:
+            relative_path = str(Path(file_path).relative_to(repo_path))
+        except ValueError:
+            relative_path = Path(file_path).name
+
+        entries = self._find_file_entries(relative_path)
+        if entries is None:
+            logger.debug(f"没有 {relative_path} 的历史覆盖率数据")
+            return None
+
+        uncovered = []
+        for func in file_analysis.get('functions', []):
+            # tree-sitter 的行号从0开始，go tool cover 的行号从1开始
+            coverage = entries.get(func.get('start_line', -1) + 1, 0.0)
+            if coverage < self.threshold:
+                uncovered.append(func)
+                logger.debug(f"  {func.get('name', '')}: {coverage}% < {self.threshold}%")
+
+        return uncovered
@@ -0,0 +1,352 @@
+"""失败聚类模块
+
+公共依赖变化或公共导入写错时，多个测试文件会报出相同的编译错误。这里把编译器 / gofmt
+的错误信息去掉文件名、行号和列号后作为错误签名，按签名把失败的文件聚成簇：
+- 每簇只调用一次 AI 修复（簇首文件），把修复前后的差异提炼为补丁，直接应用到簇内其他文件
+- 验证通过的补丁按 语言 + 签名 缓存到 Redis，后续任务遇到相同签名时不再调用 AI
+
+只有编译类错误（带 文件:行:列 的编译器/gofmt 信息、链接错误）参与聚类，
+断言失败等运行期错误与具体测试相关，仍然逐个文件修复
+"""
+
+import difflib
+import hashlib
+import json
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from loguru import logger
+
+from app.config import get_settings
+from app.services.metrics import CACHE_REQUESTS
+
+
+# Redis 键前缀
+KEY_PREFIX = "aitest:fix_patterns"
+
+# Redis 不可用后，多久再尝试重连（秒）
+REDIS_RETRY_INTERVAL = 30
+
+# 参与签名计算的最多错误条数（编译器后续的连带错误意义不大）
+MAX_SIGNATURE_MESSAGES = 5
+
+# 补丁最多包含的修改块数和修改行数，超过说明 AI 重写了整个文件，无法推广到其他文件
+MAX_PATCH_HUNKS = 8
+MAX_PATCH_LINES = 40
+
+# 编译器 / gofmt 错误: path/to/file.go:12:5: message（gofmt 从标准输入读取时为 <standard input>）
+_COMPILER_LINE_RE = re.compile(
+    r'(?P<path>[^\s:]+?\.(?:go|c|cc|cpp|cxx|h|hpp)|<standard input>):(?P<line>\d+):(?P<column>\d+):\s*(?P<message>.+)'
+)
+# 链接错误: undefined reference to `symbol'
+_LINKER_LINE_RE = re.compile(r"undefined reference to\s*(?P<symbol>\S+)")
+
+# 归一化时去掉的易变部分
+_PATH_RE = re.compile(r'(?<![\w."])\.{0,2}/(?:[\w.~+-]+/)*(?P<name>[\w.+-]+)')
+_HEX_RE = re.compile(r'\b0x[0-9a-fA-F]+\b')
+_DURATION_RE = re.compile(r'\(\d+(?:\.\d+)?m?s\)')
+
+
+def normalize_message(message: str) -> str:
+    """去掉错误信息中的路径目录、地址和耗时，只保留与根因相关的部分"""
+    message = _PATH_RE.sub(lambda m: m.group('name'), message)
+    message = _HEX_RE.sub('0x?', message)
+    message = _DURATION_RE.sub('', message)
+    return ' '.join(message.split())
+
+
+def parse_compiler_errors(output: str, file_name: Optional[str] = None) -> List[Dict]:
+    """
+    从编译器 / gofmt / go test 输出中解析编译类错误（不含警告和提示）
+
+    Args:
+        output: 命令输出或错误列表拼接的文本
+        file_name: 只保留该文件（文件名）的错误；为空时保留所有文件的错误
+
+    Returns:
+        错误列表，每条: {'path', 'line', 'column', 'message'}（链接错误没有路径和行号）
+    """
+    errors = []
+    for line in output.splitlines():
+        match = _COMPILER_LINE_RE.search(line)
+        if match:
+            if file_name and Path(match.group('path')).name != file_name:
+                continue
+            message = match.group('message').strip()
+            # gcc 的警告和提示不是失败原因
+            if message.startswith(('warning:', 'note:')) or message.startswith('too many errors'):
+                continue
+            errors.append({
+                'path': match.group('path'),
+                'line': int(match.group('line')),
+                'column': int(match.group('column')),
+                'message': message
+            })
+            continue
+
+        match = _LINKER_LINE_RE.search(line)
+        if match:
+            errors.append({
+                'path': None,
+                'line': None,
+                'column': None,
+                'message': f"undefined reference to {match.group('symbol')}"
+            })
+    return errors
+
+
+def extract_error_messages(output: str, file_name: Optional[str] = None) -> List[str]:
+    """
+    从编译器 / gofmt / go test 输出中提取归一化后的错误信息（去重并保持出现顺序）
+
+    Args:
+        output: 命令输出或错误列表拼接的文本
+        file_name: 只保留该文件（文件名）的错误；为空时保留所有文件的错误
+
+    Returns:
+        归一化后的错误信息列表
+    """
+    messages = []
+    for error in parse_compiler_errors(output, file_name):
+        message = normalize_message(error['message'])
+        if message and message not in messages:
+            messages.append(message)
+    return messages
+
+
+def error_signature(messages: List[str]) -> str:
+    """由归一化后的错误信息计算签名（与错误出现的位置和顺序无关）"""
+    if not messages:
+        return ""
+    key = "\n".join(sorted(messages[:MAX_SIGNATURE_MESSAGES]))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def cluster_failures(failures: Dict[str, str], match_file_name: bool = True) -> List[Dict]:
+    """
+    按错误签名聚类失败的文件
+
+    Args:
+        failures: {文件路径: 失败输出}
+        match_file_name: 输出中包含多个文件的错误时（如 go test 的包级输出），只取该文件自己的错误
+
+    Returns:
+        簇列表（按文件数从多到少），每簇: {'signature', 'messages', 'files'}；
+        没有编译类错误的文件不在任何簇中
+    """
+    clusters: Dict[str, Dict] = {}
+    for file_path, output in failures.items():
+        file_name = Path(file_path).name if match_file_name else None
+        messages = extract_error_messages(output or "", file_name)
+        signature = error_signature(messages)
+        if not signature:
+            continue
+        cluster = clusters.setdefault(signature, {'signature': signature, 'messages': messages, 'files': []})
+        cluster['files'].append(file_path)
+
+    return sorted(clusters.values(), key=lambda c: len(c['files']), reverse=True)
+
+
+def learn_patch(before: str, after: str) -> List[Dict]:
+    """
+    把一次修复提炼为补丁（逐行差异）
+
+    Returns:
+        修改块列表，每块: {'remove': 删除的行, 'add': 新增的行, 'anchor': 修改位置前一行}；
+        修改过多（AI 重写了整个文件）时返回空列表
+    """
+    old_lines = before.splitlines()
+    new_lines = after.splitlines()
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+
+    hunks = []
+    changed = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        remove = old_lines[i1:i2]
+        add = new_lines[j1:j2]
+        # 只有空白行的改动不影响编译
+        if not any(line.strip() for line in remove + add):
+            continue
+        hunks.append({'remove': remove, 'add': add, 'anchor': old_lines[i1 - 1] if i1 > 0 else ""})
+        changed += len(remove) + len(add)
+
+    if len(hunks) > MAX_PATCH_HUNKS or changed > MAX_PATCH_LINES:
+        return []
+    return hunks
+
+
+def _find_block(lines: List[str], block: List[str], start: int = 0) -> Optional[int]:
+    """忽略缩进查找连续的若干行，返回起始行号"""
+    target = [line.strip() for line in block]
+    for i in range(start, len(lines) - len(target) + 1):
+        if [line.strip() for line in lines[i:i + len(target)]] == target:
+            return i
+    return None
+
+
+def _reindent(lines: List[str], old_indent: str, new_indent: str) -> List[str]:
+    """把补丁中的缩进换成目标文件对应位置的缩进"""
+    if old_indent == new_indent:
+        return list(lines)
+    return [
+        new_indent + line[len(old_indent):] if line.startswith(old_indent) else line
+        for line in lines
+    ]
+
+
+def _indent_of(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def apply_patch(code: str, hunks: List[Dict]) -> Optional[str]:
+    """
+    把补丁应用到另一个文件（按内容而不是行号定位，忽略缩进差异）
+
+    删除的行在目标文件中不存在、或要新增的行已经存在的修改块会被跳过
+
+    Returns:
+        应用后的代码；没有任何修改块可以应用时返回 None
+    """
+    lines = code.splitlines()
+    applied = 0
+
+    for hunk in hunks:
+        remove, add = hunk['remove'], hunk['add']
+        remove_content = [line for line in remove if line.strip()]
+
+        if remove_content:
+            index = _find_block(lines, remove)
+            if index is None:
+                continue
+            new_block = _reindent(add, _indent_of(remove[0]), _indent_of(lines[index]))
+            lines[index:index + len(remove)] = new_block
+            applied += 1
+            continue
+
+        # 纯新增（如补充 import）：已经存在则跳过，否则插入到锚点行之后
+        if _find_block(lines, add) is not None:
+            continue
+        if not hunk['anchor'].strip():
+            lines[0:0] = add
+            applied += 1
+            continue
+        index = _find_block(lines, [hunk['anchor']])
+        if index is None:
+            continue
+        lines[index + 1:index + 1] = _reindent(add, _indent_of(hunk['anchor']), _indent_of(lines[index]))
+        applied += 1
+
+    if not applied:
+        return None
+    patched = "\n".join(lines)
+    return patched + "\n" if code.endswith("\n") else patched
+
+
+class FixPatternCache:
+    """已验证的修复补丁缓存（按 语言 + 错误签名，所有 worker 通过 Redis 共享）
+
+    Redis 不可用时退化为进程内缓存，只在当前进程的后续任务中复用
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.settings = get_settings()
+        self._local: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_retry_at = 0.0
+
+    def _get_redis(self):
+        """获取 Redis 客户端（失败后一段时间内只使用进程内缓存）"""
+        if self._redis is not None:
+            return self._redis
+        if time.monotonic() < self._redis_retry_at:
+            return None
+
+        try:
+            import redis
+            client = redis.Redis.from_url(self.settings.redis_url, socket_timeout=2, socket_connect_timeout=2)
+            client.ping()
+            self._redis = client
+        except Exception as e:
+            self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+            logger.warning(f"⚠️ Redis 不可用，修复补丁只缓存在进程内: {e}")
+        return self._redis
+
+    def _drop_redis(self, error: Exception):
+        logger.warning(f"⚠️ 修复补丁缓存读写 Redis 出错: {error}")
+        self._redis = None
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+
+    @staticmethod
+    def _key(language: str, signature: str) -> str:
+        return f"{KEY_PREFIX}:{language}:{signature}"
+
+    def get(self, language: str, signature: str) -> Optional[List[Dict]]:
+        """查询已验证的补丁，没有时返回 None"""
+        key = self._key(language, signature)
+        hunks = None
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                value = client.get(key)
+                if value:
+                    hunks = json.loads(value)['hunks']
+            except Exception as e:
+                self._drop_redis(e)
+
+        if hunks is None:
+            with self._lock:
+                entry = self._local.get(key)
+                if entry and entry[0] > time.time():
+                    hunks = entry[1]
+
+        CACHE_REQUESTS.labels(cache="fix_pattern", result="hit" if hunks else "miss").inc()
+        return hunks
+
+    def put(self, language: str, signature: str, hunks: List[Dict], messages: List[str]):
+        """缓存验证通过的补丁"""
+        key = self._key(language, signature)
+        with self._lock:
+            self._local[key] = (time.time() + self.ttl, hunks)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                value = json.dumps({'hunks': hunks, 'messages': messages}, ensure_ascii=False)
+                client.setex(key, self.ttl, value)
+            except Exception as e:
+                self._drop_redis(e)
+        logger.info(f"💾 已缓存修复补丁: {signature} ({messages[0] if messages else ''})")
+
+    def discard(self, language: str, signature: str):
+        """缓存的补丁应用后验证失败时删除，避免后续任务反复使用"""
+        key = self._key(language, signature)
+        with self._lock:
+            self._local.pop(key, None)
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                client.delete(key)
+            except Exception as e:
+                self._drop_redis(e)
+
+
+_fix_pattern_cache: Optional[FixPatternCache] = None
+_fix_pattern_cache_lock = threading.Lock()
+
+
+def get_fix_pattern_cache() -> FixPatternCache:
+    """获取进程级修复补丁缓存"""
+    global _fix_pattern_cache
+    with _fix_pattern_cache_lock:
+        if _fix_pattern_cache is None:
+            _fix_pattern_cache = FixPatternCache(get_settings().fix_pattern_cache_ttl)
+        return _fix_pattern_cache
+
@@ -0,0 +1,193 @@
+"""测试修复后台任务
+
+POST /api/tasks/fix-tests 不再在 API 进程中等待修复完成，而是创建修复任务投递到 Celery（interactive 队列），
+与测试生成任务共用 worker 的并发和限流配置：
+- worker 每修复完一个文件，向 Redis 列表追加一条事件（started / file / completed / failed），
+  同时把进度计数写回 fix_jobs 表
+- 客户端按偏移量增量读取事件，或通过 NDJSON 流式接口实时接收
+- 事件过期（fix_job_event_ttl）后，由数据库中保存的最终结果还原
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+from uuid import uuid4
+from loguru import logger
+
+from app.config import get_settings
+
+
+KEY_PREFIX = "aitest:fix_job"
+
+# 修复任务结束的事件类型
+TERMINAL_EVENTS = ("completed", "failed")
+
+
+def events_key(job_id: str) -> str:
+    return f"{KEY_PREFIX}:{job_id}:events"
+
+
+async def create_fix_job(db, request: Dict):
+    """
+    创建修复任务（由 API 调用，随后投递 run_fix_tests_job）
+
+    Args:
+        db: 数据库会话
+        request: TestFixRequest 的内容
+    """
+    from app.database import FixJob, FixJobStatus
+
+    job = FixJob(id=str(uuid4()), status=FixJobStatus.PENDING, request=request)
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+async def load_fix_job(db, job_id: str):
+    """读取修复任务（不存在时返回 None）"""
+    from sqlalchemy import select
+    from app.database import FixJob
+
+    result = await db.execute(select(FixJob).where(FixJob.id == job_id))
+    return result.scalar_one_or_none()
+
+
+class FixJobReporter:
+    """
+    记录修复进度（在 worker 中作为 TestFixer 的事件回调）
+
+    事件写入失败（Redis 不可用）不影响修复，客户端仍可从数据库读取进度和最终结果
+    """
+
+    def __init__(self, db, job):
+        self.db = db
+        self.job = job
+        self.settings = get_settings()
+        self._redis = None
+        self._lock = asyncio.Lock()
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis
+            self._redis = redis.Redis.from_url(self.settings.redis_url, socket_timeout=2, socket_connect_timeout=2)
+        return self._redis
+
+    def publish(self, event: Dict) -> None:
+        """追加一条事件"""
+        event = {'job_id': self.job.id, 'time': datetime.utcnow().isoformat(), **event}
+        try:
+            client = self._get_redis()
+            key = events_key(self.job.id)
+            pipe = client.pipeline(transaction=False)
+            pipe.rpush(key, json.dumps(event, ensure_ascii=False))
+            pipe.expire(key, self.settings.fix_job_event_ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ 写入修复任务事件失败: {e}")
+
+    async def start(self) -> None:
+        from app.database import FixJobStatus
+
+        self.job.status = FixJobStatus.RUNNING
+        self.job.started_at = datetime.utcnow()
+        await self.db.commit()
+
+    async def __call__(self, event: Dict) -> None:
+        """TestFixer 的事件回调（多个文件并发完成，内部加锁）"""
+        async with self._lock:
+            if event['type'] == "started":
+                self.job.total_files = event['total_files']
+            elif event['type'] == "file":
+                result = event['result']
+                self.job.processed_files += 1
+                if not result['success']:
+                    self.job.failed_files += 1
+                elif result['fixed']:
+                    self.job.fixed_files += 1
+                else:
+                    self.job.skipped_files += 1
+            self.publish(event)
+            try:
+                await self.db.commit()
+            except Exception as e:
+                logger.warning(f"⚠️ 更新修复任务进度失败: {e}")
+                await self.db.rollback()
+
+    async def complete(self, result: Dict) -> None:
+        """保存最终结果（逐文件结果已作为事件发送，完成事件中不再重复）"""
+        from app.database import FixJobStatus
+
+        self.job.status = FixJobStatus.COMPLETED
+        self.job.total_files = result['total_files']
+        self.job.fixed_files = result['fixed_files']
+        self.job.failed_files = result['failed_files']
+        self.job.skipped_files = result['skipped_files']
+        self.job.result = result
+        self.job.completed_at = datetime.utcnow()
+        await self.db.commit()
+        self.publish({'type': "completed", 'result': {k: v for k, v in result.items() if k != 'file_results'}})
+
+    async def fail(self, error: Exception) -> None:
+        from app.database import FixJobStatus
+
+        self.job.status = FixJobStatus.FAILED
+        self.job.error = str(error)
+        self.job.completed_at = datetime.utcnow()
+        await self.db.commit()
+        self.publish({'type': "failed", 'error': str(error)})
+
+
+def _events_from_result(job) -> List[Dict]:
+    """事件过期后由数据库中的最终结果还原事件序列"""
+    from app.database import FixJobStatus
+
+    if job.status == FixJobStatus.FAILED:
+        return [{'job_id': job.id, 'type': "failed", 'error': job.error}]
+    if job.status != FixJobStatus.COMPLETED or not job.result:
+        return []
+
+    file_results = job.result.get('file_results') or []
+    events = [{'job_id': job.id, 'type': "started", 'total_files': job.result['total_files']}]
+    events += [
+        {'job_id': job.id, 'type': "file", 'index': index, 'total_files': len(file_results), 'result': result}
+        for index, result in enumerate(file_results, 1)
+    ]
+    events.append({
+        'job_id': job.id,
+        'type': "completed",
+        'result': {k: v for k, v in job.result.items() if k != 'file_results'}
+    })
+    return events
+
+
+async def read_events(job, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    """
+    读取修复任务从 offset 开始的事件
+
+    Args:
+        job: 修复任务
+        offset: 已读取的事件数
+        limit: 最多读取的事件数（为空时读取全部）
+    """
+    settings = get_settings()
+    events = None
+    try:
+        import redis.asyncio as aioredis
+        client = aioredis.Redis.from_url(settings.redis_url, socket_timeout=2, socket_connect_timeout=2)
+        try:
+            key = events_key(job.id)
+            if await client.exists(key):
+                end = -1 if limit is None else offset + limit - 1
+                events = [json.loads(item) for item in await client.lrange(key, offset, end)]
+        finally:
+            await client.close()
+    except Exception as e:
+        logger.warning(f"⚠️ 读取修复任务事件失败: {e}")
+
+    if events is None:
+        events = _events_from_result(job)[offset:]
+        if limit is not None:
+            events = events[:limit]
+    return events
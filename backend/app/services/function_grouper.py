@@ -0,0 +1,153 @@
+"""函数分组模块
+
+分批生成测试时，按 token 估算和共享的接收者/结构体把函数装箱分组：
+- 小函数（getter/setter 等）合并到同一个请求，避免重复发送套件模板和上下文
+- 大函数单独成组，避免单个请求负载过重
+- 同一接收者、或参数/返回值引用同一结构体的函数优先放在一起，共享类型定义上下文
+"""
+
+import re
+from typing import Dict, List, Optional
+from loguru import logger
+
+from app.config import get_settings
+from app.services.token_budget import TokenBudget
+
+
+class FunctionGrouper:
+    """函数分组器（First-Fit Decreasing 装箱）"""
+
+    def __init__(self, token_budget: TokenBudget):
+        """
+        初始化函数分组器
+
+        Args:
+            token_budget: Token 预算计算器
+        """
+        settings = get_settings()
+        self.token_budget = token_budget
+
+        # 每组的 token 容量（函数体输入 + 预期输出），不超过模型输入预算的一半
+        self.group_token_budget = min(
+            settings.batch_group_token_budget,
+            max(1000, token_budget.input_budget() // 2)
+        )
+        self.max_group_functions = settings.batch_group_max_functions
+
+    def _receiver_type(self, func: Dict) -> Optional[str]:
+        """从接收者声明中提取类型名，如 (u *User) -> User，(s *Store[T]) -> Store"""
+        receiver = func.get('receiver', '')
+        if not receiver:
+            return None
+        match = re.search(r'\*?\s*([A-Za-z_]\w*)\s*(?:\[[^\]]*\])?\s*\)?\s*$', receiver.strip().rstrip(')'))
+        return match.group(1) if match else None
+
+    def _referenced_types(self, func: Dict, type_names: List[str]) -> List[str]:
+        """查找函数签名（接收者、参数、返回值）中引用到的本文件类型"""
+        signature = ' '.join([
+            func.get('receiver', ''),
+            ' '.join(func.get('params', [])),
+            func.get('return_type', '')
+        ])
+        return [name for name in type_names if re.search(rf'\b{re.escape(name)}\b', signature)]
+
+    def _group_key(self, func: Dict, type_names: List[str]) -> str:
+        """分组键：方法按接收者类型；普通函数按签名中首个引用的本文件结构体（如构造函数）"""
+        receiver_type = self._receiver_type(func)
+        if receiver_type:
+            return receiver_type
+        referenced = self._referenced_types(func, type_names)
+        return referenced[0] if referenced else ''
+
+    def estimate_function_tokens(self, func: Dict) -> int:
+        """估算单个函数在请求中占用的 token 数（函数体输入 + 预期测试输出）"""
+        input_tokens = self.token_budget.count(func.get('body', '')) + 50  # 签名和说明行
+        output_tokens = (
+            self.token_budget.estimate_test_output_tokens({'functions': [func]})
+            - self.token_budget.output_overhead_tokens
+        )
+        return input_tokens + output_tokens
+
+    def _pack(self, items: List[Dict]) -> List[Dict]:
+        """
+        First-Fit Decreasing 装箱
+
+        Args:
+            items: [{'indices': [...], 'tokens': int}]，indices 为函数在源文件中的序号
+
+        Returns:
+            装箱后的分组（结构同 items）
+        """
+        bins: List[Dict] = []
+        for item in sorted(items, key=lambda x: x['tokens'], reverse=True):
+            for bin_ in bins:
+                if (bin_['tokens'] + item['tokens'] <= self.group_token_budget
+                        and len(bin_['indices']) + len(item['indices']) <= self.max_group_functions):
+                    bin_['indices'].extend(item['indices'])
+                    bin_['tokens'] += item['tokens']
+                    break
+            else:
+                bins.append({'indices': list(item['indices']), 'tokens': item['tokens']})
+        return bins
+
+    def group(self, file_analysis: Dict) -> List[Dict]:
+        """
+        将文件中的函数分组
+
+        Args:
+            file_analysis: 文件分析结果（包含 functions / structs / interfaces）
+
+        Returns:
+            分组列表（按源码顺序），每组包含:
+                - functions: 组内函数（按源码顺序）
+                - types: 组内函数引用到的结构体/接口定义
+                - key: 分组依据（接收者或结构体名，空字符串表示普通函数）
+                - estimated_tokens: 估算 token 数
+        """
+        functions = file_analysis.get('functions', [])
+        types = file_analysis.get('structs', []) + file_analysis.get('interfaces', [])
+        type_names = [t['name'] for t in types if t.get('name')]
+
+        # 1. 同一接收者/结构体的函数先各自装箱
+        keyed: Dict[str, List[Dict]] = {}
+        for idx, func in enumerate(functions):
+            key = self._group_key(func, type_names)
+            keyed.setdefault(key, []).append({
+                'indices': [idx],
+                'tokens': self.estimate_function_tokens(func)
+            })
+
+        bins = []
+        for key, items in keyed.items():
+            for bin_ in self._pack(items):
+                bin_['key'] = key
+                bins.append(bin_)
+
+        # 2. 再把各类型剩余的小箱子合并，减少请求数
+        merged = self._pack(bins)
+        for bin_ in merged:
+            keys = {self._group_key(functions[i], type_names) for i in bin_['indices']}
+            bin_['key'] = ','.join(sorted(k for k in keys if k))
+
+        # 3. 组内和组间都按源码顺序排列，保证合并结果确定
+        groups = []
+        for bin_ in sorted(merged, key=lambda b: min(b['indices'])):
+            indices = sorted(bin_['indices'])
+            group_functions = [functions[i] for i in indices]
+
+            referenced = set()
+            for func in group_functions:
+                referenced.update(self._referenced_types(func, type_names))
+
+            groups.append({
+                'functions': group_functions,
+                'types': [t for t in types if t.get('name') in referenced],
+                'key': bin_['key'],
+                'estimated_tokens': bin_['tokens']
+            })
+
+        logger.info(
+            f"🧩 {len(functions)} 个函数分为 {len(groups)} 组 "
+            f"(每组上限 {self.group_token_budget} tokens / {self.max_group_functions} 个函数)"
+        )
+        return groups
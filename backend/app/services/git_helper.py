@@ -5,6 +5,8 @@ from typing import Optional
 from loguru import logger
 from datetime import datetime
 
+from app.services.tracing import start_span
+
 
 class GitHelper:
     """Git 操作辅助类"""
@@ -37,12 +39,14 @@ class GitHelper:
         full_command = ['git', '-C', str(self.repo_path)] + command
         logger.debug(f"执行命令: {' '.join(full_command)}")
         
-        result = subprocess.run(
-            full_command,
-            capture_output=True,
-            text=True,
-            check=False
-        )
+        with start_span("subprocess", {'process.command': ' '.join(['git'] + command)}) as span:
+            result = subprocess.run(
+                full_command,
+                capture_output=True,
+                text=True,
+                check=False
+            )
+            span.set_attribute('process.exit_code', result.returncode)
         
         if check and result.returncode != 0:
             error_msg = result.stderr.strip() or result.stdout.strip()
@@ -87,6 +87,48 @@ class GitService:
             logger.error(f"Git操作失败: {e}")
             raise
     
+    async def get_remote_head(self, git_url: str, branch: str = "main") -> Optional[str]:
+        """
+        查询远端分支的最新commit（git ls-remote，不需要克隆）
+        
+        Args:
+            git_url: Git仓库URL
+            branch: 分支名称
+            
+        Returns:
+            commit hash；查询失败时返回 None
+        """
+        try:
+            output = git.cmd.Git().ls_remote(self._get_auth_url(git_url), f"refs/heads/{branch}")
+            return output.split()[0] if output.strip() else None
+        except Exception as e:
+            logger.warning(f"⚠️ 查询远端分支失败: {e}")
+            return None
+    
+    async def pin_commit(self, repo_path: str, commit_hash: str) -> bool:
+        """
+        把当前分支固定到指定commit（批处理任务恢复时使用，保证与收集请求时的代码一致）
+        
+        Args:
+            repo_path: 仓库路径
+            commit_hash: 目标commit
+        
+        Returns:
+            是否成功（浅克隆中找不到该commit时返回 False，继续使用最新代码）
+        """
+        try:
+            repo = git.Repo(repo_path)
+            if repo.head.commit.hexsha == commit_hash:
+                return True
+            
+            repo.git.reset('--hard', commit_hash)
+            logger.info(f"📌 已固定到commit: {commit_hash}")
+            return True
+        
+        except Exception as e:
+            logger.warning(f"⚠️ 固定commit失败，使用最新代码: {e}")
+            return False
+    
     async def create_branch(
         self,
         repo_path: str,
@@ -0,0 +1,526 @@
+"""LLM 批处理模块（夜间批量生成）
+
+夜间批量任务对延迟不敏感，生成请求改为通过提供商的异步批处理接口提交（价格更低，且不占用交互请求的限流配额）：
+1. 收集：任务照常执行克隆、分析、生成，但生成请求只记录不发送（_call_llm 抛出 BatchDeferred），
+   收集到的请求连同当时的 commit 保存到 llm_batches 表，任务停在 GENERATING 状态
+2. 提交：定时任务把收集窗口内同一提供商/模型的请求合并（相同请求只提交一次）提交到批处理接口；
+   本地模型 / 模拟提供商没有批处理接口，由定时任务直接执行作为替代
+3. 轮询：批次结束后结果写回数据库，重新投递任务
+4. 恢复：任务固定到收集时的 commit 重新执行，生成请求按内容从批处理结果中取回；
+   没有结果的请求（批次失败、过期或提示词变化）以及后续的修复请求照常实时调用
+
+批处理状态全部保存在数据库中，worker 重启不影响恢复
+"""
+
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+from loguru import logger
+
+from app.config import get_settings
+from app.services.metrics import LLM_BATCH_REQUESTS
+from app.services.prompt_cache import (
+    anthropic_usage,
+    build_anthropic_request,
+    build_openai_messages,
+    openai_usage
+)
+
+
+ANTHROPIC_API_URL = "https://api.anthropic.com/v1"
+ANTHROPIC_VERSION = "2023-06-01"
+
+# OpenAI 批次的终止状态
+OPENAI_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchDeferred(Exception):
+    """请求已加入批处理，等待批次结果后再继续"""
+
+
+def request_key(model: str, request: Dict) -> str:
+    """请求内容的键（收集和恢复时按内容对应，同时作为批处理的 custom_id）"""
+    raw = json.dumps(
+        [
+            model,
+            request.get('system_prompt') or "",
+            request.get('prompt_prefix') or "",
+            request['prompt'],
+            request['temperature'],
+            request['max_tokens']
+        ],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class BatchSession:
+    """单个任务的批处理会话
+
+    收集模式（results 为空）: 记录请求并抛出 BatchDeferred
+    恢复模式: 按请求内容返回批处理结果，没有结果时返回 None（由调用方实时调用）
+    """
+
+    def __init__(self, provider: str, model: str, results: Optional[Dict[str, Dict]] = None):
+        self.provider = provider
+        self.model = model
+        self.results = results
+        self.requests: Dict[str, Dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def collecting(self) -> bool:
+        return self.results is None
+
+    def resolve(self, request: Dict) -> Optional[Dict]:
+        """
+        取回请求的批处理结果
+
+        Args:
+            request: {'prompt', 'system_prompt', 'prompt_prefix', 'temperature', 'max_tokens', 'kind'}
+
+        Returns:
+            {'content', 'usage': [输入, 输出, 命中缓存] 或 None, 'truncated'}；恢复模式下没有结果时返回 None
+
+        Raises:
+            BatchDeferred: 收集模式
+        """
+        key = request_key(self.model, request)
+        with self._lock:
+            if self.collecting:
+                self.requests.setdefault(key, {'custom_id': key, **request})
+                raise BatchDeferred(f"已加入批处理 ({len(self.requests)} 个请求)，等待批次结果")
+
+            result = self.results.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def pending_requests(self) -> List[Dict]:
+        """收集到的请求（按收集顺序）"""
+        with self._lock:
+            return list(self.requests.values())
+
+
+def unpack_result(result: Dict, prompt_tokens: int, count_tokens: Callable[[str], int]) -> Tuple:
+    """
+    把批处理结果转换为 _call_llm 的返回值
+
+    Returns:
+        (返回文本, 输入tokens, 输出tokens, 命中缓存的输入tokens, 是否被截断)
+    """
+    content = result['content']
+    usage = result.get('usage')
+    if usage:
+        return content, usage[0], usage[1], usage[2], result.get('truncated', False)
+    return content, prompt_tokens, count_tokens(content), 0, result.get('truncated', False)
+
+
+# ==================== 提供商批处理接口 ====================
+# openai==1.3.5 / anthropic==0.7.1 还没有批处理接口，这里直接调用 REST API
+
+class BatchBackend:
+    """批处理后端"""
+
+    provider = ""
+
+    def __init__(self):
+        self.settings = get_settings()
+
+    def submit(self, model: str, requests: List[Dict]) -> Dict:
+        """
+        提交批次
+
+        Returns:
+            {'id': 提供商批次ID, 'results': 结果(已同步执行完时)}
+        """
+        raise NotImplementedError
+
+    def poll(self, batch_id: str) -> Optional[Dict]:
+        """
+        查询批次
+
+        Returns:
+            批次结束时返回 {'results': {custom_id: 结果}, 'error': 失败原因或 None}，仍在处理时返回 None
+        """
+        raise NotImplementedError
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API（/v1/batches，24 小时内完成，半价）"""
+
+    provider = "openai"
+
+    def _client(self):
+        import httpx
+        return httpx.Client(
+            base_url=self.settings.openai_base_url.rstrip('/'),
+            headers={'Authorization': f"Bearer {self.settings.openai_api_key}"},
+            timeout=self.settings.llm_request_timeout
+        )
+
+    def submit(self, model: str, requests: List[Dict]) -> Dict:
+        lines = []
+        for request in requests:
+            lines.append(json.dumps({
+                'custom_id': request['custom_id'],
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': {
+                    'model': model,
+                    'messages': build_openai_messages(
+                        request['prompt'], request.get('system_prompt'), request.get('prompt_prefix')
+                    ),
+                    'temperature': request['temperature'],
+                    'max_tokens': request['max_tokens']
+                }
+            }, ensure_ascii=False))
+
+        with self._client() as client:
+            response = client.post(
+                '/files',
+                data={'purpose': 'batch'},
+                files={'file': ('batch.jsonl', "\n".join(lines).encode('utf-8'), 'application/jsonl')}
+            )
+            response.raise_for_status()
+            response = client.post('/batches', json={
+                'input_file_id': response.json()['id'],
+                'endpoint': '/v1/chat/completions',
+                'completion_window': self.settings.llm_batch_completion_window
+            })
+            response.raise_for_status()
+            return {'id': response.json()['id'], 'results': None}
+
+    def poll(self, batch_id: str) -> Optional[Dict]:
+        with self._client() as client:
+            response = client.get(f'/batches/{batch_id}')
+            response.raise_for_status()
+            batch = response.json()
+            if batch['status'] not in OPENAI_FINAL_STATUSES:
+                return None
+
+            results = {}
+            # 过期 / 取消的批次也可能有部分结果
+            if batch.get('output_file_id'):
+                response = client.get(f"/files/{batch['output_file_id']}/content")
+                response.raise_for_status()
+                for line in response.text.splitlines():
+                    if not line.strip():
+                        continue
+                    item = json.loads(line)
+                    body = (item.get('response') or {}).get('body') or {}
+                    if item.get('error') or not body.get('choices'):
+                        continue
+                    choice = body['choices'][0]
+                    usage = openai_usage(SimpleNamespace(**body['usage'])) if body.get('usage') else None
+                    results[item['custom_id']] = {
+                        'content': choice['message']['content'],
+                        'usage': list(usage) if usage else None,
+                        'truncated': choice.get('finish_reason') == "length"
+                    }
+
+        error = None if batch['status'] == "completed" else f"批次状态: {batch['status']}"
+        if batch.get('errors'):
+            error = json.dumps(batch['errors'], ensure_ascii=False)[:1000]
+        return {'results': results, 'error': error}
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """Anthropic Message Batches API（/v1/messages/batches，24 小时内完成，半价）"""
+
+    provider = "anthropic"
+
+    def _client(self):
+        import httpx
+        return httpx.Client(
+            base_url=ANTHROPIC_API_URL,
+            headers={
+                'x-api-key': self.settings.anthropic_api_key,
+                'anthropic-version': ANTHROPIC_VERSION
+            },
+            timeout=self.settings.llm_request_timeout
+        )
+
+    def submit(self, model: str, requests: List[Dict]) -> Dict:
+        payload = {'requests': [
+            {
+                'custom_id': request['custom_id'],
+                'params': {
+                    'model': model,
+                    'max_tokens': request['max_tokens'],
+                    'temperature': request['temperature'],
+                    **build_anthropic_request(
+                        request['prompt'],
+                        request.get('system_prompt'),
+                        request.get('prompt_prefix'),
+                        self.settings.llm_prompt_cache_enabled
+                    )
+                }
+            }
+            for request in requests
+        ]}
+
+        with self._client() as client:
+            response = client.post('/messages/batches', json=payload)
+            response.raise_for_status()
+            return {'id': response.json()['id'], 'results': None}
+
+    def poll(self, batch_id: str) -> Optional[Dict]:
+        with self._client() as client:
+            response = client.get(f'/messages/batches/{batch_id}')
+            response.raise_for_status()
+            batch = response.json()
+            if batch['processing_status'] != "ended":
+                return None
+
+            results = {}
+            failed = 0
+            if batch.get('results_url'):
+                response = client.get(batch['results_url'])
+                response.raise_for_status()
+                for line in response.text.splitlines():
+                    if not line.strip():
+                        continue
+                    item = json.loads(line)
+                    result = item.get('result') or {}
+                    if result.get('type') != "succeeded":
+                        failed += 1
+                        continue
+                    message = result['message']
+                    usage = anthropic_usage(SimpleNamespace(**message['usage'])) if message.get('usage') else None
+                    results[item['custom_id']] = {
+                        'content': message['content'][0]['text'],
+                        'usage': list(usage) if usage else None,
+                        'truncated': message.get('stop_reason') == "max_tokens"
+                    }
+
+        return {'results': results, 'error': f"{failed} 个请求失败" if failed else None}
+
+
+class LocalBatchBackend(BatchBackend):
+    """本地模型 / 模拟提供商没有批处理接口，提交时直接并发执行（结果中没有用量，执行时已计入指标）"""
+
+    def __init__(self, provider: str):
+        super().__init__()
+        self.provider = provider
+
+    def submit(self, model: str, requests: List[Dict]) -> Dict:
+        # 延迟导入：test_generator 依赖本模块
+        from app.services.test_generator import TestGenerator
+        generator = TestGenerator(self.provider)
+
+        def execute(request: Dict) -> Tuple[str, Optional[Dict]]:
+            try:
+                content = generator._call_llm(
+                    request['prompt'],
+                    system_prompt=request.get('system_prompt'),
+                    temperature=request['temperature'],
+                    max_tokens=request['max_tokens'],
+                    kind=request.get('kind', "generate"),
+                    prompt_prefix=request.get('prompt_prefix')
+                )
+                return request['custom_id'], {'content': content, 'usage': None, 'truncated': False}
+            except Exception as e:
+                logger.warning(f"⚠️ 批处理请求执行失败: {e}")
+                return request['custom_id'], None
+
+        max_workers = max(1, min(self.settings.local_model_concurrency, len(requests)))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-batch") as executor:
+            results = {custom_id: result for custom_id, result in executor.map(execute, requests) if result}
+
+        return {'id': f"local-{uuid4()}", 'results': results}
+
+
+def get_batch_backend(provider: str) -> BatchBackend:
+    """工厂函数：获取提供商的批处理后端"""
+    if provider == "openai":
+        return OpenAIBatchBackend()
+    if provider == "anthropic":
+        return AnthropicBatchBackend()
+    if provider in ("local", "mock"):
+        return LocalBatchBackend(provider)
+    raise ValueError(f"不支持的AI提供商: {provider}")
+
+
+# ==================== 持久化与调度 ====================
+
+async def create_batch(db, task_id: str, commit_hash: Optional[str], batch: Dict) -> str:
+    """
+    保存任务收集到的请求（等待定时任务合并提交）
+
+    Args:
+        db: 数据库会话
+        task_id: 任务ID
+        commit_hash: 收集请求时的 commit（恢复时固定到该 commit，保证提示词一致）
+        batch: {'provider', 'model', 'requests'}
+
+    Returns:
+        批处理记录ID
+    """
+    from app.database import BatchStatus, LLMBatch
+
+    record = LLMBatch(
+        id=str(uuid4()),
+        task_id=task_id,
+        provider=batch['provider'],
+        model=batch['model'],
+        status=BatchStatus.COLLECTING,
+        commit_hash=commit_hash,
+        request_count=len(batch['requests']),
+        requests=batch['requests']
+    )
+    db.add(record)
+    await db.commit()
+    logger.info(f"📮 任务 {task_id} 收集到 {record.request_count} 个生成请求，等待批处理提交")
+    return record.id
+
+
+async def load_batch(db, batch_id: str):
+    """读取批处理记录（不存在时返回 None）"""
+    from sqlalchemy import select
+    from app.database import LLMBatch
+
+    result = await db.execute(select(LLMBatch).where(LLMBatch.id == batch_id))
+    return result.scalar_one_or_none()
+
+
+def _finish(record, status, results: Dict, error: Optional[str]):
+    """把批次结果按记录拆分（每条记录只保存自己请求的结果）"""
+    own = {request['custom_id'] for request in record.requests or []}
+    record.results = {key: value for key, value in results.items() if key in own}
+    record.status = status
+    record.error = error
+    record.completed_at = datetime.utcnow()
+    LLM_BATCH_REQUESTS.labels(provider=record.provider, model=record.model, result="succeeded").inc(len(record.results))
+    LLM_BATCH_REQUESTS.labels(provider=record.provider, model=record.model, result="failed").inc(
+        len(own) - len(record.results)
+    )
+
+
+def _chunk_records(records: List, max_requests: int) -> List[List]:
+    """把记录分成若干批次（合并去重后的请求数不超过上限，单条记录不拆分）"""
+    chunks, current, keys = [], [], set()
+    for record in records:
+        record_keys = {request['custom_id'] for request in record.requests or []}
+        if current and len(keys | record_keys) > max_requests:
+            chunks.append(current)
+            current, keys = [], set()
+        current.append(record)
+        keys |= record_keys
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _flush_collecting(db) -> List[Dict]:
+    """提交收集窗口已到期的请求，返回已直接完成（本地替代执行）的记录"""
+    from sqlalchemy import select
+    from app.database import BatchStatus, LLMBatch
+
+    settings = get_settings()
+    result = await db.execute(
+        select(LLMBatch)
+        .where(LLMBatch.status == BatchStatus.COLLECTING)
+        .order_by(LLMBatch.created_at)
+        .with_for_update(skip_locked=True)
+    )
+    groups: Dict[Tuple[str, str], List] = {}
+    for record in result.scalars().all():
+        groups.setdefault((record.provider, record.model), []).append(record)
+
+    ready = []
+    deadline = datetime.utcnow() - timedelta(seconds=settings.llm_batch_window_seconds)
+    for (provider, model), records in groups.items():
+        # 收集窗口：等最早的请求到期后，与窗口内其他任务的请求一起提交
+        if records[0].created_at > deadline:
+            continue
+
+        for chunk in _chunk_records(records, settings.llm_batch_max_requests):
+            requests = {}
+            for record in chunk:
+                for request in record.requests or []:
+                    requests.setdefault(request['custom_id'], request)
+
+            try:
+                submitted = get_batch_backend(provider).submit(model, list(requests.values()))
+            except Exception as e:
+                # 提交失败时任务直接恢复，用实时调用完成生成
+                logger.error(f"❌ 批处理提交失败 ({provider}/{model}, {len(requests)} 个请求): {e}")
+                for record in chunk:
+                    _finish(record, BatchStatus.FAILED, {}, f"提交失败: {e}")
+                    ready.append({'task_id': record.task_id, 'batch_id': record.id})
+                continue
+
+            LLM_BATCH_REQUESTS.labels(provider=provider, model=model, result="submitted").inc(len(requests))
+            logger.info(
+                f"📤 提交批处理 {submitted['id']}: {len(chunk)} 个任务, "
+                f"{len(requests)} 个请求 ({provider}/{model})"
+            )
+            now = datetime.utcnow()
+            for record in chunk:
+                record.provider_batch_id = submitted['id']
+                record.submitted_at = now
+                if submitted['results'] is not None:
+                    _finish(record, BatchStatus.COMPLETED, submitted['results'], None)
+                    ready.append({'task_id': record.task_id, 'batch_id': record.id})
+                else:
+                    record.status = BatchStatus.SUBMITTED
+
+    await db.commit()
+    return ready
+
+
+async def _poll_submitted(db) -> List[Dict]:
+    """查询已提交的批次，返回已结束的记录"""
+    from sqlalchemy import select
+    from app.database import BatchStatus, LLMBatch
+
+    result = await db.execute(
+        select(LLMBatch)
+        .where(LLMBatch.status == BatchStatus.SUBMITTED)
+        .with_for_update(skip_locked=True)
+    )
+    batches: Dict[Tuple[str, str], List] = {}
+    for record in result.scalars().all():
+        batches.setdefault((record.provider, record.provider_batch_id), []).append(record)
+
+    ready = []
+    for (provider, batch_id), records in batches.items():
+        try:
+            polled = get_batch_backend(provider).poll(batch_id)
+        except Exception as e:
+            # 网络错误等下次轮询再试
+            logger.warning(f"⚠️ 查询批处理 {batch_id} 失败: {e}")
+            continue
+        if polled is None:
+            continue
+
+        status = BatchStatus.COMPLETED if polled['results'] else BatchStatus.FAILED
+        logger.info(f"📥 批处理 {batch_id} 已结束: {len(polled['results'])} 个结果, {polled['error'] or '无错误'}")
+        for record in records:
+            _finish(record, status, polled['results'], polled['error'])
+            ready.append({'task_id': record.task_id, 'batch_id': record.id})
+
+    await db.commit()
+    return ready
+
+
+async def process_batches(db) -> List[Dict]:
+    """
+    提交到期的请求并轮询已提交的批次（由定时任务调用）
+
+    Returns:
+        需要恢复执行的任务: [{'task_id', 'batch_id'}]
+    """
+    ready = await _flush_collecting(db)
+    ready.extend(await _poll_submitted(db))
+    return ready
@@ -0,0 +1,252 @@
+"""LLM 请求执行策略模块
+
+在单次提供商调用之上提供：
+- 可重试错误（超时、连接错误、429、5xx）的指数退避重试（full jitter）
+- 流式输出被守卫中止（生成跑偏）时立即重试
+- 对冲请求：请求耗时超过历史 p95 时再发一个相同请求，先返回的结果生效
+- 备用模型：主提供商重试耗尽后切换到本地模型（local_model_url）
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Optional
+from loguru import logger
+
+from app.config import get_settings
+from app.services.local_llm import create_local_client
+from app.services.metrics import LLM_FALLBACKS, LLM_HEDGES, LLM_RETRIES
+from app.services.rate_limiter import is_rate_limit_error, retry_after_seconds
+from app.services.stream_guard import StreamAborted
+from app.services.tracing import bind_context
+
+
+# 可重试的 HTTP 状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# SDK 中表示网络层/超时错误的异常类名（openai / anthropic 同名）
+RETRYABLE_ERROR_NAMES = {'APITimeoutError', 'APIConnectionError', 'InternalServerError', 'RateLimitError'}
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断错误是否值得重试（瞬时错误）"""
+    if isinstance(error, (TimeoutError, ConnectionError, StreamAborted)):
+        return True
+    if is_rate_limit_error(error):
+        return True
+    if getattr(error, 'status_code', None) in RETRYABLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+class LLMTarget:
+    """一个可调用的 提供商/模型 组合"""
+
+    def __init__(self, provider: str, model: str, client: Any):
+        """
+        初始化调用目标
+
+        Args:
+            provider: 提供商（openai / anthropic / local）
+            model: 模型名称
+            client: 提供商 SDK 客户端
+        """
+        self.provider = provider
+        self.model = model
+        self.client = client
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+
+def create_fallback_target() -> Optional[LLMTarget]:
+    """
+    创建备用调用目标（本地 OpenAI 兼容模型服务）
+
+    Returns:
+        备用目标；未启用备用模型时返回 None
+    """
+    settings = get_settings()
+    if not settings.llm_fallback_enabled or not settings.local_model_url:
+        return None
+
+    return LLMTarget("local", settings.local_model_name, create_local_client())
+
+
+class LatencyTracker:
+    """按 (调用目标, 请求类型) 记录最近的成功请求耗时，用于计算对冲阈值"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, latency: float):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, name: str, pct: float, min_samples: int) -> Optional[float]:
+        """计算百分位耗时；样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * pct / 100))
+        return samples[index]
+
+
+class RequestPolicy:
+    """LLM 请求执行策略（进程内共享，以便累积耗时统计）"""
+
+    def __init__(self):
+        settings = get_settings()
+        self.max_retries = settings.llm_max_retries
+        self.base_delay = settings.llm_retry_base_delay
+        self.max_delay = settings.llm_retry_max_delay
+
+        self.hedging_enabled = settings.llm_hedging_enabled
+        self.hedge_min_samples = settings.llm_hedge_min_samples
+        self.hedge_max_ratio = settings.llm_hedge_max_ratio
+
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(2, settings.max_concurrent_llm_requests * 2),
+            thread_name_prefix="llm-hedge"
+        )
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'fallbacks': 0}
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    @staticmethod
+    def _latency_key(target: LLMTarget, kind: str) -> str:
+        return f"{target.name}:{kind}"
+
+    @contextmanager
+    def timed(self, target: LLMTarget, kind: str):
+        """
+        记录提供商调用本身的耗时（由 call 包在提供商请求外层）
+
+        限流器等待、排队时间不计入，否则过载时 p95 被拉高，对冲失效；
+        生成、修复等不同类型的请求耗时差异很大，分开统计
+        """
+        started = time.monotonic()
+        yield
+        self.latency.record(self._latency_key(target, kind), time.monotonic() - started)
+
+    def _hedge_allowed(self) -> bool:
+        """对冲请求不超过总请求数的一定比例，避免在过载时放大负载"""
+        with self._stats_lock:
+            return self.stats['hedges'] < max(1, self.stats['requests'] * self.hedge_max_ratio)
+
+    def _run_hedged(self, call: Callable[[LLMTarget], Any], target: LLMTarget, kind: str) -> Any:
+        """执行一次请求；超过 p95 耗时仍未返回时发起对冲请求"""
+        self._count('requests')
+
+        threshold = None
+        if self.hedging_enabled:
+            threshold = self.latency.percentile(self._latency_key(target, kind), 95, self.hedge_min_samples)
+
+        if threshold is None:
+            return call(target)
+
+        # 对冲请求在线程池中执行，需要带上调用方的 trace 上下文
+        call = bind_context(call)
+        primary = self._executor.submit(call, target)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._hedge_allowed():
+            return primary.result()
+
+        logger.info(f"⏱️ {target.name} 请求超过 p95 ({threshold:.1f}s)，发起对冲请求")
+        self._count('hedges')
+        LLM_HEDGES.labels(provider=target.provider, model=target.model, result="launched").inc()
+        hedge = self._executor.submit(call, target)
+
+        # 先成功的结果生效；落后的请求无法中断，在后台完成后丢弃
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    self._count('hedge_wins')
+                    LLM_HEDGES.labels(provider=target.provider, model=target.model, result="won").inc()
+                return result
+        raise error
+
+    def _run_with_retries(self, call: Callable[[LLMTarget], Any], target: LLMTarget, kind: str) -> Any:
+        """对可重试错误做指数退避重试（full jitter）"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._run_hedged(call, target, kind)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                if isinstance(e, StreamAborted):
+                    # 生成跑偏不是服务端问题，无需退避
+                    delay = 0
+                elif is_rate_limit_error(e):
+                    delay = max(delay, retry_after_seconds(e) or 0)
+
+                self._count('retries')
+                LLM_RETRIES.labels(provider=target.provider, model=target.model, reason=type(e).__name__).inc()
+                logger.warning(
+                    f"🔁 {target.name} 请求失败 ({type(e).__name__}: {e})，"
+                    f"{delay:.1f}s 后重试 ({attempt + 1}/{self.max_retries})"
+                )
+                time.sleep(delay)
+
+    def execute(
+        self,
+        call: Callable[[LLMTarget], Any],
+        primary: LLMTarget,
+        fallback: Optional[LLMTarget] = None,
+        kind: str = "generate"
+    ) -> Any:
+        """
+        按策略执行一次 LLM 调用
+
+        Args:
+            call: 针对指定目标执行单次调用的函数（应使用 timed() 记录提供商调用耗时）
+            primary: 主调用目标
+            fallback: 备用调用目标（可选）
+            kind: 请求类型（对冲阈值按调用目标和请求类型分别统计）
+
+        Returns:
+            call 的返回值
+        """
+        try:
+            return self._run_with_retries(call, primary, kind)
+        except Exception as e:
+            if fallback is None or not is_retryable_error(e):
+                raise
+            self._count('fallbacks')
+            LLM_FALLBACKS.labels(provider=primary.provider, model=primary.model).inc()
+            logger.warning(f"🔀 {primary.name} 重试耗尽 ({type(e).__name__})，切换到备用模型 {fallback.name}")
+            return self._run_with_retries(call, fallback, kind)
+
+
+_request_policy: Optional[RequestPolicy] = None
+_request_policy_lock = threading.Lock()
+
+
+def get_request_policy() -> RequestPolicy:
+    """获取进程级请求执行策略单例"""
+    global _request_policy
+    with _request_policy_lock:
+        if _request_policy is None:
+            _request_policy = RequestPolicy()
+        return _request_policy
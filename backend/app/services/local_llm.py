@@ -0,0 +1,70 @@
+"""本地模型提供商模块
+
+通过 OpenAI 兼容的 HTTP 接口调用本地部署的模型服务（llama.cpp server / vLLM / Ollama 等），
+用于离线、低延迟生成：
+- 进程内共享一个带连接池的 HTTP 客户端，并发请求复用长连接
+- 请求按服务端批处理友好的方式组织（固定的 system 前缀 + 开启前缀缓存），
+  让并发请求在服务端的连续批处理中共享 KV 缓存
+"""
+
+import threading
+from typing import Dict, Optional
+import httpx
+import openai
+from loguru import logger
+
+from app.config import get_settings
+
+
+_http_client: Optional[httpx.Client] = None
+_http_client_lock = threading.Lock()
+
+
+def get_local_http_client() -> httpx.Client:
+    """获取本地模型服务的共享 HTTP 客户端（连接池大小与本地并发上限一致）"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            settings = get_settings()
+            _http_client = httpx.Client(
+                timeout=httpx.Timeout(settings.llm_request_timeout, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=settings.local_model_concurrency,
+                    max_keepalive_connections=settings.local_model_concurrency,
+                    keepalive_expiry=60.0
+                )
+            )
+            logger.info(
+                f"🖥️ 本地模型服务: {settings.local_model_url} "
+                f"(模型: {settings.local_model_name}, 连接池: {settings.local_model_concurrency})"
+            )
+        return _http_client
+
+
+def create_local_client() -> openai.OpenAI:
+    """创建本地模型服务的 OpenAI 兼容客户端（共享连接池，重试由请求执行策略负责）"""
+    settings = get_settings()
+    return openai.OpenAI(
+        base_url=settings.local_model_url,
+        api_key=settings.local_model_api_key or "not-needed",
+        http_client=get_local_http_client(),
+        max_retries=0
+    )
+
+
+def local_request_options() -> Dict:
+    """
+    本地模型请求的附加参数
+
+    - cache_prompt: llama.cpp server 复用相同前缀的 KV 缓存（vLLM 等会忽略该字段，
+      其自动前缀缓存依赖相同的 system 提示词前缀）
+    - seed: 固定随机种子，同样的提示词得到稳定的输出，便于基准测试对比
+
+    Returns:
+        传给 chat.completions.create 的 extra_body
+    """
+    settings = get_settings()
+    options = {'cache_prompt': settings.local_model_cache_prompt}
+    if settings.local_model_seed is not None:
+        options['seed'] = settings.local_model_seed
+    return options
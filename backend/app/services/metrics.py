@@ -0,0 +1,264 @@
+"""运行指标模块（Prometheus）
+
+记录测试生成流程各环节的耗时和计数，由 FastAPI（/metrics）和 Celery worker（独立端口）导出：
+- 直方图：流水线各阶段耗时（克隆、分析、生成、执行、修复、覆盖率、提交）、
+  单次 LLM 请求耗时（按 提供商/模型/请求类型）、单次语法验证耗时、提示词模板渲染耗时
+- 计数器：任务数、LLM tokens、重试/对冲/备用模型切换、缓存命中、修复尝试
+- 仪表：进行中的 LLM 请求数、等待限流许可的请求数、Celery 队列长度
+
+Celery 使用 prefork 多进程时，需要配置 METRICS_MULTIPROC_DIR（prometheus 多进程模式），
+各子进程把指标写入该目录，由 worker 主进程汇总导出
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+from loguru import logger
+
+from app.config import get_settings
+from app.services.task_routing import PRIORITY_STEPS, priority_queue_keys
+
+
+# prometheus_client 在导入时决定是否使用多进程模式，必须先设置目录
+_settings = get_settings()
+if _settings.metrics_multiproc_dir and not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    Path(_settings.metrics_multiproc_dir).mkdir(parents=True, exist_ok=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = _settings.metrics_multiproc_dir
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily  # noqa: E402
+
+
+# 阶段耗时从数秒（分析）到数十分钟（大仓库生成）
+STAGE_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+# 单次 LLM 请求从亚秒（本地/缓存）到数分钟（长输出）
+LLM_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# 语法验证（go vet / g++ -fsyntax-only 等）通常在数秒内
+VALIDATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 提示词模板渲染通常在毫秒以内
+PROMPT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+
+TASKS = Counter(
+    'aitest_tasks_total',
+    '测试生成任务数',
+    ['language', 'status']
+)
+STAGE_DURATION = Histogram(
+    'aitest_stage_duration_seconds',
+    '流水线各阶段耗时',
+    ['stage', 'language'],
+    buckets=STAGE_BUCKETS
+)
+VALIDATION_DURATION = Histogram(
+    'aitest_validation_duration_seconds',
+    '单次语法验证耗时',
+    ['language'],
+    buckets=VALIDATION_BUCKETS
+)
+LLM_REQUEST_DURATION = Histogram(
+    'aitest_llm_request_duration_seconds',
+    '单次 LLM 请求耗时（不含限流等待）',
+    ['provider', 'model', 'kind', 'outcome'],
+    buckets=LLM_BUCKETS
+)
+PROMPT_BUILD_DURATION = Histogram(
+    'aitest_prompt_build_seconds',
+    '提示词模板渲染耗时',
+    ['template'],
+    buckets=PROMPT_BUCKETS
+)
+LLM_TOKENS = Counter(
+    'aitest_llm_tokens_total',
+    'LLM 消耗的 tokens',
+    ['provider', 'model', 'type']
+)
+LLM_RETRIES = Counter(
+    'aitest_llm_retries_total',
+    'LLM 请求重试次数',
+    ['provider', 'model', 'reason']
+)
+LLM_HEDGES = Counter(
+    'aitest_llm_hedges_total',
+    'LLM 对冲请求次数',
+    ['provider', 'model', 'result']
+)
+LLM_FALLBACKS = Counter(
+    'aitest_llm_fallbacks_total',
+    '切换到备用模型的次数',
+    ['provider', 'model']
+)
+LLM_IN_FLIGHT = Gauge(
+    'aitest_llm_in_flight_requests',
+    '进行中的 LLM 请求数',
+    ['provider', 'model'],
+    multiprocess_mode='livesum'
+)
+LLM_WAITING = Gauge(
+    'aitest_llm_waiting_requests',
+    '等待并发/限流许可的 LLM 请求数',
+    ['provider', 'model'],
+    multiprocess_mode='livesum'
+)
+CACHE_REQUESTS = Counter(
+    'aitest_cache_requests_total',
+    '缓存查询次数',
+    ['cache', 'result']
+)
+FIX_ATTEMPTS = Counter(
+    'aitest_fix_attempts_total',
+    '测试修复尝试次数',
+    ['language', 'kind', 'outcome']
+)
+SCHEDULED_TASKS = Counter(
+    'aitest_scheduled_tasks_total',
+    '定时触发的任务数',
+    ['result']
+)
+LLM_BATCH_REQUESTS = Counter(
+    'aitest_llm_batch_requests_total',
+    '通过批处理接口提交的 LLM 请求数',
+    ['provider', 'model', 'result']
+)
+
+
+@contextmanager
+def track_stage(stage: str, language: str):
+    """
+    记录一个流水线阶段的耗时（可包裹 await 语句）
+
+    用法:
+        with track_stage("clone", language):
+            await git_service.clone_or_pull(...)
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=stage, language=language).observe(time.monotonic() - started)
+
+
+@contextmanager
+def track_llm_request(provider: str, model: str, kind: str):
+    """记录单次 LLM 请求的耗时、结果和进行中的请求数"""
+    in_flight = LLM_IN_FLIGHT.labels(provider=provider, model=model)
+    in_flight.inc()
+    started = time.monotonic()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        in_flight.dec()
+        LLM_REQUEST_DURATION.labels(provider=provider, model=model, kind=kind, outcome=outcome).observe(
+            time.monotonic() - started
+        )
+
+
+def record_llm_tokens(
+    provider: str,
+    model: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+    cached_prompt_tokens: int = 0
+):
+    """累计一次请求消耗的 tokens（cached_prompt 是 prompt 中命中提供商提示词缓存的部分）"""
+    LLM_TOKENS.labels(provider=provider, model=model, type="prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(provider=provider, model=model, type="cached_prompt").inc(cached_prompt_tokens)
+    LLM_TOKENS.labels(provider=provider, model=model, type="completion").inc(completion_tokens)
+
+
+class CeleryQueueCollector:
+    """采集时读取 Redis broker 中各 Celery 队列的长度"""
+
+    def __init__(self, broker_url: str, queues: Iterable[str]):
+        self.broker_url = broker_url
+        self.queues = list(queues)
+        self._redis = None
+
+    def collect(self):
+        family = GaugeMetricFamily('aitest_queue_depth', 'Celery 队列中等待执行的任务数', labels=['queue'])
+        try:
+            if self._redis is None:
+                import redis
+                self._redis = redis.Redis.from_url(self.broker_url, socket_timeout=2, socket_connect_timeout=2)
+            # 优先级队列在 Redis 中按档位拆成多个列表（bulk、bulk:1 ...），按队列汇总
+            pipe = self._redis.pipeline(transaction=False)
+            for queue in self.queues:
+                for key in priority_queue_keys(queue):
+                    pipe.llen(key)
+            depths = iter(pipe.execute())
+            for queue in self.queues:
+                family.add_metric([queue], sum(next(depths) for _ in PRIORITY_STEPS))
+        except Exception as e:
+            self._redis = None
+            logger.debug(f"读取 Celery 队列长度失败: {e}")
+        yield family
+
+
+_queue_collector: Optional[CeleryQueueCollector] = None
+
+
+def register_queue_collector(queues: Iterable[str]):
+    """注册 Celery 队列长度采集（只需在导出指标的 API 进程中注册一次）"""
+    global _queue_collector
+    if _queue_collector is not None:
+        return
+    _queue_collector = CeleryQueueCollector(get_settings().celery_broker_url, queues)
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        REGISTRY.register(_queue_collector)
+
+
+def _collect_registry() -> CollectorRegistry:
+    """多进程模式下汇总各进程写入的指标；否则使用默认注册表"""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if _queue_collector is not None:
+        registry.register(_queue_collector)
+    return registry
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    生成 Prometheus 文本格式的指标
+
+    Returns:
+        (指标内容, Content-Type)
+    """
+    return generate_latest(_collect_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int):
+    """在独立端口启动指标 HTTP 服务（Celery worker 使用）"""
+    start_http_server(port, registry=_collect_registry())
+    mode = "多进程" if os.environ.get('PROMETHEUS_MULTIPROC_DIR') else "单进程"
+    logger.info(f"📈 指标服务已启动: http://0.0.0.0:{port}/metrics ({mode}模式)")
+
+
+def clear_multiprocess_dir():
+    """清理上次运行遗留的多进程指标文件（worker 启动时、子进程 fork 前调用）"""
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not directory:
+        return
+    for path in Path(directory).glob('*.db'):
+        path.unlink(missing_ok=True)
+
+
+def mark_process_dead(pid: int):
+    """子进程退出时清理其 livesum 类型的仪表数据"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
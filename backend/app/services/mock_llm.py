@@ -0,0 +1,196 @@
+"""模拟 LLM 提供商模块
+
+AI_PROVIDER=mock 时使用，不产生真实的 API 调用费用，用于基准测试和离线调试：
+- synthetic: 根据提示词生成确定性的最小测试代码，并按配置模拟首 token 延迟和输出速度
+- record: 调用真实提供商（MOCK_LLM_RECORD_PROVIDER），并把回复写入录制文件
+- replay: 从录制文件回放；未录制的请求回退到 synthetic（严格模式下报错）
+
+录制文件为 JSONL，每行一条 {"key", "content", "usage", "truncated"}，
+key 由模型名、系统提示词、提示词和温度计算，与 max_tokens 无关
+"""
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+from loguru import logger
+
+from app.config import get_settings
+from app.services.local_llm_stub import build_stub_completion
+from app.services.metrics import CACHE_REQUESTS
+
+
+MOCK_MODES = ("synthetic", "record", "replay")
+
+
+class MockLLMClient:
+    """模拟 LLM 客户端（进程内共享，统计所有生成器的调用）"""
+
+    def __init__(
+        self,
+        mode: str = "synthetic",
+        cassette_path: str = "",
+        latency_ms: float = 0,
+        tokens_per_second: float = 0,
+        strict_replay: bool = False
+    ):
+        """
+        初始化模拟客户端
+
+        Args:
+            mode: 模式（synthetic / record / replay）
+            cassette_path: 录制文件路径（record / replay 模式必需）
+            latency_ms: 模拟的首 token 延迟（毫秒）
+            tokens_per_second: 模拟的输出速度（0 表示不限速）
+            strict_replay: 回放模式下遇到未录制的请求时是否报错
+        """
+        if mode not in MOCK_MODES:
+            raise ValueError(f"不支持的模拟模式: {mode}（可选: {', '.join(MOCK_MODES)}）")
+        if mode != "synthetic" and not cassette_path:
+            raise ValueError(f"{mode} 模式需要配置录制文件路径 MOCK_LLM_CASSETTE")
+
+        self.mode = mode
+        self.cassette_path = Path(cassette_path) if cassette_path else None
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.strict_replay = strict_replay
+
+        self._lock = threading.Lock()
+        self._cassette: Dict[str, Dict] = {}
+        self.stats = {'calls': 0, 'synthetic': 0, 'replayed': 0, 'recorded': 0, 'misses': 0}
+
+        if mode == "replay":
+            self._load_cassette()
+
+        logger.info(f"🎭 模拟 LLM 提供商: {mode} 模式" + (f"，录制文件 {self.cassette_path}" if self.cassette_path else ""))
+
+    def _load_cassette(self):
+        if not self.cassette_path.exists():
+            raise FileNotFoundError(f"录制文件不存在: {self.cassette_path}")
+
+        with open(self.cassette_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._cassette[entry['key']] = entry
+        logger.info(f"📼 已加载 {len(self._cassette)} 条录制回复")
+
+    def _append_cassette(self, entry: Dict):
+        with self._lock:
+            self._cassette[entry['key']] = entry
+            self.cassette_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cassette_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats[key] += 1
+
+    @staticmethod
+    def request_key(model: str, prompt: str, system_prompt: Optional[str], temperature: float) -> str:
+        """计算请求的录制键"""
+        payload = json.dumps([model, system_prompt or "", prompt, round(temperature, 3)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _synthetic(self, prompt: str, max_tokens: int) -> tuple:
+        content = build_stub_completion([{'role': 'user', 'content': prompt}])
+        completion_tokens = len(content) // 4 + 1
+
+        truncated = completion_tokens > max_tokens
+        if truncated:
+            content = content[:max_tokens * 4]
+            completion_tokens = max_tokens
+
+        delay = self.latency_ms / 1000
+        if self.tokens_per_second:
+            delay += completion_tokens / self.tokens_per_second
+        if delay:
+            time.sleep(delay)
+
+        return content, (len(prompt) // 4 + 1, completion_tokens), truncated
+
+    def complete(
+        self,
+        model: str,
+        prompt: str,
+        system_prompt: Optional[str],
+        temperature: float,
+        max_tokens: int,
+        real_call: Optional[Callable[[], tuple]] = None
+    ) -> tuple:
+        """
+        执行一次模拟调用
+
+        Args:
+            model: 模型名称（参与录制键计算）
+            prompt: 用户提示词
+            system_prompt: 系统提示词
+            temperature: 采样温度
+            max_tokens: 最大输出 tokens
+            real_call: 录制模式下调用真实提供商的函数
+
+        Returns:
+            (返回文本, (输入tokens, 输出tokens), 是否被截断)
+        """
+        key = self.request_key(model, prompt, system_prompt, temperature)
+
+        if self.mode == "record":
+            if real_call is None:
+                raise ValueError("录制模式需要提供真实提供商调用")
+            content, usage, truncated = real_call()
+            self._append_cassette({
+                'key': key,
+                'content': content,
+                'usage': list(usage) if usage else None,
+                'truncated': truncated
+            })
+            self._count('recorded')
+            return content, usage, truncated
+
+        if self.mode == "replay":
+            entry = self._cassette.get(key)
+            if entry is not None:
+                self._count('replayed')
+                CACHE_REQUESTS.labels(cache="mock_cassette", result="hit").inc()
+                usage = tuple(entry['usage']) if entry.get('usage') else None
+                return entry['content'], usage, entry.get('truncated', False)
+
+            if self.strict_replay:
+                raise KeyError(f"录制文件中没有该请求的回复: {key[:12]}")
+            with self._lock:
+                self.stats['misses'] += 1
+            CACHE_REQUESTS.labels(cache="mock_cassette", result="miss").inc()
+            logger.debug(f"录制文件中没有该请求 ({key[:12]})，使用合成回复")
+
+        self._count('synthetic')
+        return self._synthetic(prompt, max_tokens)
+
+
+_mock_client: Optional[MockLLMClient] = None
+_mock_client_lock = threading.Lock()
+
+
+def get_mock_llm_client() -> MockLLMClient:
+    """获取进程级模拟 LLM 客户端（按配置创建）"""
+    global _mock_client
+    with _mock_client_lock:
+        if _mock_client is None:
+            settings = get_settings()
+            _mock_client = MockLLMClient(
+                mode=settings.mock_llm_mode,
+                cassette_path=settings.mock_llm_cassette,
+                latency_ms=settings.mock_llm_latency_ms,
+                tokens_per_second=settings.mock_llm_tokens_per_second,
+                strict_replay=settings.mock_llm_strict_replay
+            )
+        return _mock_client
+
+
+def set_mock_llm_client(client: Optional[MockLLMClient]):
+    """替换进程级模拟客户端（基准测试在同一进程内切换模式时使用）"""
+    global _mock_client
+    with _mock_client_lock:
+        _mock_client = client
@@ -0,0 +1,215 @@
+"""测试输出落盘
+
+大仓库一次 go test / ginkgo / 编译的输出可达数百 MB，原来整段读入内存后又被日志、测试结果和修复提示词各持有一份。
+现在子进程输出逐行处理：
+- 完整输出写入磁盘上的环形分段文件（{workspace_dir}/test-output/ 下），总大小超过 test_output_spool_max_bytes
+  时丢弃最早的分段
+- 内存中只保留末尾 test_output_tail_bytes（作为结果中的 output，也用于日志）
+- 修复提示词只使用与测试文件相关的失败片段，每个文件不超过 test_output_excerpt_bytes
+
+worker 的内存占用因此不随测试输出大小增长
+"""
+
+import shutil
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from app.config import get_settings
+
+
+OUTPUT_DIR = "test-output"
+
+# 环形文件的分段数（丢弃时按分段整体丢弃）
+SEGMENTS = 4
+
+# 摘录时每处匹配前后保留的行数
+EXCERPT_CONTEXT_LINES = 5
+
+
+def clip_text(text: str, limit: int) -> str:
+    """文本超过 limit 时保留开头和末尾，中间替换为省略说明"""
+    if len(text) <= limit:
+        return text
+    half = max(1, limit // 2)
+    return f"{text[:half]}\n... (省略 {len(text) - 2 * half} 字符) ...\n{text[-half:]}"
+
+
+class BoundedText:
+    """只保留开头和末尾的文本缓冲（中间部分丢弃并记录省略的字符数）"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.head: List[str] = []
+        self.head_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.omitted = 0
+
+    def append(self, text: str) -> None:
+        text = text[:self.limit]
+        if self.head_size + len(text) <= self.limit // 2:
+            self.head.append(text)
+            self.head_size += len(text)
+            return
+        self.tail.append(text)
+        self.tail_size += len(text)
+        while self.tail_size > self.limit - self.head_size and len(self.tail) > 1:
+            dropped = self.tail.popleft()
+            self.tail_size -= len(dropped)
+            self.omitted += len(dropped)
+
+    def __bool__(self) -> bool:
+        return bool(self.head or self.tail)
+
+    def render(self) -> str:
+        middle = f"... (省略 {self.omitted} 字符) ...\n" if self.omitted else ""
+        return "".join(self.head) + middle + "".join(self.tail)
+
+
+class OutputSpool:
+    """
+    一次命令执行的输出（写入磁盘环形分段文件，内存中只保留末尾）
+
+    由 TestExecutor 的输出读取线程写入（内部加锁），执行结束后关闭；关闭后仍可按行重新读取
+    """
+
+    def __init__(self, directory: Path, max_bytes: Optional[int] = None, tail_bytes: Optional[int] = None):
+        settings = get_settings()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = max(1, (max_bytes or settings.test_output_spool_max_bytes) // SEGMENTS)
+        self.tail_bytes = tail_bytes or settings.test_output_tail_bytes
+        self.total_bytes = 0
+        self.dropped_bytes = 0
+        self._segments = deque()
+        self._segment_index = 0
+        self._file = None
+        self._file_size = 0
+        self._tail = deque()
+        self._tail_size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> str:
+        return str(self.directory)
+
+    def _rotate(self) -> None:
+        if self._file:
+            self._file.close()
+        self._segment_index += 1
+        segment = self.directory / f"{self._segment_index:06d}.log"
+        self._segments.append(segment)
+        self._file = open(segment, 'w', encoding='utf-8', errors='replace')
+        self._file_size = 0
+        while len(self._segments) > SEGMENTS:
+            oldest = self._segments.popleft()
+            self.dropped_bytes += oldest.stat().st_size
+            oldest.unlink()
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        with self._lock:
+            if self._file is None or self._file_size >= self.segment_bytes:
+                self._rotate()
+            self._file.write(text)
+            self._file_size += len(text)
+            self.total_bytes += len(text)
+
+            self._tail.append(text)
+            self._tail_size += len(text)
+            while self._tail_size > self.tail_bytes and len(self._tail) > 1:
+                self._tail_size -= len(self._tail.popleft())
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def tail(self) -> str:
+        """内存中保留的输出末尾"""
+        with self._lock:
+            text = "".join(self._tail)
+        if self.total_bytes > len(text):
+            return f"... (前 {self.total_bytes - len(text)} 字符见 {self.path}) ...\n{text}"
+        return text
+
+    def lines(self) -> Iterator[str]:
+        """按行读取输出（超出上限被丢弃的部分不再可读）"""
+        return read_lines(self.path)
+
+
+def read_lines(path: str) -> Iterator[str]:
+    """按行读取输出目录中的分段文件"""
+    directory = Path(path)
+    if not directory.is_dir():
+        return
+    for segment in sorted(directory.glob("*.log")):
+        try:
+            with open(segment, 'r', encoding='utf-8', errors='replace') as f:
+                yield from f
+        except FileNotFoundError:
+            continue
+
+
+def excerpt_for_files(
+    lines: Iterable[str],
+    file_names: Dict[str, str],
+    limit: Optional[int] = None,
+    context_lines: int = EXCERPT_CONTEXT_LINES
+) -> Dict[str, str]:
+    """
+    从输出中摘录与各文件相关的片段（出现文件名的行及其前后几行）
+
+    Args:
+        lines: 输出行
+        file_names: {键: 要匹配的文件名}
+        limit: 每个文件的摘录上限（默认 test_output_excerpt_bytes）
+        context_lines: 每处匹配前后保留的行数
+
+    Returns:
+        {键: 摘录}（没有匹配的文件不出现在结果中）
+    """
+    limit = limit or get_settings().test_output_excerpt_bytes
+    excerpts: Dict[str, BoundedText] = {}
+    before = deque(maxlen=context_lines)
+    # 各文件还需要追加的后续行数、最后追加的行号
+    pending: Dict[str, int] = {}
+    last_line: Dict[str, int] = {}
+
+    for number, line in enumerate(lines):
+        matched = [key for key, name in file_names.items() if name in line]
+        for key in matched:
+            buffer = excerpts.setdefault(key, BoundedText(limit))
+            context = [(n, text) for n, text in before if n > last_line.get(key, -1)]
+            # 与上一处片段不相邻时用空行分隔
+            if buffer and (context[0][0] if context else number) > last_line[key] + 1:
+                buffer.append("\n")
+            for _, text in context:
+                buffer.append(text)
+            buffer.append(line)
+            last_line[key] = number
+            pending[key] = context_lines
+        for key in list(pending):
+            if key in matched:
+                continue
+            excerpts[key].append(line)
+            last_line[key] = number
+            pending[key] -= 1
+            if pending[key] <= 0:
+                del pending[key]
+        before.append((number, line))
+
+    return {key: buffer.render() for key, buffer in excerpts.items()}
+
+
+def spool_root() -> Path:
+    return Path(get_settings().workspace_dir) / OUTPUT_DIR
+
+
+def remove_spools(directory: Path) -> None:
+    """删除输出目录（删除失败不影响任务）"""
+    shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,228 @@
+"""补丁模式修复模块
+
+修复大测试文件时不再发送整个文件、让模型重新输出整个文件，而是：
+1. 根据错误输出中的行号、失败的测试函数名定位出错区域，只发送这些区域（带行号）和文件头部的导入
+2. 要求模型只返回 SEARCH/REPLACE 修改块
+3. 在本地按内容把修改块应用到原文件
+
+修改块无法应用（SEARCH 内容在原文件中找不到或不唯一）时返回 None，由调用方回退到整文件修复
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from app.services.failure_clusters import parse_compiler_errors
+
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER_MARKER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+
+_BLOCK_RE = re.compile(
+    r'^<<<<<<< SEARCH[ \t]*\n(?P<search>.*?)^=======[ \t]*\n(?P<replace>.*?)^>>>>>>> REPLACE[ \t]*$',
+    re.DOTALL | re.MULTILINE
+)
+# go test / Ginkgo / Google Test 输出中的失败测试名
+_FAILED_TEST_RE = re.compile(r'--- FAIL: (?P<go>\w+)|\[  FAILED  \] (?:\w+\.)?(?P<gtest>\w+)')
+# 文件被截断时补丁模式无从定位，直接整文件修复
+_TRUNCATED_RE = re.compile(r"found 'EOF'|unexpected EOF|at end of input")
+
+# 文件头部（package / import / #include）最多发送的行数
+HEADER_MAX_LINES = 40
+
+
+def locate_error_lines(code: str, error_text: str, file_name: Optional[str] = None) -> List[int]:
+    """
+    从错误输出中找出测试文件的出错行（从 1 开始）
+
+    Args:
+        code: 测试代码
+        error_text: 编译器 / gofmt / 测试执行输出
+        file_name: 测试文件名（为空时错误输出中的行号都视为该文件的行号）
+
+    Returns:
+        排好序的行号列表
+    """
+    lines = code.split("\n")
+    found = {error['line'] for error in parse_compiler_errors(error_text, file_name) if error['line']}
+
+    # 运行期失败: calc_test.go:15: ... / calc_test.cpp:23: Failure / Ginkgo 的 [FAILED] ... calc_test.go:45
+    if file_name:
+        for match in re.finditer(rf'{re.escape(file_name)}:(\d+)', error_text):
+            found.add(int(match.group(1)))
+
+    # 失败的测试函数（没有行号时定位到函数声明）
+    for match in _FAILED_TEST_RE.finditer(error_text):
+        name = match.group('go') or match.group('gtest')
+        pattern = re.compile(rf'^func\s+{re.escape(name)}\s*\(|^\s*TEST(?:_F|_P)?\s*\(\s*\w+\s*,\s*{re.escape(name)}\s*\)')
+        for index, line in enumerate(lines):
+            if pattern.search(line):
+                found.add(index + 1)
+                break
+
+    return sorted(line for line in found if 1 <= line <= len(lines))
+
+
+def _header_end(lines: List[str]) -> int:
+    """文件头部（package / import / #include 等声明）结束的行号（不含）"""
+    end = 0
+    in_import = False
+    for index, line in enumerate(lines[:HEADER_MAX_LINES]):
+        stripped = line.strip()
+        if in_import:
+            end = index + 1
+            if stripped.startswith(')'):
+                in_import = False
+            continue
+        if stripped.startswith(('package ', '#include', '#define', 'using ', 'extern "C"')):
+            end = index + 1
+        elif stripped.startswith('import'):
+            end = index + 1
+            in_import = stripped.endswith('(')
+        elif stripped and not stripped.startswith(('//', '/*', '*')):
+            break
+    return end
+
+
+def build_excerpt(code: str, error_lines: List[int], context_lines: int, max_ratio: float) -> Optional[str]:
+    """
+    生成带行号的出错区域片段（包含文件头部，相邻区域合并）
+
+    Args:
+        code: 测试代码
+        error_lines: 出错行号
+        context_lines: 每个出错行前后保留的行数
+        max_ratio: 片段超过文件行数的该比例时返回 None（不如整文件修复）
+
+    Returns:
+        片段文本；没有出错行或片段过大时返回 None
+    """
+    if not error_lines:
+        return None
+
+    lines = code.split("\n")
+    ranges = []
+    header_end = _header_end(lines)
+    if header_end:
+        ranges.append((0, header_end))
+    for line in error_lines:
+        ranges.append((max(0, line - 1 - context_lines), min(len(lines), line + context_lines)))
+
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    covered = sum(end - start for start, end in merged)
+    if covered > len(lines) * max_ratio:
+        return None
+
+    width = len(str(len(lines)))
+    parts = []
+    for start, end in merged:
+        if start > 0:
+            parts.append("...")
+        parts.extend(f"{index + 1:>{width}} | {lines[index]}" for index in range(start, end))
+    if merged[-1][1] < len(lines):
+        parts.append("...")
+    return "\n".join(parts)
+
+
+def build_patch_prompt(
+    language: str,
+    excerpt: str,
+    error_text: str,
+    total_lines: int,
+    source_file: str,
+    max_error_chars: int = 4000
+) -> str:
+    """构建补丁模式的修复提示词"""
+    if len(error_text) > max_error_chars:
+        error_text = error_text[:max_error_chars] + "\n... (输出过长已截断)"
+
+    return f"""以下{language}测试文件（共 {total_lines} 行）存在错误。下面只给出了文件头部和出错位置附近的代码（每行前面是行号）。
+
+## 错误信息
+```
+{error_text}
+```
+
+## 代码片段
+```
+{excerpt}
+```
+
+## 测试目标
+源文件: {source_file}
+
+## 输出格式
+不要输出完整文件，只输出修改块，每个修改块的格式如下：
+
+{SEARCH_MARKER}
+原文件中连续的若干行（必须与原文逐字一致，不要带行号和 "|"）
+{DIVIDER_MARKER}
+替换后的代码
+{REPLACE_MARKER}
+
+要求：
+1. 可以输出多个修改块，每个 SEARCH 内容必须能在原文件中唯一定位（必要时多包含几行上下文）
+2. 需要新增导入时，以 import 块（或 #include）中的已有行作为 SEARCH 内容，在 REPLACE 中保留该行并追加新行
+3. 只修复错误相关的代码，不要修改其他测试
+4. 除修改块外不要输出任何解释
+"""
+
+
+def parse_patch_blocks(text: str) -> List[Dict]:
+    """解析模型返回的 SEARCH/REPLACE 修改块: [{'search', 'replace'}]"""
+    text = text.replace("\r\n", "\n")
+    blocks = []
+    for match in _BLOCK_RE.finditer(text):
+        search = match.group('search').rstrip("\n")
+        replace = match.group('replace').rstrip("\n")
+        blocks.append({'search': search, 'replace': replace})
+    return blocks
+
+
+def _locate(lines: List[str], search_lines: List[str]) -> Optional[int]:
+    """在原文件中唯一定位 SEARCH 内容（先精确匹配，再忽略行首尾空白匹配），找不到或不唯一时返回 None"""
+    for normalize in (lambda line: line.rstrip(), lambda line: line.strip()):
+        target = [normalize(line) for line in search_lines]
+        hits = [
+            i for i in range(len(lines) - len(target) + 1)
+            if [normalize(line) for line in lines[i:i + len(target)]] == target
+        ]
+        if len(hits) == 1:
+            return hits[0]
+        if len(hits) > 1:
+            return None
+    return None
+
+
+def apply_patch_blocks(code: str, blocks: List[Dict]) -> Optional[str]:
+    """
+    按顺序把修改块应用到代码
+
+    Returns:
+        修改后的代码；没有修改块或任一修改块无法唯一定位时返回 None
+    """
+    if not blocks:
+        return None
+
+    lines = code.split("\n")
+    for block in blocks:
+        search_lines = block['search'].split("\n")
+        if not any(line.strip() for line in search_lines):
+            return None
+        index = _locate(lines, search_lines)
+        if index is None:
+            return None
+        replace_lines = block['replace'].split("\n") if block['replace'] else []
+        lines[index:index + len(search_lines)] = replace_lines
+    return "\n".join(lines)
+
+
+def is_truncation_error(error_text: str) -> bool:
+    """错误是否由文件被截断引起"""
+    return bool(_TRUNCATED_RE.search(error_text))
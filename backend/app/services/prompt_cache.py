@@ -0,0 +1,110 @@
+"""提示词前缀缓存模块
+
+系统提示词、框架规则、模块/包信息在同一任务的每次请求中都完全相同，只有函数列表和源码片段在变化。
+请求消息按 [系统提示词] [固定前缀] [可变部分] 的顺序组织，让提供商的提示词缓存命中固定前缀：
+- Anthropic: 在系统提示词和固定前缀的内容块上标记 cache_control，命中部分按缓存价计费
+- OpenAI / 本地模型（vLLM 等）: 按最长公共前缀自动缓存，只需保证前缀逐字节稳定
+
+并统一解析各提供商返回的缓存命中 token 数，用于按任务统计缓存命中情况
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+
+# Anthropic 缓存断点标记（5 分钟内重复的前缀直接命中）
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def join_prompt(prompt: str, prompt_prefix: Optional[str] = None) -> str:
+    """把固定前缀和可变部分拼成完整的用户提示词"""
+    if not prompt_prefix:
+        return prompt
+    return f"{prompt_prefix}\n\n{prompt}"
+
+
+def build_openai_messages(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    prompt_prefix: Optional[str] = None
+) -> List[Dict]:
+    """构建 OpenAI 兼容接口的消息（固定前缀在用户消息开头，由服务端自动缓存）"""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": join_prompt(prompt, prompt_prefix)})
+    return messages
+
+
+def build_anthropic_request(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    prompt_prefix: Optional[str] = None,
+    cache_enabled: bool = True
+) -> Dict:
+    """
+    构建 Anthropic Messages 接口的 system 和 messages 参数
+
+    固定前缀作为用户消息的第一个内容块，缓存断点打在系统提示词和固定前缀上
+    （系统提示词较短时单独不足以缓存，但与固定前缀一起构成可缓存的前缀）
+
+    Returns:
+        可直接展开到 messages.create 的参数: {'messages', 'system'(可选)}
+    """
+    def block(text: str) -> Dict:
+        content = {"type": "text", "text": text}
+        if cache_enabled:
+            content["cache_control"] = CACHE_CONTROL
+        return content
+
+    request = {}
+    if system_prompt:
+        request['system'] = [block(system_prompt)] if cache_enabled else system_prompt
+
+    if prompt_prefix:
+        content = [block(prompt_prefix), {"type": "text", "text": prompt}]
+    else:
+        content = prompt
+    request['messages'] = [{"role": "user", "content": content}]
+    return request
+
+
+def openai_usage(usage) -> Optional[Tuple[int, int, int]]:
+    """
+    解析 OpenAI 兼容接口的用量
+
+    Returns:
+        (输入tokens, 输出tokens, 其中命中缓存的输入tokens)；没有用量信息时返回 None
+    """
+    if not usage:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    if isinstance(details, dict):
+        cached = details.get('cached_tokens')
+    else:
+        cached = getattr(details, 'cached_tokens', None)
+    return usage.prompt_tokens, usage.completion_tokens, cached or 0
+
+
+def anthropic_input_tokens(usage) -> Tuple[int, int]:
+    """
+    解析 Anthropic 的输入用量（input_tokens 不含缓存读取和缓存写入的部分，需要加回）
+
+    Returns:
+        (全部输入tokens, 其中命中缓存的输入tokens)
+    """
+    cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+    cache_creation = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    return usage.input_tokens + cache_read + cache_creation, cache_read
+
+
+def anthropic_usage(usage) -> Optional[Tuple[int, int, int]]:
+    """
+    解析 Anthropic 的用量
+
+    Returns:
+        (输入tokens, 输出tokens, 其中命中缓存的输入tokens)；没有用量信息时返回 None
+    """
+    if not usage:
+        return None
+    input_tokens, cached = anthropic_input_tokens(usage)
+    return input_tokens, usage.output_tokens, cached
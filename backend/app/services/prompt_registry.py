@@ -0,0 +1,331 @@
+"""提示词模板注册表
+
+生成 / 修复提示词的正文放在 app/prompts/*.tmpl 中，由注册表加载并预编译一次：
+- 模板使用 ${name} 占位符（$$ 表示字面的 $），编译时拆分为 字面文本 / 占位符 片段，渲染只做一次拼接
+- 函数签名、函数源码、相关类型定义等由分析结果生成的片段通过共享缓存渲染，
+  同一函数在生成、分组生成、修复等多个提示词中只格式化一次；含函数源码的片段按 (文件, 函数名, 行区间) 缓存，
+  命中时不读取函数体
+- 支持不重新部署的覆盖：项目仓库中的 .aitest/prompts/<模板名>.tmpl（PROMPT_PROJECT_OVERRIDES 开启时）优先，其次是 PROMPT_TEMPLATE_DIR，
+  最后是内置模板；覆盖文件修改后在 PROMPT_TEMPLATE_RELOAD_INTERVAL 秒内生效
+- 每次渲染的耗时记录到 aitest_prompt_build_seconds{template}
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from functools import lru_cache
+from pathlib import Path
+from string import Template
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from loguru import logger
+
+from app.config import get_settings
+from app.services.metrics import PROMPT_BUILD_DURATION
+
+
+# 内置模板目录
+BUILTIN_TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "prompts"
+
+# 项目仓库中的模板覆盖目录（相对仓库根目录）
+PROJECT_TEMPLATE_DIR = ".aitest/prompts"
+
+TEMPLATE_SUFFIX = ".tmpl"
+
+# 片段缓存的最大条目数（按函数 / 类型定义计）
+FRAGMENT_CACHE_SIZE = 4096
+
+
+class CompiledTemplate:
+    """预编译的提示词模板"""
+
+    def __init__(self, name: str, source: str, path: Optional[Path] = None):
+        self.name = name
+        self.path = path
+        # [(字面文本, 占位符名或 None)]
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        self.placeholders = set()
+
+        position = 0
+        for match in Template.pattern.finditer(source):
+            literal = source[position:match.start()]
+            position = match.end()
+            if match.group('escaped') is not None:
+                self.parts.append((literal + '$', None))
+            elif match.group('invalid') is not None:
+                line = source[:match.start()].count("\n") + 1
+                raise ValueError(f"提示词模板 {path or name} 第 {line} 行的占位符无效")
+            else:
+                placeholder = match.group('named') or match.group('braced')
+                self.parts.append((literal, placeholder))
+                self.placeholders.add(placeholder)
+        self.parts.append((source[position:], None))
+
+    def render(self, values: Dict) -> str:
+        """
+        渲染模板
+
+        Raises:
+            KeyError: 缺少模板中用到的占位符
+        """
+        chunks = []
+        for literal, placeholder in self.parts:
+            chunks.append(literal)
+            if placeholder is not None:
+                if placeholder not in values:
+                    raise KeyError(f"提示词模板 {self.name} 缺少参数: {placeholder}")
+                chunks.append(str(values[placeholder]))
+        return "".join(chunks)
+
+
+class PromptRegistry:
+    """提示词模板注册表（进程内共享，线程安全）"""
+
+    def __init__(self, builtin_dir: Path = BUILTIN_TEMPLATE_DIR):
+        self.settings = get_settings()
+        self.builtin_dir = builtin_dir
+        self.override_dir = Path(self.settings.prompt_template_dir) if self.settings.prompt_template_dir else None
+        self.reload_interval = self.settings.prompt_template_reload_interval
+        # 路径 -> (修改时间, 编译后的模板, 下次检查修改时间的时刻)
+        self._compiled: Dict[Path, Tuple[float, CompiledTemplate, float]] = {}
+        # (项目目录, 模板名) -> (下次查找的时刻, 模板路径)
+        self._resolved: Dict[Tuple[Optional[str], str], Tuple[float, Path]] = {}
+        self._lock = threading.Lock()
+
+    def _search_dirs(self, project_dir: Optional[str]) -> List[Path]:
+        """模板查找目录（优先级从高到低）"""
+        dirs = []
+        if project_dir and self.settings.prompt_project_overrides:
+            dirs.append(Path(project_dir) / PROJECT_TEMPLATE_DIR)
+        if self.override_dir:
+            dirs.append(self.override_dir)
+        dirs.append(self.builtin_dir)
+        return dirs
+
+    def _resolve(self, name: str, project_dir: Optional[str]) -> Path:
+        """查找模板文件（结果缓存一段时间，避免每次渲染都访问文件系统）"""
+        key = (project_dir, name)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._resolved.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        file_name = f"{name}{TEMPLATE_SUFFIX}"
+        for directory in self._search_dirs(project_dir):
+            path = directory / file_name
+            if path.is_file():
+                break
+        else:
+            raise KeyError(f"提示词模板不存在: {name}")
+
+        with self._lock:
+            self._resolved[key] = (now + self.reload_interval, path)
+        return path
+
+    def get(self, name: str, project_dir: Optional[str] = None) -> CompiledTemplate:
+        """
+        获取编译后的模板（覆盖模板的文件修改后重新编译）
+
+        Args:
+            name: 模板名（不含扩展名）
+            project_dir: 项目仓库目录（用于查找项目级覆盖）
+        """
+        path = self._resolve(name, project_dir)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._compiled.get(path)
+        # 内置模板随代码发布，不检查修改时间
+        if entry and (path.parent == self.builtin_dir or entry[2] > now):
+            return entry[1]
+
+        mtime = path.stat().st_mtime
+        if entry and entry[0] == mtime:
+            template = entry[1]
+        else:
+            template = CompiledTemplate(name, path.read_text(encoding='utf-8'), path)
+            if path.parent != self.builtin_dir:
+                logger.info(f"📝 使用覆盖的提示词模板: {path}")
+        with self._lock:
+            self._compiled[path] = (mtime, template, now + self.reload_interval)
+        return template
+
+    def render(self, name: str, project_dir: Optional[str] = None, **values) -> str:
+        """渲染模板并记录耗时"""
+        started = time.perf_counter()
+        text = self.get(name, project_dir).render(values)
+        PROMPT_BUILD_DURATION.labels(template=name).observe(time.perf_counter() - started)
+        return text
+
+    def invalidate(self):
+        """清空已编译的模板（覆盖目录变化后立即生效）"""
+        with self._lock:
+            self._compiled.clear()
+            self._resolved.clear()
+
+
+# ==================== 共享片段 ====================
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _go_signature(name: str, params: Tuple[str, ...], return_type: str, receiver: str) -> str:
+    signature = f"func {name}({', '.join(params)}) {return_type}"
+    if receiver:
+        signature = f"func ({receiver}) {name}({', '.join(params)}) {return_type}"
+    return signature
+
+
+def go_signature(func: Dict) -> str:
+    """Go 函数签名（由代码分析结果生成）"""
+    return _go_signature(
+        func.get('name', ''),
+        tuple(func.get('params', [])),
+        func.get('return_type', ''),
+        func.get('receiver', '')
+    )
+
+
+_sections: "OrderedDict[Tuple, str]" = OrderedDict()
+_sections_lock = threading.Lock()
+
+
+def _cached_section(key: Tuple, build: Callable[[], str]) -> str:
+    """按键缓存含函数实现的片段（未命中时才构建，因而才读取函数体）"""
+    with _sections_lock:
+        section = _sections.get(key)
+        if section is not None:
+            _sections.move_to_end(key)
+            return section
+
+    section = build()
+    with _sections_lock:
+        _sections[key] = section
+        while len(_sections) > FRAGMENT_CACHE_SIZE:
+            _sections.popitem(last=False)
+    return section
+
+
+def function_key(file_path: str, func: Mapping, *extra: Any) -> Tuple:
+    """
+    函数片段的缓存键：(文件, 函数名, 接收者, 行区间, 源文件版本, *extra)
+
+    不含函数体，避免每次查找都读取并哈希整个函数体；源文件版本取自 FunctionInfo 的源文件映射，
+    仓库更新后同一区间的内容变化时不会命中旧片段。extra 为影响函数体内容的其他参数（如 token 预算）
+    """
+    source = getattr(func, 'source', None)
+    return (
+        file_path,
+        func.get('name', ''),
+        func.get('receiver') or '',
+        func.get('start_line', 0),
+        func.get('end_line', 0),
+        source.stamp if source is not None else None,
+        *extra
+    )
+
+
+def function_source_section(key: Tuple, signature: str, body: Callable[[], str], language: str = "go") -> str:
+    """
+    函数签名 + 函数实现片段
+
+    Args:
+        key: function_key() 生成的缓存键
+        body: 返回函数实现的函数（只在缓存未命中时调用）
+    """
+    return _cached_section(
+        ('source', key, signature, language),
+        lambda: f"### {signature}\n```{language}\n{body()}\n```"
+    )
+
+
+def strategy_function_section(
+    key: Tuple,
+    signature: str,
+    body: Callable[[], str],
+    executable_lines: int,
+    complexity: int,
+    counts: Tuple[int, int, int, int],
+    language: str = "go"
+) -> str:
+    """
+    函数签名 + 测试用例数量建议 + 函数实现片段
+
+    Args:
+        key: function_key() 生成的缓存键
+        body: 返回函数实现的函数（只在缓存未命中时调用）
+        counts: (建议测试用例数, 正常, 边界, 异常)
+    """
+    test_count, normal_count, edge_count, error_count = counts
+    return _cached_section(
+        ('strategy', key, signature, executable_lines, complexity, counts, language),
+        lambda: (
+            f"### {signature}\n"
+            f"**代码行数**: {executable_lines}行 | **复杂度**: {complexity} | "
+            f"**建议测试用例**: {test_count}个 (正常:{normal_count}, 边界:{edge_count}, 异常:{error_count})\n\n"
+            f"**函数实现**:\n```{language}\n{body()}\n```"
+        )
+    )
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def strategy_function_line(
+    signature: str,
+    executable_lines: int,
+    complexity: int,
+    counts: Tuple[int, int, int, int]
+) -> str:
+    """函数签名 + 测试用例数量建议（不含函数实现的简短列表项）"""
+    test_count, normal_count, edge_count, error_count = counts
+    return (
+        f"- {signature}\n"
+        f"  (代码{executable_lines}行, 复杂度{complexity}, "
+        f"建议{test_count}个测试: 正常{normal_count}+边界{edge_count}+异常{error_count})"
+    )
+
+
+def strategy_counts(func_strategy: Dict) -> Tuple[int, int, int, int]:
+    """测试用例策略中的 (建议测试用例数, 正常, 边界, 异常)"""
+    return (
+        func_strategy.get('total_count', 3),
+        func_strategy.get('normal_cases', 1),
+        func_strategy.get('edge_cases', 1),
+        func_strategy.get('error_cases', 1)
+    )
+
+
+@lru_cache(maxsize=FRAGMENT_CACHE_SIZE)
+def _type_definition(name: str, kind: str, members: Tuple[str, ...]) -> str:
+    keyword = 'struct' if kind == 'struct' else 'interface'
+    body = "\n".join(f"\t{member}" for member in members)
+    return f"type {name} {keyword} {{\n{body}\n}}"
+
+
+def context_types_section(context_types: List[Dict]) -> str:
+    """
+    相关类型定义片段（分组生成时共享结构体/接口上下文）
+
+    Returns:
+        提示词片段，没有相关类型时返回空字符串
+    """
+    if not context_types:
+        return ""
+
+    definitions = []
+    for type_def in context_types:
+        kind = type_def.get('kind')
+        members = type_def.get('fields', []) if kind == 'struct' else type_def.get('methods', [])
+        definitions.append(_type_definition(type_def.get('name', ''), kind, tuple(members)))
+
+    return "## 相关类型定义\n```go\n" + "\n\n".join(definitions) + "\n```\n\n"
+
+
+_prompt_registry: Optional[PromptRegistry] = None
+_prompt_registry_lock = threading.Lock()
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """获取进程级提示词模板注册表"""
+    global _prompt_registry
+    with _prompt_registry_lock:
+        if _prompt_registry is None:
+            _prompt_registry = PromptRegistry()
+        return _prompt_registry
@@ -630,7 +630,7 @@ AfterEach(func() {{
         functions_info: List[Dict],
         source_code_snippet: str = ""
     ) -> str:
-        """Ginkgo 整个文件测试提示词"""
+        """Ginkgo 整个文件测试提示词（固定前缀在前，文件相关的内容在后）"""
         
         # 构建函数列表
         functions_list = []
@@ -651,16 +651,27 @@ AfterEach(func() {{
 ```
 """
         
-        return f"""请为以下Go源文件的函数生成Ginkgo BDD测试逻辑。
+        return f"""{PromptTemplates.golang_ginkgo_file_prefix(module_path, package_name)}
 
-## 项目信息
-- Go模块路径: {module_path}
-- 包名: {package_name}
+## 源文件
 - 文件路径: {file_path}
 
 ## 需要测试的函数
 {functions_list_str}
-{source_section}
+{source_section}"""
+    
+    @staticmethod
+    def golang_ginkgo_file_prefix(module_path: str, package_name: str) -> str:
+        """
+        Ginkgo 整个文件测试提示词的固定前缀
+        
+        框架规则、测试模板和模块/包信息在同一个包的所有文件间完全相同，放在提示词最前面以命中提供商的提示词缓存
+        """
+        return f"""请为下面给出的Go源文件的函数生成Ginkgo BDD测试逻辑。
+
+## 项目信息
+- Go模块路径: {module_path}
+- 包名: {package_name}
 
 ## 重要规则（必须严格遵守）
 
@@ -688,7 +699,7 @@ import (
 - 为每个函数生成一个 Describe 块
 - 使用 Context 组织不同的测试场景
 - 使用 It 编写具体的测试用例
-- 根据上面的建议测试用例数量生成测试
+- 根据下方的建议测试用例数量生成测试
 
 ### 3. 测试策略
 **根据函数类型选择策略**:
@@ -885,7 +896,7 @@ var _ = Describe("XdyEcsBillCase", func() {{
 请只返回测试逻辑代码，包含所有函数的 Describe 块。
 不要包含 package 声明、import 语句和套件注册函数。
 
-请参考上面的优秀模板，为所有函数生成结构清晰、覆盖全面的测试逻辑。
+请参考上面的优秀模板，为下面源文件中的所有函数生成结构清晰、覆盖全面的测试逻辑。
 """
     
     @staticmethod
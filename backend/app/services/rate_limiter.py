@@ -0,0 +1,518 @@
+"""LLM 限流模块
+
+所有 worker 和 API 进程共享同一组 Redis 令牌桶，按 提供商/模型 同时限制
+每分钟请求数（RPM）和每分钟 token 数（TPM）；进程内再用 AIMD 自适应并发：
+- 成功且延迟正常时并发上限缓慢增加（加性增）
+- 收到 429 或延迟超过目标时并发上限快速下降（乘性减），并通知所有进程暂停
+
+Redis 不可用时自动退化为进程内令牌桶，不影响生成流程
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+from loguru import logger
+
+from app.config import get_settings
+from app.services.metrics import LLM_WAITING
+
+
+# Redis 键前缀
+KEY_PREFIX = "aitest:llm"
+
+# Redis 不可用后，多久再尝试重连（秒）
+REDIS_RETRY_INTERVAL = 30
+
+# 原子地检查请求桶和 token 桶，两个桶都足够时才同时扣减
+# KEYS[1]: 请求桶  KEYS[2]: token 桶  KEYS[3]: 全局冷却键（429 后设置）
+# ARGV: 当前毫秒时间, 请求桶容量, 请求每毫秒补充量, token 桶容量, token 每毫秒补充量, 本次 token 消耗
+# 返回: 需要等待的毫秒数（0 表示已获取）
+_ACQUIRE_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[3])
+if cooldown > 0 then
+    return cooldown
+end
+
+local now = tonumber(ARGV[1])
+
+local function level_of(key, capacity, rate)
+    local data = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(data[1])
+    local ts = tonumber(data[2])
+    if level == nil or ts == nil then
+        return capacity
+    end
+    return math.min(capacity, level + math.max(0, now - ts) * rate)
+end
+
+local req_capacity = tonumber(ARGV[2])
+local req_rate = tonumber(ARGV[3])
+local tok_capacity = tonumber(ARGV[4])
+local tok_rate = tonumber(ARGV[5])
+local cost = tonumber(ARGV[6])
+
+local wait = 0
+local req_level = 0
+local tok_level = 0
+
+if req_capacity > 0 then
+    req_level = level_of(KEYS[1], req_capacity, req_rate)
+    if req_level < 1 then
+        wait = math.max(wait, (1 - req_level) / req_rate)
+    end
+end
+
+if tok_capacity > 0 then
+    cost = math.min(cost, tok_capacity)
+    tok_level = level_of(KEYS[2], tok_capacity, tok_rate)
+    if tok_level < cost then
+        wait = math.max(wait, (cost - tok_level) / tok_rate)
+    end
+end
+
+if wait > 0 then
+    return math.ceil(wait)
+end
+
+if req_capacity > 0 then
+    redis.call('HSET', KEYS[1], 'level', req_level - 1, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], 120000)
+end
+if tok_capacity > 0 then
+    redis.call('HSET', KEYS[2], 'level', tok_level - cost, 'ts', now)
+    redis.call('PEXPIRE', KEYS[2], 120000)
+end
+return 0
+"""
+
+# 归还预扣但未使用的 token（不超过桶容量）
+# KEYS[1]: token 桶  ARGV: token 桶容量, 归还数量
+_REFUND_SCRIPT = """
+local level = tonumber(redis.call('HGET', KEYS[1], 'level'))
+if level == nil then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'level', math.min(tonumber(ARGV[1]), level + tonumber(ARGV[2])))
+return 1
+"""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为提供商返回的限流错误（HTTP 429）"""
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    return type(error).__name__ == 'RateLimitError'
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """从限流错误的响应头中读取 Retry-After（秒）"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        value = headers.get('retry-after')
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _provider_quota(provider: str) -> Tuple[int, int]:
+    """提供商的 (RPM, TPM) 配额；本地模型服务和模拟提供商没有配额（0 表示不限制）"""
+    if provider in ("local", "mock"):
+        return 0, 0
+    settings = get_settings()
+    return settings.llm_requests_per_minute, settings.llm_tokens_per_minute
+
+
+class _LocalTokenBucket:
+    """进程内令牌桶（Redis 不可用时的退化实现）"""
+
+    def __init__(self, capacity: float, rate_per_ms: float):
+        self.capacity = capacity
+        self.rate_per_ms = rate_per_ms
+        self.level = capacity
+        self.ts = time.monotonic() * 1000
+
+    def _refill(self, now_ms: float):
+        self.level = min(self.capacity, self.level + (now_ms - self.ts) * self.rate_per_ms)
+        self.ts = now_ms
+
+    def wait_ms(self, cost: float, now_ms: float) -> float:
+        """获取 cost 个令牌还需等待的毫秒数"""
+        if self.capacity <= 0:
+            return 0
+        self._refill(now_ms)
+        cost = min(cost, self.capacity)
+        return 0 if self.level >= cost else (cost - self.level) / self.rate_per_ms
+
+    def take(self, cost: float):
+        if self.capacity > 0:
+            self.level -= min(cost, self.capacity)
+
+    def refund(self, amount: float):
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD 自适应并发限制器（进程内）"""
+
+    def __init__(self, max_limit: int, min_limit: int, latency_target: float):
+        """
+        初始化自适应并发限制器
+
+        Args:
+            max_limit: 并发上限的最大值
+            min_limit: 并发上限的最小值
+            latency_target: 目标延迟（秒），超过时视为过载信号
+        """
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.latency_target = latency_target
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.throttled = 0
+        self.errors = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency: float):
+        """请求成功：延迟正常时加性增，延迟过高时小幅乘性减"""
+        with self._cond:
+            if self.latency_target and latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def on_error(self, latency: float):
+        """请求出错（非 429）：超时等耗时超过目标延迟的失败视为过载信号，小幅乘性减"""
+        with self._cond:
+            self.errors += 1
+            if self.latency_target and latency > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            self._cond.notify_all()
+
+    def on_throttle(self):
+        """收到 429：并发上限减半"""
+        with self._cond:
+            self.throttled += 1
+            self.limit = max(self.min_limit, self.limit / 2)
+            logger.warning(f"🚦 收到限流响应，并发上限降至 {int(self.limit)}")
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'throttled': self.throttled,
+                'errors': self.errors
+            }
+
+
+class LLMRateLimiter:
+    """LLM 请求限流器（按 提供商/模型 区分）"""
+
+    def __init__(self, provider: str, model: str):
+        """
+        初始化限流器
+
+        Args:
+            provider: AI 提供商
+            model: 模型名称
+        """
+        self.settings = get_settings()
+        self.provider = provider
+        self.model = model or "default"
+        self.prefix = f"{KEY_PREFIX}:{provider}:{self.model}"
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+        # 桶容量为一分钟的配额，按毫秒匀速补充（0 表示不限制）
+        # 本地模型服务和模拟提供商没有配额，只限制并发
+        is_local = provider == "local"
+        self.rpm, self.tpm = _provider_quota(provider)
+
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            max_limit=self.settings.local_model_concurrency if is_local else self.settings.max_concurrent_llm_requests,
+            min_limit=self.settings.llm_min_concurrency,
+            latency_target=self.settings.llm_latency_target_seconds
+        )
+
+        self._local_lock = threading.Lock()
+        self._local_requests = _LocalTokenBucket(self.rpm, self.rpm / 60000)
+        self._local_tokens = _LocalTokenBucket(self.tpm, self.tpm / 60000)
+        self._local_cooldown_until = 0.0
+
+        self._redis = None
+        self._acquire_script = None
+        self._refund_script = None
+        self._redis_retry_at = 0.0
+
+    def _get_redis(self):
+        """获取 Redis 客户端（失败后一段时间内直接使用进程内限流）"""
+        if self._redis is not None:
+            return self._redis
+        if time.monotonic() < self._redis_retry_at:
+            return None
+
+        try:
+            import redis
+            client = redis.Redis.from_url(self.settings.redis_url, socket_timeout=2, socket_connect_timeout=2)
+            client.ping()
+            self._acquire_script = client.register_script(_ACQUIRE_SCRIPT)
+            self._refund_script = client.register_script(_REFUND_SCRIPT)
+            client.sadd(f"{KEY_PREFIX}:limiters", f"{self.provider}:{self.model}")
+            self._redis = client
+        except Exception as e:
+            self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+            logger.warning(f"⚠️ Redis 限流不可用，使用进程内限流: {e}")
+        return self._redis
+
+    def _drop_redis(self, error: Exception):
+        logger.warning(f"⚠️ Redis 限流出错，暂时使用进程内限流: {error}")
+        self._redis = None
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+
+    def _try_acquire(self, tokens: int) -> float:
+        """尝试扣减令牌，返回需要等待的毫秒数（0 表示已获取）"""
+        client = self._get_redis()
+        if client is not None:
+            try:
+                return float(self._acquire_script(
+                    keys=[f"{self.prefix}:requests", f"{self.prefix}:tokens", f"{self.prefix}:cooldown"],
+                    args=[int(time.time() * 1000), self.rpm, self.rpm / 60000, self.tpm, self.tpm / 60000, tokens],
+                    client=client
+                ))
+            except Exception as e:
+                self._drop_redis(e)
+
+        with self._local_lock:
+            now_ms = time.monotonic() * 1000
+            if now_ms < self._local_cooldown_until:
+                return self._local_cooldown_until - now_ms
+            wait = max(
+                self._local_requests.wait_ms(1, now_ms),
+                self._local_tokens.wait_ms(tokens, now_ms)
+            )
+            if wait <= 0:
+                self._local_requests.take(1)
+                self._local_tokens.take(tokens)
+            return wait
+
+    def _wait_for_budget(self, tokens: int):
+        """阻塞直到请求桶和 token 桶都有足够余量"""
+        if self.rpm <= 0 and self.tpm <= 0:
+            return
+
+        waited = 0.0
+        while True:
+            wait_ms = self._try_acquire(tokens)
+            if wait_ms <= 0:
+                break
+            # 最多等待 5 秒后重新检查，避免多个进程同时醒来
+            sleep = min(wait_ms / 1000, 5.0)
+            time.sleep(sleep)
+            waited += sleep
+
+        if waited >= 1:
+            logger.info(f"🚦 {self.provider}/{self.model} 限流等待 {waited:.1f}s")
+
+    def _refund_tokens(self, amount: int):
+        """归还预扣但未实际使用的 token"""
+        if self.tpm <= 0 or amount <= 0:
+            return
+        if self._redis is not None:
+            try:
+                self._refund_script(keys=[f"{self.prefix}:tokens"], args=[self.tpm, amount], client=self._redis)
+                return
+            except Exception as e:
+                self._drop_redis(e)
+        with self._local_lock:
+            self._local_tokens.refund(amount)
+
+    def _record(self, tokens: int):
+        """记录本分钟的请求数和 token 数，并上报本进程的并发状态"""
+        if self._redis is None:
+            return
+        minute = int(time.time() // 60)
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.incr(f"{self.prefix}:rpm:{minute}")
+            pipe.expire(f"{self.prefix}:rpm:{minute}", 180)
+            pipe.incrby(f"{self.prefix}:tpm:{minute}", tokens)
+            pipe.expire(f"{self.prefix}:tpm:{minute}", 180)
+            pipe.hset(f"{self.prefix}:workers", self.worker_id, json.dumps({
+                **self.concurrency.snapshot(),
+                'updated_at': int(time.time())
+            }))
+            pipe.expire(f"{self.prefix}:workers", 600)
+            pipe.execute()
+        except Exception as e:
+            self._drop_redis(e)
+
+    def _start_cooldown(self, error: Exception):
+        """收到 429 后让所有进程暂停发送请求"""
+        seconds = retry_after_seconds(error) or self.settings.llm_rate_limit_cooldown_seconds
+        with self._local_lock:
+            self._local_cooldown_until = time.monotonic() * 1000 + seconds * 1000
+        if self._redis is not None:
+            try:
+                self._redis.set(f"{self.prefix}:cooldown", 1, px=int(seconds * 1000))
+            except Exception as e:
+                self._drop_redis(e)
+
+    @contextmanager
+    def request(self, estimated_tokens: int):
+        """
+        获取一次 LLM 请求的执行许可
+
+        用法:
+            with limiter.request(prompt_tokens + max_tokens) as ticket:
+                ...调用提供商...
+                ticket['used_tokens'] = 实际消耗
+
+        Args:
+            estimated_tokens: 预扣的 token 数（提示词 + max_tokens）
+
+        调用出错时预扣的 token 全部归还（未设置 used_tokens 时按 0 记录），并记录并发限制器的失败结果
+        """
+        ticket = {'used_tokens': None}
+        reserved = False
+        succeeded = False
+
+        waiting = LLM_WAITING.labels(provider=self.provider, model=self.model)
+        waiting.inc()
+        self.concurrency.acquire()
+        try:
+            try:
+                self._wait_for_budget(estimated_tokens)
+            finally:
+                waiting.dec()
+            reserved = True
+            started = time.monotonic()
+            try:
+                yield ticket
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    self.concurrency.on_throttle()
+                    self._start_cooldown(e)
+                else:
+                    self.concurrency.on_error(time.monotonic() - started)
+                raise
+            else:
+                succeeded = True
+                self.concurrency.on_success(time.monotonic() - started)
+        finally:
+            self.concurrency.release()
+            if reserved:
+                used = ticket['used_tokens']
+                if used is None and not succeeded:
+                    used = 0
+                if used is not None:
+                    self._refund_tokens(estimated_tokens - used)
+                self._record(used if used is not None else estimated_tokens)
+
+    def local_snapshot(self) -> Dict:
+        """本进程的限流状态"""
+        return {
+            'provider': self.provider,
+            'model': self.model,
+            'requests_per_minute_limit': self.rpm,
+            'tokens_per_minute_limit': self.tpm,
+            'concurrency': self.concurrency.snapshot(),
+            'backend': 'redis' if self._redis is not None else 'local'
+        }
+
+
+# 按 提供商/模型 缓存的限流器
+_rate_limiters: Dict[str, LLMRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, model: str) -> LLMRateLimiter:
+    """获取指定提供商/模型的限流器（进程内单例）"""
+    key = f"{provider}:{model}"
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            _rate_limiters[key] = LLMRateLimiter(provider, model)
+        return _rate_limiters[key]
+
+
+def get_rate_limit_snapshot() -> Dict:
+    """
+    获取当前的限流状态（所有进程汇总）
+
+    Returns:
+        {'limiters': [...]}，每项包含配额、桶余量、本分钟/上一分钟用量、冷却剩余时间和各进程并发状态
+    """
+    settings = get_settings()
+    limiters = []
+
+    try:
+        import redis
+        client = redis.Redis.from_url(settings.redis_url, socket_timeout=2, socket_connect_timeout=2)
+        names = sorted(name.decode() for name in client.smembers(f"{KEY_PREFIX}:limiters"))
+    except Exception as e:
+        logger.warning(f"⚠️ 读取 Redis 限流状态失败: {e}")
+        return {
+            'backend': 'local',
+            'limiters': [limiter.local_snapshot() for limiter in _rate_limiters.values()]
+        }
+
+    now_ms = int(time.time() * 1000)
+    minute = int(time.time() // 60)
+
+    for name in names:
+        provider, _, model = name.partition(':')
+        prefix = f"{KEY_PREFIX}:{provider}:{model}"
+        rpm, tpm = _provider_quota(provider)
+
+        pipe = client.pipeline(transaction=False)
+        pipe.hmget(f"{prefix}:requests", 'level', 'ts')
+        pipe.hmget(f"{prefix}:tokens", 'level', 'ts')
+        pipe.get(f"{prefix}:rpm:{minute}")
+        pipe.get(f"{prefix}:tpm:{minute}")
+        pipe.get(f"{prefix}:rpm:{minute - 1}")
+        pipe.get(f"{prefix}:tpm:{minute - 1}")
+        pipe.pttl(f"{prefix}:cooldown")
+        pipe.hgetall(f"{prefix}:workers")
+        req_bucket, tok_bucket, rpm_now, tpm_now, rpm_prev, tpm_prev, cooldown, workers = pipe.execute()
+
+        def bucket_level(bucket, capacity):
+            level, ts = bucket
+            if capacity <= 0:
+                return None
+            if level is None or ts is None:
+                return capacity
+            return round(min(capacity, float(level) + max(0, now_ms - float(ts)) * capacity / 60000), 1)
+
+        limiters.append({
+            'provider': provider,
+            'model': model,
+            'requests_per_minute_limit': rpm,
+            'tokens_per_minute_limit': tpm,
+            'requests_available': bucket_level(req_bucket, rpm),
+            'tokens_available': bucket_level(tok_bucket, tpm),
+            'current_minute': {'requests': int(rpm_now or 0), 'tokens': int(tpm_now or 0)},
+            'previous_minute': {'requests': int(rpm_prev or 0), 'tokens': int(tpm_prev or 0)},
+            'cooldown_ms': max(0, cooldown),
+            'workers': {
+                worker.decode(): json.loads(state)
+                for worker, state in workers.items()
+            }
+        })
+
+    return {'backend': 'redis', 'limiters': limiters}
@@ -0,0 +1,467 @@
+"""规则修复模块
+
+编译/语法错误中有很大一部分是机械性的，不需要调用 LLM：
+- 残留的 markdown 代码块标记
+- 未使用的导入（"fmt" imported and not used）
+- 缺少标准库 / Ginkgo / Gomega 导入（undefined: context、undefined: Expect）
+- 包名错误（found packages calc (calc.go) and foo (calc_test.go)、缺少 package 声明）
+- 声明但未使用的变量（declared and not used: x）
+- 输出被截断导致缺少结尾的 }) 等闭合括号
+- C/C++ 编译器提示的缺失头文件（did you forget to '#include <vector>'）
+
+根据编译器 / gofmt / go vet 的错误文本逐条匹配规则，用 tree-sitter 语法树定位
+package / import 节点后按行修改，毫秒级完成。所有错误都被规则处理时不再调用 LLM
+"""
+
+import difflib
+import re
+from typing import Dict, List, Optional, Set
+from loguru import logger
+
+from app.services.failure_clusters import parse_compiler_errors
+from app.services.stream_guard import TREE_SITTER_LANGUAGES
+
+
+# 测试代码中常用的 Go 标准库包（包名 -> 导入路径）
+GO_STD_PACKAGES = {
+    'context': 'context',
+    'time': 'time',
+    'errors': 'errors',
+    'fmt': 'fmt',
+    'strings': 'strings',
+    'strconv': 'strconv',
+    'bytes': 'bytes',
+    'sort': 'sort',
+    'sync': 'sync',
+    'atomic': 'sync/atomic',
+    'reflect': 'reflect',
+    'math': 'math',
+    'rand': 'math/rand',
+    'os': 'os',
+    'io': 'io',
+    'filepath': 'path/filepath',
+    'regexp': 'regexp',
+    'json': 'encoding/json',
+    'http': 'net/http',
+    'httptest': 'net/http/httptest',
+    'testing': 'testing'
+}
+
+GINKGO_IMPORT = 'github.com/onsi/ginkgo/v2'
+GOMEGA_IMPORT = 'github.com/onsi/gomega'
+
+# Ginkgo / Gomega 点导入提供的标识符
+GINKGO_IDENTIFIERS = {
+    'Describe', 'Context', 'When', 'It', 'Specify', 'By', 'Fail', 'Skip', 'RunSpecs',
+    'BeforeEach', 'AfterEach', 'JustBeforeEach', 'JustAfterEach', 'BeforeSuite', 'AfterSuite',
+    'DescribeTable', 'Entry', 'GinkgoT', 'GinkgoWriter'
+}
+GOMEGA_IDENTIFIERS = {
+    'RegisterFailHandler', 'Expect', 'Eventually', 'Consistently', 'Succeed', 'Equal', 'BeEquivalentTo',
+    'BeNil', 'BeTrue', 'BeFalse', 'BeZero', 'BeEmpty', 'HaveOccurred', 'HaveLen', 'HaveKey',
+    'HaveKeyWithValue', 'ContainSubstring', 'ContainElement', 'ConsistOf', 'MatchError', 'BeNumerically'
+}
+
+_UNUSED_IMPORT_RE = re.compile(r'"(?P<path>[^"]+)" imported (?:as \w+ )?and not used')
+_UNDEFINED_RE = re.compile(r'^undefined: (?P<name>\w+)$')
+_DECLARED_UNUSED_RE = re.compile(r'^(?:declared and not used: (?P<a>\w+)|(?P<b>\w+) declared (?:and|but) not used)$')
+_FOUND_PACKAGES_RE = re.compile(r'found packages (?P<p1>\w+) \((?P<f1>[^)]+)\) and (?P<p2>\w+) \((?P<f2>[^)]+)\)')
+_MISSING_PACKAGE_RE = re.compile(r"expected 'package', found")
+_FENCE_ERROR_RE = re.compile(r"illegal character U\+0060|stray '`'")
+_TRUNCATED_RE = re.compile(
+    r"expected '[)}\]]', found 'EOF'|expected .*, found 'EOF'|unexpected EOF|expected '}' at end of input"
+    r"|大括号不匹配|小括号不匹配"
+)
+_INCLUDE_HINT_RE = re.compile(
+    r"'(?P<ident>[\w:]+)' is defined in header '(?P<h1><[^>]+>)'"
+    r"|include '(?P<h2><[^>]+>)' or provide a declaration of '(?P<ident2>\w+)'"
+)
+_UNDECLARED_CPP_RE = re.compile(
+    r"'(?P<ident>[\w:]+)' (?:was not declared|is not a member of|has not been declared|undeclared)"
+    r"|implicit declaration of function '(?P<ident2>\w+)'"
+    r"|unknown type name '(?P<ident3>\w+)'"
+)
+_FENCE_LINE_RE = re.compile(r'^\s*```[\w+-]*\s*$')
+
+
+class RuleFixer:
+    """基于规则的编译错误修复器"""
+
+    def __init__(self, language: str):
+        """
+        Args:
+            language: 编程语言（golang/cpp/c）
+        """
+        self.language = language
+        self._parser = self._create_parser()
+
+    def _create_parser(self):
+        """创建 tree-sitter 解析器（不可用时只使用不依赖语法树的规则）"""
+        name = TREE_SITTER_LANGUAGES.get(self.language)
+        if not name:
+            return None
+        try:
+            import tree_sitter_languages
+            return tree_sitter_languages.get_parser(name)
+        except Exception as e:
+            logger.debug(f"tree-sitter 不可用，规则修复只处理文本规则: {e}")
+            return None
+
+    def _parse(self, lines: List[str]):
+        """解析代码，返回 (语法树根节点, 源码字节)；没有解析器时根节点为 None"""
+        source = "\n".join(lines).encode('utf-8')
+        if self._parser is None:
+            return None, source
+        return self._parser.parse(source).root_node, source
+
+    def fix(self, code: str, error_text: str, file_name: Optional[str] = None, package_name: str = "") -> Dict:
+        """
+        按错误文本逐条应用规则
+
+        Args:
+            code: 测试代码
+            error_text: 编译器 / gofmt / 测试执行的错误输出
+            file_name: 只处理该文件的编译错误（go test 的包级输出中包含其他文件的错误）
+            package_name: 被测源文件的包名（修复包声明时使用）
+
+        Returns:
+            {
+                'code': 修复后的代码,
+                'applied': 应用的规则列表,
+                'unresolved': 规则无法处理的错误（保留 路径:行:列 前缀，行号已对应到修复后的代码）
+            }
+        """
+        errors = parse_compiler_errors(error_text, file_name)
+        if not errors:
+            # 没有带位置的编译错误（如 C/C++ 的基础括号检查），按行作为错误信息
+            errors = [
+                {'path': None, 'line': None, 'column': None, 'message': line.strip()}
+                for line in error_text.splitlines()
+                if line.strip()
+            ]
+
+        original_lines = code.split("\n")
+        lines = list(original_lines)
+        applied: List[str] = []
+        handled: Set[int] = set()
+
+        # 1. 依赖行号的规则先执行（从后往前改，避免行号偏移）
+        for index, error in sorted(enumerate(errors), key=lambda item: -(item[1]['line'] or 0)):
+            match = _DECLARED_UNUSED_RE.match(error['message'])
+            if match and error['line'] and self.language == 'golang':
+                if self._use_variable(lines, error['line'], match.group('a') or match.group('b')):
+                    handled.add(index)
+                    applied.append(f"unused_var:{match.group('a') or match.group('b')}")
+
+        # 2. 代码块标记
+        fence_errors = {i for i, e in enumerate(errors) if _FENCE_ERROR_RE.search(e['message'])}
+        if any(_FENCE_LINE_RE.match(line) for line in lines):
+            lines = [line for line in lines if not _FENCE_LINE_RE.match(line)]
+            handled |= fence_errors
+            applied.append("markdown_fence")
+
+        # 3. 包声明和导入
+        if self.language == 'golang':
+            lines = self._fix_go_declarations(lines, errors, handled, applied, package_name)
+        else:
+            lines = self._fix_includes(lines, errors, error_text, handled, applied)
+
+        # 4. 截断导致的未闭合括号（最后执行，补在文件末尾）
+        truncated = {i for i, e in enumerate(errors) if _TRUNCATED_RE.search(e['message'])}
+        if truncated:
+            closed = self._close_brackets(lines)
+            if closed is not None:
+                lines = closed
+                handled |= truncated
+                applied.append("close_brackets")
+
+        # 剩余错误交给 AI（补丁模式按行号定位出错区域），行号按规则增删的行调整
+        line_map = self._line_mapping(original_lines, lines) if applied else {}
+        unresolved = [self._format_error(e, line_map) for i, e in enumerate(errors) if i not in handled]
+        return {'code': "\n".join(lines), 'applied': applied, 'unresolved': unresolved}
+
+    @staticmethod
+    def _line_mapping(before: List[str], after: List[str]) -> Dict[int, int]:
+        """规则修改前后的行号对应（从 1 开始）；被删除的行对应到其后第一个保留的行"""
+        matcher = difflib.SequenceMatcher(None, before, after, autojunk=False)
+        mapping = {}
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            for index in range(i1, i2):
+                if tag == 'equal' or index - i1 < j2 - j1:
+                    mapping[index + 1] = j1 + index - i1 + 1
+                else:
+                    mapping[index + 1] = min(j2 + 1, max(1, len(after)))
+        return mapping
+
+    @staticmethod
+    def _format_error(error: Dict, line_map: Dict[int, int]) -> str:
+        """按编译器格式还原错误行（路径:行:列: 信息）"""
+        if not error['path'] or not error['line']:
+            return error['message']
+        line = line_map.get(error['line'], error['line'])
+        return f"{error['path']}:{line}:{error['column']}: {error['message']}"
+
+    # ------------------------------------------------------------------
+    # Go
+    # ------------------------------------------------------------------
+
+    def _fix_go_declarations(
+        self,
+        lines: List[str],
+        errors: List[Dict],
+        handled: Set[int],
+        applied: List[str],
+        package_name: str
+    ) -> List[str]:
+        """处理包声明、未使用的导入和缺失的导入"""
+        if self._parser is None:
+            return lines
+
+        for index, error in enumerate(errors):
+            message = error['message']
+
+            match = _FOUND_PACKAGES_RE.search(message)
+            if match:
+                # 测试文件与源文件包名不一致，改成源文件的包名
+                source_package = match.group('p2') if match.group('f1').endswith('_test.go') else match.group('p1')
+                new_lines = self._set_package(lines, source_package)
+                if new_lines is not None:
+                    lines = new_lines
+                    handled.add(index)
+                    applied.append(f"package:{source_package}")
+                continue
+
+            if _MISSING_PACKAGE_RE.search(message) and package_name:
+                new_lines = self._set_package(lines, package_name)
+                if new_lines is not None:
+                    lines = new_lines
+                    handled.add(index)
+                    applied.append(f"package:{package_name}")
+                continue
+
+            match = _UNUSED_IMPORT_RE.search(message)
+            if match:
+                new_lines = self._remove_import(lines, match.group('path'))
+                if new_lines is not None:
+                    lines = new_lines
+                    handled.add(index)
+                    applied.append(f"remove_import:{match.group('path')}")
+                continue
+
+            match = _UNDEFINED_RE.match(message)
+            if match:
+                name = match.group('name')
+                if name in GO_STD_PACKAGES:
+                    path, dot = GO_STD_PACKAGES[name], False
+                elif name in GINKGO_IDENTIFIERS:
+                    path, dot = GINKGO_IMPORT, True
+                elif name in GOMEGA_IDENTIFIERS:
+                    path, dot = GOMEGA_IMPORT, True
+                else:
+                    continue
+                new_lines = self._add_import(lines, path, dot)
+                if new_lines is not None:
+                    lines = new_lines
+                    handled.add(index)
+                    if f"add_import:{path}" not in applied:
+                        applied.append(f"add_import:{path}")
+
+        return lines
+
+    @staticmethod
+    def _go_imports(root, source: bytes) -> List[Dict]:
+        """语法树中的导入: [{'path', 'row', 'end_row', 'declaration', 'in_list'}]"""
+        imports = []
+        for declaration in root.children:
+            if declaration.type != 'import_declaration':
+                continue
+            for child in declaration.children:
+                specs = child.children if child.type == 'import_spec_list' else [child]
+                for spec in specs:
+                    if spec.type != 'import_spec':
+                        continue
+                    path_node = spec.child_by_field_name('path')
+                    if path_node is None:
+                        continue
+                    imports.append({
+                        'path': source[path_node.start_byte:path_node.end_byte].decode('utf-8').strip('"`'),
+                        'row': spec.start_point[0],
+                        'end_row': spec.end_point[0],
+                        'declaration': declaration,
+                        'in_list': child.type == 'import_spec_list'
+                    })
+        return imports
+
+    def _set_package(self, lines: List[str], package_name: str) -> Optional[List[str]]:
+        """修改（或补充）package 声明"""
+        root, _ = self._parse(lines)
+        for node in root.children:
+            if node.type == 'package_clause':
+                row = node.start_point[0]
+                new_line = re.sub(r'package\s+\w+', f"package {package_name}", lines[row], count=1)
+                if new_line == lines[row]:
+                    return None
+                return lines[:row] + [new_line] + lines[row + 1:]
+
+        # 没有 package 声明：补在第一行非注释代码之前
+        insert_at = 0
+        while insert_at < len(lines) and (not lines[insert_at].strip() or lines[insert_at].lstrip().startswith('//')):
+            insert_at += 1
+        return lines[:insert_at] + [f"package {package_name}", ""] + lines[insert_at:]
+
+    def _remove_import(self, lines: List[str], path: str) -> Optional[List[str]]:
+        """删除未使用的导入（整个 import 声明只有这一个导入时删除整个声明）"""
+        root, source = self._parse(lines)
+        for spec in self._go_imports(root, source):
+            if spec['path'] != path:
+                continue
+            if spec['in_list']:
+                start, end = spec['row'], spec['end_row']
+            else:
+                start, end = spec['declaration'].start_point[0], spec['declaration'].end_point[0]
+            return lines[:start] + lines[end + 1:]
+        return None
+
+    def _add_import(self, lines: List[str], path: str, dot: bool = False) -> Optional[List[str]]:
+        """添加导入（已存在时返回原代码）"""
+        root, source = self._parse(lines)
+        imports = self._go_imports(root, source)
+        if any(spec['path'] == path for spec in imports):
+            return lines
+
+        spec_text = f'. "{path}"' if dot else f'"{path}"'
+        for spec in imports:
+            if spec['in_list']:
+                # 插在导入列表的右括号之前
+                closing_row = spec['declaration'].end_point[0]
+                return lines[:closing_row] + [f"\t{spec_text}"] + lines[closing_row:]
+
+        if imports:
+            last_row = imports[-1]['declaration'].end_point[0]
+            return lines[:last_row + 1] + [f"import {spec_text}"] + lines[last_row + 1:]
+
+        for node in root.children:
+            if node.type == 'package_clause':
+                row = node.end_point[0]
+                return lines[:row + 1] + ["", f"import {spec_text}"] + lines[row + 1:]
+        return None
+
+    @staticmethod
+    def _use_variable(lines: List[str], line_no: int, name: str) -> bool:
+        """在声明的下一行加 `_ = name`（只处理 := 和 var 声明）"""
+        row = line_no - 1
+        if row < 0 or row >= len(lines):
+            return False
+        line = lines[row]
+        if not re.search(rf'\b{re.escape(name)}\b[\w\s,]*:=|\bvar\s+{re.escape(name)}\b', line):
+            return False
+        # 声明在 if/for/switch 头部时变量作用域在代码块内，不能补在下一行
+        if re.match(r'\s*(if|for|switch|select)\b', line) or line.rstrip().endswith(('{', '(', ',')):
+            return False
+        indent = line[:len(line) - len(line.lstrip())]
+        lines.insert(row + 1, f"{indent}_ = {name}")
+        return True
+
+    # ------------------------------------------------------------------
+    # C/C++
+    # ------------------------------------------------------------------
+
+    def _fix_includes(
+        self,
+        lines: List[str],
+        errors: List[Dict],
+        error_text: str,
+        handled: Set[int],
+        applied: List[str]
+    ) -> List[str]:
+        """根据编译器的头文件提示补充 #include"""
+        # 提示信息（note）不在错误列表中，直接从原始输出中查找
+        headers = {}
+        for line in error_text.splitlines():
+            for match in _INCLUDE_HINT_RE.finditer(line):
+                ident = (match.group('ident') or match.group('ident2')).split('::')[-1]
+                headers[ident] = match.group('h1') or match.group('h2')
+        if not headers:
+            return lines
+
+        for index, error in enumerate(errors):
+            match = _UNDECLARED_CPP_RE.search(error['message'])
+            if not match:
+                continue
+            ident = (match.group('ident') or match.group('ident2') or match.group('ident3')).split('::')[-1]
+            header = headers.get(ident)
+            if not header:
+                continue
+            include = f"#include {header}"
+            if not any(line.strip() == include for line in lines):
+                last_include = max((i for i, line in enumerate(lines) if line.lstrip().startswith('#include')), default=-1)
+                lines = lines[:last_include + 1] + [include] + lines[last_include + 1:]
+                applied.append(f"include:{header}")
+            handled.add(index)
+        return lines
+
+    # ------------------------------------------------------------------
+    # 通用
+    # ------------------------------------------------------------------
+
+    def _close_brackets(self, lines: List[str]) -> Optional[List[str]]:
+        """
+        补全文件末尾未闭合的括号（跳过字符串、字符和注释）
+
+        括号不配对（而不是只缺少结尾）时返回 None；有 tree-sitter 时要求补全后没有语法错误
+        """
+        code = "\n".join(lines)
+        pairs = {'(': ')', '{': '}', '[': ']'}
+        stack = []
+        i = 0
+        while i < len(code):
+            ch = code[i]
+            if code.startswith('//', i):
+                end = code.find('\n', i)
+                i = len(code) if end == -1 else end
+                continue
+            if code.startswith('/*', i):
+                end = code.find('*/', i + 2)
+                i = len(code) if end == -1 else end + 2
+                continue
+            if ch in ('"', "'") or (ch == '`' and self.language == 'golang'):
+                i += 1
+                while i < len(code) and code[i] != ch:
+                    if ch != '`' and code[i] == '\\':
+                        i += 1
+                    elif ch != '`' and code[i] == '\n':
+                        break
+                    i += 1
+                i += 1
+                continue
+            if ch in pairs:
+                stack.append(ch)
+            elif ch in pairs.values():
+                if not stack or pairs[stack.pop()] != ch:
+                    return None
+            i += 1
+
+        if not stack:
+            return None
+
+        # 每个 } 另起一行，紧随其后的 ) ] 跟在同一行（如 Ginkgo 的 "})"）
+        indent_unit = "\t" if self.language == 'golang' else "    "
+        closing_lines = []
+        for depth in range(len(stack) - 1, -1, -1):
+            closer = pairs[stack[depth]]
+            if closer == '}' or not closing_lines:
+                braces_left = stack[:depth].count('{')
+                closing_lines.append(indent_unit * braces_left + closer)
+            else:
+                closing_lines[-1] += closer
+
+        fixed = [line for line in lines]
+        while fixed and not fixed[-1].strip():
+            fixed.pop()
+        fixed += closing_lines + [""]
+
+        root, _ = self._parse(fixed)
+        if root is not None and root.has_error:
+            return None
+        return fixed
+
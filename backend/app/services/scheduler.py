@@ -0,0 +1,192 @@
+"""项目定时调度模块
+
+按 Project.schedule_cron 定时为项目创建测试生成任务（cron 表达式按 UTC 计算）：
+- 定时任务每个周期检查一次各项目的 cron，错过的多次触发（如 beat 停机）合并为一次
+- 同一时刻触发的项目不同时启动：按项目ID哈希分散到错峰窗口内的固定位置，再加少量随机抖动，
+  避免所有项目同时拉取代码、同时请求 LLM
+- 真正启动前用 git ls-remote 查询远端分支 HEAD，与上一次成功任务的 commit 相同时跳过；
+  项目已有进行中的任务时也跳过
+"""
+
+import hashlib
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from uuid import uuid4
+from loguru import logger
+
+from app.config import get_settings
+from app.services.metrics import SCHEDULED_TASKS
+
+
+# 未结束的任务状态（项目已有这些状态的任务时不再启动定时任务）
+ACTIVE_STATUSES = ("PENDING", "CLONING", "ANALYZING", "GENERATING", "TESTING", "COLLECTING_COVERAGE", "COMMITTING")
+
+# 超过该时长仍未结束的任务视为已中断（worker 崩溃等），不再阻止定时触发（批处理任务最长等待 24 小时）
+STALE_TASK_HOURS = 48
+
+
+def is_valid_cron(expression: str) -> bool:
+    """cron 表达式是否有效"""
+    from croniter import croniter
+    return croniter.is_valid(expression)
+
+
+class ProjectScheduler:
+    """根据 cron 表达式计算触发时间和错峰启动延迟"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.spread_seconds = self.settings.scheduler_spread_seconds
+        self.jitter_seconds = self.settings.scheduler_jitter_seconds
+
+    def latest_fire(self, expression: str, after: datetime, now: datetime) -> Optional[datetime]:
+        """
+        (after, now] 区间内最近一次触发时间
+
+        Returns:
+            触发时间；区间内没有触发时返回 None（多次触发只返回最近一次）
+        """
+        from croniter import croniter
+        fire_time = croniter(expression, now).get_prev(datetime)
+        return fire_time if fire_time > after else None
+
+    def start_delay(self, project_id: str, expression: str, fire_time: datetime) -> float:
+        """
+        项目的启动延迟（秒）
+
+        错峰位置由项目ID决定（每次触发都相同，便于排查），窗口不超过两次触发间隔的一半，
+        避免高频 cron 的任务延迟到下一次触发之后
+        """
+        from croniter import croniter
+        interval = (croniter(expression, fire_time).get_next(datetime) - fire_time).total_seconds()
+        window = min(self.spread_seconds, interval / 2)
+
+        slot = 0.0
+        if window > 0:
+            digest = int(hashlib.sha1(project_id.encode('utf-8')).hexdigest()[:8], 16)
+            slot = digest / 0xFFFFFFFF * window
+        return slot + random.uniform(0, self.jitter_seconds)
+
+
+async def collect_due_projects(db) -> List[Dict]:
+    """
+    找出 cron 已触发的项目并记录本次触发（由定时任务调用）
+
+    Returns:
+        需要启动的项目: [{'project_id', 'fire_time', 'delay'}]
+    """
+    from sqlalchemy import select
+    from app.database import Project, ProjectSchedule
+
+    scheduler = ProjectScheduler()
+    now = datetime.utcnow()
+
+    result = await db.execute(
+        select(Project).where(Project.enabled.is_(True), Project.schedule_cron.isnot(None))
+    )
+    projects = [project for project in result.scalars().all() if project.schedule_cron.strip()]
+
+    result = await db.execute(select(ProjectSchedule).with_for_update(skip_locked=True))
+    states = {state.project_id: state for state in result.scalars().all()}
+
+    due = []
+    for project in projects:
+        expression = project.schedule_cron.strip()
+        state = states.get(project.id)
+
+        # 新加入调度或修改了 cron 的项目从现在开始计算，不补跑过去的触发
+        if state is None or state.schedule_cron != expression:
+            if state is None:
+                state = ProjectSchedule(project_id=project.id)
+                db.add(state)
+            state.schedule_cron = expression
+            state.last_fire_at = now
+            continue
+
+        try:
+            fire_time = scheduler.latest_fire(expression, state.last_fire_at, now)
+        except Exception as e:
+            logger.warning(f"⚠️ 项目 {project.name} 的 cron 表达式无效: {expression} ({e})")
+            continue
+        if fire_time is None:
+            continue
+
+        delay = scheduler.start_delay(project.id, expression, fire_time)
+        state.last_fire_at = now
+        due.append({'project_id': project.id, 'fire_time': fire_time.isoformat(), 'delay': delay})
+        logger.info(f"⏰ 项目 {project.name} 定时触发 ({expression})，{delay:.0f} 秒后启动")
+
+    await db.commit()
+    return due
+
+
+async def create_scheduled_task(db, project_id: str) -> Optional[str]:
+    """
+    为定时触发的项目创建任务（远端 HEAD 未变化或已有进行中的任务时跳过）
+
+    Returns:
+        任务ID；跳过时返回 None
+    """
+    from sqlalchemy import select
+    from app.database import Project, ProjectSchedule, Task, TaskStatus
+    from app.services.git_service import GitService
+
+    result = await db.execute(select(Project).where(Project.id == project_id))
+    project = result.scalar_one_or_none()
+    if not project or not project.enabled:
+        return None
+
+    result = await db.execute(
+        select(Task.id)
+        .where(
+            Task.project_id == project_id,
+            Task.status.in_([TaskStatus[name] for name in ACTIVE_STATUSES]),
+            Task.created_at > datetime.utcnow() - timedelta(hours=STALE_TASK_HOURS)
+        )
+        .limit(1)
+    )
+    if result.scalar_one_or_none():
+        logger.info(f"⏭️  项目 {project.name} 有进行中的任务，跳过本次定时触发")
+        return await _record_skip(db, project_id, "skipped_active")
+
+    result = await db.execute(
+        select(Task.commit_hash)
+        .where(Task.project_id == project_id, Task.status == TaskStatus.COMPLETED)
+        .order_by(Task.completed_at.desc())
+        .limit(1)
+    )
+    last_commit = result.scalar_one_or_none()
+
+    if last_commit:
+        remote_head = await GitService().get_remote_head(project.git_url, project.git_branch)
+        if remote_head == last_commit:
+            logger.info(f"⏭️  项目 {project.name} 的 {project.git_branch} 分支没有新提交 ({remote_head[:8]})，跳过")
+            return await _record_skip(db, project_id, "skipped_unchanged")
+
+    task = Task(id=str(uuid4()), project_id=project_id)
+    db.add(task)
+
+    result = await db.execute(select(ProjectSchedule).where(ProjectSchedule.project_id == project_id))
+    state = result.scalar_one_or_none()
+    if state:
+        state.last_task_id = task.id
+        state.last_skip_reason = None
+    await db.commit()
+
+    SCHEDULED_TASKS.labels(result="started").inc()
+    logger.info(f"🚀 项目 {project.name} 定时任务已创建: {task.id}")
+    return task.id
+
+
+async def _record_skip(db, project_id: str, reason: str) -> None:
+    from sqlalchemy import select
+    from app.database import ProjectSchedule
+
+    SCHEDULED_TASKS.labels(result=reason).inc()
+    result = await db.execute(select(ProjectSchedule).where(ProjectSchedule.project_id == project_id))
+    state = result.scalar_one_or_none()
+    if state:
+        state.last_skip_reason = reason
+        await db.commit()
+    return None
@@ -0,0 +1,235 @@
+"""流式输出守卫模块
+
+流式接收模型输出时逐行检查，尽早发现跑偏的生成并中止：
+- 输出大段说明文字而不是代码
+- 失控重复（同一行或同一段代码反复出现）
+- 已输出的代码中出现无法恢复的语法错误（tree-sitter 增量解析）
+
+代码块结束（出现闭合的 ```）时提前结束接收，后续的解释文字不再等待
+"""
+
+from typing import List, Optional
+from loguru import logger
+
+
+# tree-sitter 语言名
+TREE_SITTER_LANGUAGES = {
+    'golang': 'go',
+    'cpp': 'cpp',
+    'c': 'c'
+}
+
+# 判断输出已经是代码（而不是说明文字）的行首标记
+CODE_MARKERS = {
+    'golang': ('package ', 'import ', 'func ', 'var ', 'type ', 'Describe(', '//'),
+    'cpp': ('#include', '#define', 'TEST(', 'TEST_F(', 'namespace ', 'class ', 'using ', '//'),
+    'c': ('#include', '#define', 'static ', 'void ', 'int ', '//', '/*')
+}
+
+
+class StreamAborted(Exception):
+    """流式输出被守卫中止（生成跑偏，应立即重试）"""
+
+    def __init__(self, reason: str, received_chars: int = 0):
+        super().__init__(f"流式输出已中止: {reason} (已接收 {received_chars} 字符)")
+        self.reason = reason
+        self.received_chars = received_chars
+
+
+class StreamGuard:
+    """流式输出守卫"""
+
+    def __init__(
+        self,
+        language: str,
+        prose_limit: int = 800,
+        syntax_check: bool = True,
+        syntax_check_interval: int = 2000,
+        syntax_tail_margin: int = 400
+    ):
+        """
+        初始化流式输出守卫
+
+        Args:
+            language: 编程语言（golang/cpp/c）
+            prose_limit: 代码开始前允许的最多说明文字字符数
+            syntax_check: 是否做增量语法检查
+            syntax_check_interval: 每接收多少字符代码做一次语法检查
+            syntax_tail_margin: 末尾多少字节内的语法错误视为"尚未写完"，不做判断
+        """
+        self.language = language
+        self.prose_limit = prose_limit
+        self.syntax_check_interval = syntax_check_interval
+        self.syntax_tail_margin = syntax_tail_margin
+        self.code_markers = CODE_MARKERS.get(language, ())
+
+        self._chunks: List[str] = []
+        self._received = 0
+        self._pending_line = ""
+        self._lines: List[str] = []
+
+        # 代码状态: None=尚未开始, 'fenced'=在 ``` 代码块内, 'raw'=没有代码块标记的纯代码
+        self._code_mode: Optional[str] = None
+        self._prose_chars = 0
+        self._code = bytearray()
+
+        self._parser = self._create_parser() if syntax_check else None
+        self._tree = None
+        self._parsed_len = 0
+        self._parsed_point = (0, 0)
+        self._last_error = None
+
+    def _create_parser(self):
+        """创建 tree-sitter 解析器（不可用时跳过语法检查）"""
+        name = TREE_SITTER_LANGUAGES.get(self.language)
+        if not name:
+            return None
+        try:
+            import tree_sitter_languages
+            return tree_sitter_languages.get_parser(name)
+        except Exception as e:
+            logger.debug(f"tree-sitter 不可用，跳过流式语法检查: {e}")
+            return None
+
+    @property
+    def text(self) -> str:
+        """已接收的完整文本"""
+        return "".join(self._chunks)
+
+    def feed(self, delta: str) -> bool:
+        """
+        接收一段增量输出
+
+        Args:
+            delta: 模型新输出的文本
+
+        Returns:
+            代码块是否已经结束（True 表示可以停止接收）
+
+        Raises:
+            StreamAborted: 输出跑偏
+        """
+        self._chunks.append(delta)
+        self._received += len(delta)
+
+        self._pending_line += delta
+        *lines, self._pending_line = self._pending_line.split('\n')
+        for line in lines:
+            if self._on_line(line):
+                return True
+
+        # 一直没有换行的大段文字也按说明文字计算
+        if self._code_mode is None and self._prose_chars + len(self._pending_line) > self.prose_limit:
+            self._abort("输出说明文字而不是代码")
+        return False
+
+    def _abort(self, reason: str):
+        logger.warning(f"🛑 中止流式输出: {reason} (已接收 {self._received} 字符)")
+        raise StreamAborted(reason, self._received)
+
+    def _on_line(self, line: str) -> bool:
+        """处理一个完整的行，返回代码块是否已结束"""
+        stripped = line.strip()
+
+        if stripped.startswith('```'):
+            if self._code_mode == 'fenced':
+                # 代码块闭合：只会使用第一个代码块，之后的内容无需等待
+                # （完整代码的语法问题交给后续的自动修复处理，不再中止）
+                return True
+            if self._code_mode is None:
+                self._code_mode = 'fenced'
+                return False
+            # 纯代码中途出现代码块标记，按第二个代码块处理
+            return True
+
+        if self._code_mode is None:
+            if stripped.startswith(self.code_markers):
+                self._code_mode = 'raw'
+            else:
+                self._prose_chars += len(line) + 1
+                if self._prose_chars > self.prose_limit:
+                    self._abort("输出说明文字而不是代码")
+                return False
+
+        self._lines.append(line)
+        self._check_repetition()
+
+        self._code.extend((line + '\n').encode())
+        if len(self._code) - self._parsed_len >= self.syntax_check_interval:
+            self._check_syntax()
+        return False
+
+    def _check_repetition(self):
+        """检测失控重复：末尾由同一段（1~8 行）代码连续重复构成"""
+        lines = self._lines
+        for period in range(1, 9):
+            repeats = 12 if period == 1 else 6
+            window = period * repeats
+            if len(lines) < window:
+                break
+
+            block = lines[-period:]
+            if sum(len(l.strip()) for l in block) < 20:
+                continue
+
+            if all(lines[-window + i] == block[i % period] for i in range(window)):
+                self._abort(f"输出陷入重复（{period} 行内容连续重复 {repeats} 次）")
+
+    def _point(self, data: bytes) -> tuple:
+        """计算字节串末尾的 (行, 列) 位置"""
+        row = data.count(b'\n')
+        col = len(data) - (data.rfind(b'\n') + 1)
+        return (row, col)
+
+    def _find_settled_error(self, node):
+        """查找已经写完区域内的第一个语法错误节点"""
+        limit = len(self._code) - self.syntax_tail_margin
+        if node.start_byte >= limit:
+            return None
+        if node.type == 'ERROR' and node.end_byte < limit:
+            return node
+        for child in node.children:
+            if child.has_error:
+                found = self._find_settled_error(child)
+                if found is not None:
+                    return found
+        return None
+
+    def _check_syntax(self):
+        """增量解析已接收的代码；同一个错误连续两次出现在已写完区域时中止"""
+        if self._parser is None or not self._code:
+            return
+
+        code = bytes(self._code)
+        new_point = self._point(code)
+        if self._tree is None:
+            # 首次解析不能传入旧树（tree-sitter 0.20 的 parse 第二个参数必须是 Tree）
+            self._tree = self._parser.parse(code)
+        else:
+            # 只在末尾追加了内容，告诉 tree-sitter 复用之前的解析结果
+            self._tree.edit(
+                start_byte=self._parsed_len,
+                old_end_byte=self._parsed_len,
+                new_end_byte=len(code),
+                start_point=self._parsed_point,
+                old_end_point=self._parsed_point,
+                new_end_point=new_point
+            )
+            self._tree = self._parser.parse(code, self._tree)
+        self._parsed_len = len(code)
+        self._parsed_point = new_point
+
+        if not self._tree.root_node.has_error:
+            self._last_error = None
+            return
+
+        error = self._find_settled_error(self._tree.root_node)
+        if error is None:
+            self._last_error = None
+            return
+
+        location = (error.start_byte, error.end_byte)
+        if location == self._last_error:
+            line = error.start_point[0] + 1
+            self._abort(f"第 {line} 行附近存在语法错误")
+        self._last_error = location
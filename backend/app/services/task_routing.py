@@ -0,0 +1,160 @@
+"""Celery 队列与任务路由
+
+所有任务原来都在默认队列中排队，一个手动触发的小任务可能排在整仓库的全量生成之后。现在按类型和规模分队列：
+- interactive: 手动触发且规模较小的任务及测试修复任务，由独立的 worker 消费，保证低延迟
+- bulk: 大仓库、定时触发、批处理模式及批处理恢复的任务
+- llm: 以 LLM 调用为主的任务（批处理提交、本地模型替代执行）
+- build: 以编译 / 执行测试为主的任务
+- maintenance: 定时调度、清理等轻量任务
+
+任务规模按同一项目上一次完成任务的源文件数估算；同一队列内按规模设置优先级（小任务优先），
+并按队列设置超时时间。各队列的 worker 数和并发数在部署时分别配置（celery worker -Q <队列>）
+"""
+
+import math
+from typing import Dict, List
+from loguru import logger
+
+from app.config import get_settings
+
+
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_BULK = "bulk"
+QUEUE_LLM = "llm"
+QUEUE_BUILD = "build"
+QUEUE_MAINTENANCE = "maintenance"
+
+ALL_QUEUES = (QUEUE_INTERACTIVE, QUEUE_BULK, QUEUE_LLM, QUEUE_BUILD, QUEUE_MAINTENANCE)
+
+# Redis broker 的优先级档位（0 最高）及优先级子队列的分隔符（bulk、bulk:1 ... bulk:9）
+PRIORITY_STEPS = list(range(10))
+PRIORITY_SEPARATOR = ":"
+
+# 不随任务规模变化的静态路由
+TASK_ROUTES = {
+    'process_llm_batches': {'queue': QUEUE_LLM},
+    'schedule_projects': {'queue': QUEUE_MAINTENANCE},
+    'start_scheduled_project': {'queue': QUEUE_MAINTENANCE},
+    'cleanup_old_tasks': {'queue': QUEUE_MAINTENANCE},
+    'run_test_generation_task': {'queue': QUEUE_BULK},
+    'pipeline_generate_file': {'queue': QUEUE_LLM},
+    'pipeline_finish': {'queue': QUEUE_BUILD},
+    # 修复请求由用户触发且等待结果，与小任务一样走 interactive 队列
+    'run_fix_tests_job': {'queue': QUEUE_INTERACTIVE},
+}
+
+
+def priority_queue_keys(queue: str) -> List[str]:
+    """队列在 Redis 中的各优先级子队列键"""
+    return [queue if step == 0 else f"{queue}{PRIORITY_SEPARATOR}{step}" for step in PRIORITY_STEPS]
+
+
+def stage_queues(parent_queue: str) -> Dict:
+    """
+    分阶段执行时各子任务的队列
+
+    interactive 任务的子任务留在 interactive 队列（不排在大任务之后）；
+    其他任务的逐文件生成进入 llm 队列，测试执行和提交进入 build 队列
+
+    Returns:
+        {'generate': 生成子任务队列, 'finish': 测试提交子任务队列}
+    """
+    if parent_queue == QUEUE_INTERACTIVE:
+        return {'generate': QUEUE_INTERACTIVE, 'finish': QUEUE_INTERACTIVE}
+    return {'generate': QUEUE_LLM, 'finish': QUEUE_BUILD}
+
+
+async def estimate_task_cost(db, project_id: str) -> Dict:
+    """
+    根据上一次完成任务估算任务规模
+
+    Returns:
+        {'source_files': 源文件数（没有历史任务时为 None）, 'tests': 测试用例数, 'from_task': 参考的任务ID}
+    """
+    from sqlalchemy import select
+    from app.database import Task, TaskStatus
+
+    result = await db.execute(
+        select(Task)
+        .where(Task.project_id == project_id, Task.status == TaskStatus.COMPLETED)
+        .order_by(Task.completed_at.desc())
+        .limit(1)
+    )
+    previous = result.scalar_one_or_none()
+    if previous is None:
+        return {'source_files': None, 'tests': 0, 'from_task': None}
+
+    # 旧任务没有记录源文件列表时，用测试文件数代替
+    source_files = len(previous.target_files or previous.generated_tests or [])
+    return {'source_files': source_files, 'tests': previous.total_tests or 0, 'from_task': previous.id}
+
+
+def route_generation_task(cost: Dict, interactive: bool) -> Dict:
+    """
+    为测试生成任务选择队列、优先级和超时时间
+
+    Args:
+        cost: estimate_task_cost 的结果
+        interactive: 是否由用户手动触发（定时任务、批处理模式为 False）
+
+    Returns:
+        apply_async 的参数: {'queue', 'priority', 'time_limit', 'soft_time_limit'}
+    """
+    settings = get_settings()
+    source_files = cost.get('source_files')
+
+    # 没有历史任务的项目第一次需要全量生成，按大任务处理
+    small = source_files is not None and source_files <= settings.celery_interactive_max_files
+    if interactive and small:
+        queue, time_limit = QUEUE_INTERACTIVE, settings.celery_interactive_time_limit
+    else:
+        queue, time_limit = QUEUE_BULK, settings.celery_bulk_time_limit
+
+    # 队列内小任务优先：1 个文件优先级 1，文件数每翻一倍降一档
+    priority = PRIORITY_STEPS[-1]
+    if source_files is not None:
+        priority = min(priority, int(math.log2(source_files + 1)))
+    return {
+        'queue': queue,
+        'priority': priority,
+        'time_limit': time_limit,
+        # 软超时比硬超时早一分钟，任务有机会把状态写回数据库
+        'soft_time_limit': max(60, time_limit - 60)
+    }
+
+
+async def dispatch_generation_task(
+    db,
+    task_id: str,
+    project_id: str,
+    interactive: bool = True,
+    **task_kwargs
+) -> Dict:
+    """
+    估算规模并把测试生成任务投递到对应队列
+
+    Args:
+        db: 数据库会话
+        task_id: 任务ID
+        project_id: 项目ID
+        interactive: 是否由用户手动触发
+        task_kwargs: run_test_generation_task 的其他参数（batch_mode / batch_id）
+
+    Returns:
+        路由结果
+    """
+    # 延迟导入：worker 依赖本模块
+    from app.worker import run_test_generation_task
+
+    cost = await estimate_task_cost(db, project_id)
+    # 批处理模式的任务本来就不追求延迟
+    if task_kwargs.get('batch_mode') or task_kwargs.get('batch_id'):
+        interactive = False
+    route = route_generation_task(cost, interactive)
+
+    run_test_generation_task.apply_async((task_id,), task_kwargs, **route)
+    logger.info(
+        f"📬 任务 {task_id} 投递到 {route['queue']} 队列 (优先级 {route['priority']}, "
+        f"预计源文件 {cost['source_files'] if cost['source_files'] is not None else '未知'})"
+    )
+    return {**route, 'cost': cost}
@@ -1,11 +1,12 @@
 """测试代码修复服务"""
 import asyncio
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional
 from loguru import logger
 
 from app.services.test_generator import get_test_generator
 from app.services.git_helper import GitHelper
+from app.services.failure_clusters import apply_patch, cluster_failures, get_fix_pattern_cache, learn_patch
 from app.config import get_settings
 
 
@@ -106,6 +107,9 @@ class TestFixer:
         
         logger.info(f"📝 找到 {len(test_files)} 个测试文件")
         
+        # 相同语法错误的文件先按簇修复，结果作为逐个文件修复的起点
+        initial_codes = self._fix_clusters(test_files) if self.settings.failure_clustering else {}
+        
         # 修复每个测试文件
         results = []
         fixed_count = 0
@@ -115,7 +119,8 @@ class TestFixer:
         for test_file in test_files:
             result = self._fix_single_test_file(
                 test_file,
-                max_fix_attempts=max_fix_attempts
+                max_fix_attempts=max_fix_attempts,
+                initial_code=initial_codes.get(str(test_file))
             )
             results.append(result)
             
@@ -151,7 +156,8 @@ class TestFixer:
         auto_git_commit: bool = False,
         git_username: str = "ut-agent",
         git_branch_name: Optional[str] = None,
-        git_commit_message: Optional[str] = None
+        git_commit_message: Optional[str] = None,
+        on_event: Optional[Callable[[Dict], Awaitable[None]]] = None
     ) -> Dict:
         """
         异步并发修复指定目录下的所有测试文件
@@ -165,6 +171,8 @@ class TestFixer:
             git_username: Git 用户名
             git_branch_name: Git 分支名称（可选，默认自动生成）
             git_commit_message: Git 提交信息（可选，默认自动生成）
+            on_event: 进度事件回调（后台修复任务使用）：找到测试文件后发送 started，
+                每个文件修复完成后立即发送 file（不等待其他文件）
             
         Returns:
             修复结果字典
@@ -218,19 +226,33 @@ class TestFixer:
         
         logger.info(f"📝 找到 {len(test_files)} 个测试文件")
         logger.info(f"🚀 使用异步并发处理 (最大并发: {max_concurrent})")
+        if on_event:
+            await on_event({'type': "started", 'total_files': len(test_files)})
         
         # 创建信号量控制并发数
         semaphore = asyncio.Semaphore(max_concurrent)
         
-        # 异步并发修复所有测试文件
-        tasks = [
-            self._fix_single_test_file_async(
+        # 相同语法错误的文件先按簇修复，结果作为逐个文件修复的起点
+        initial_codes = {}
+        if self.settings.failure_clustering:
+            initial_codes = await self._fix_clusters_async(test_files, semaphore)
+        
+        async def fix_and_report(test_file: Path, file_idx: int) -> Dict:
+            result = await self._fix_single_test_file_async(
                 test_file,
                 max_fix_attempts,
                 semaphore,
-                idx + 1,
-                len(test_files)
+                file_idx,
+                len(test_files),
+                initial_code=initial_codes.get(str(test_file))
             )
+            if on_event:
+                await on_event({'type': "file", 'index': file_idx, 'total_files': len(test_files), 'result': result})
+            return result
+        
+        # 异步并发修复所有测试文件
+        tasks = [
+            fix_and_report(test_file, idx + 1)
             for idx, test_file in enumerate(test_files)
         ]
         
@@ -313,6 +335,126 @@ class TestFixer:
             'git_result': git_result
         }
     
+    def _check_syntax(self, test_file: Path) -> Dict:
+        """读取并验证单个测试文件，返回 {'code': 代码, 'errors': 语法错误列表}"""
+        test_code = test_file.read_text(encoding='utf-8')
+        validation_result = self.generator.validate_syntax(test_code)
+        errors = [] if validation_result['valid'] else validation_result.get('errors', [])
+        return {'code': test_code, 'errors': errors}
+    
+    def _cluster_syntax_failures(self, checks: Dict[str, Dict]) -> List[Dict]:
+        """按语法错误签名聚类（gofmt 的错误来自临时文件，不按文件名过滤）"""
+        failures = {
+            file_path: "\n".join(check['errors'])
+            for file_path, check in checks.items()
+            if check['errors']
+        }
+        clusters = cluster_failures(failures, match_file_name=False)
+        if clusters:
+            clustered = sum(len(cluster['files']) for cluster in clusters)
+            logger.info(f"🧩 {clustered} 个有语法错误的文件聚成 {len(clusters)} 簇")
+        return clusters
+    
+    def _fix_cluster(self, cluster: Dict, checks: Dict[str, Dict]) -> Dict[str, str]:
+        """
+        修复一个语法错误簇
+        
+        有缓存的补丁时直接应用到所有文件；否则 AI 修复簇首文件，验证通过后把修复前后的差异
+        作为补丁应用到簇内其他文件，并缓存该补丁
+        
+        Args:
+            cluster: 失败簇 {'signature', 'messages', 'files'}
+            checks: {文件路径: {'code', 'errors'}}
+            
+        Returns:
+            {文件路径: 修复后的代码}（只包含有变化的文件）
+        """
+        pattern_cache = get_fix_pattern_cache()
+        files = cluster['files']
+        hunks = pattern_cache.get(self.language, cluster['signature'])
+        from_cache = bool(hunks)
+        fixed_codes = {}
+        
+        if not hunks:
+            if len(files) < 2:
+                return fixed_codes
+            leader, files = files[0], files[1:]
+            file_analysis = {'file_path': leader, 'functions': []}
+            fixed_code = self.generator._fix_syntax_errors(
+                checks[leader]['code'],
+                checks[leader]['errors'],
+                file_analysis,
+                self.language,
+                self.test_framework
+            )
+            fixed_codes[leader] = fixed_code
+            if not self.generator.validate_syntax(fixed_code)['valid']:
+                logger.debug(f"簇首文件修复后仍有语法错误，不推广补丁: {Path(leader).name}")
+                return fixed_codes
+            hunks = learn_patch(checks[leader]['code'], fixed_code)
+            if not hunks:
+                return fixed_codes
+            pattern_cache.put(self.language, cluster['signature'], hunks, cluster['messages'])
+        
+        valid_count = 0
+        for file_path in files:
+            patched = apply_patch(checks[file_path]['code'], hunks)
+            if patched is None or patched == checks[file_path]['code']:
+                continue
+            fixed_codes[file_path] = patched
+            if self.generator.validate_syntax(patched)['valid']:
+                valid_count += 1
+        
+        if from_cache and fixed_codes and valid_count == 0:
+            pattern_cache.discard(self.language, cluster['signature'])
+        
+        source = "缓存的" if from_cache else "簇首文件的"
+        logger.info(f"🧩 {source}补丁修复了 {valid_count}/{len(files)} 个文件: {cluster['messages'][0]}")
+        return fixed_codes
+    
+    def _fix_clusters(self, test_files: List[Path]) -> Dict[str, str]:
+        """
+        按簇修复有相同语法错误的文件
+        
+        Returns:
+            {文件路径: 修复后的代码}，作为逐个文件验证/修复的起点
+        """
+        checks = {str(test_file): self._check_syntax(test_file) for test_file in test_files}
+        fixed_codes = {}
+        for cluster in self._cluster_syntax_failures(checks):
+            try:
+                fixed_codes.update(self._fix_cluster(cluster, checks))
+            except Exception as e:
+                logger.warning(f"⚠️ 按簇修复失败，改为逐个文件修复: {e}")
+        return fixed_codes
+    
+    async def _fix_clusters_async(self, test_files: List[Path], semaphore: asyncio.Semaphore) -> Dict[str, str]:
+        """按簇修复有相同语法错误的文件（各簇并发，簇首文件的 AI 修复受并发数限制）"""
+        loop = asyncio.get_event_loop()
+        
+        check_results = await asyncio.gather(
+            *[loop.run_in_executor(None, self._check_syntax, test_file) for test_file in test_files],
+            return_exceptions=True
+        )
+        checks = {
+            str(test_file): check
+            for test_file, check in zip(test_files, check_results)
+            if not isinstance(check, Exception)
+        }
+        
+        async def fix_cluster(cluster: Dict) -> Dict[str, str]:
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(None, self._fix_cluster, cluster, checks)
+                except Exception as e:
+                    logger.warning(f"⚠️ 按簇修复失败，改为逐个文件修复: {e}")
+                    return {}
+        
+        fixed_codes = {}
+        for result in await asyncio.gather(*[fix_cluster(c) for c in self._cluster_syntax_failures(checks)]):
+            fixed_codes.update(result)
+        return fixed_codes
+    
     def _find_test_files(self, directory: Path) -> List[Path]:
         """
         查找目录下的所有测试文件
@@ -345,7 +487,8 @@ class TestFixer:
     def _fix_single_test_file(
         self,
         test_file: Path,
-        max_fix_attempts: int = 5
+        max_fix_attempts: int = 5,
+        initial_code: Optional[str] = None
     ) -> Dict:
         """
         修复单个测试文件
@@ -353,6 +496,7 @@ class TestFixer:
         Args:
             test_file: 测试文件路径
             max_fix_attempts: 最大修复尝试次数
+            initial_code: 按簇修复后的代码（为空时从文件读取）
             
         Returns:
             修复结果
@@ -367,8 +511,10 @@ class TestFixer:
             
             # 验证语法并自动修复
             original_code = test_code
-            had_errors = False
+            had_errors = initial_code is not None
             fixed = False
+            if initial_code is not None:
+                test_code = initial_code
             
             for attempt in range(1, max_fix_attempts + 1):
                 logger.debug(f"  第 {attempt} 次验证...")
@@ -469,7 +615,8 @@ class TestFixer:
         max_fix_attempts: int,
         semaphore: asyncio.Semaphore,
         file_idx: int,
-        total_files: int
+        total_files: int,
+        initial_code: Optional[str] = None
     ) -> Dict:
         """
         异步修复单个测试文件
@@ -480,6 +627,7 @@ class TestFixer:
             semaphore: 信号量（控制并发数）
             file_idx: 当前文件索引
             total_files: 文件总数
+            initial_code: 按簇修复后的代码（为空时从文件读取）
             
         Returns:
             修复结果
@@ -498,8 +646,10 @@ class TestFixer:
                 
                 # 验证语法并自动修复
                 original_code = test_code
-                had_errors = False
+                had_errors = initial_code is not None
                 fixed = False
+                if initial_code is not None:
+                    test_code = initial_code
                 
                 for attempt in range(1, max_fix_attempts + 1):
                     logger.debug(f"  [{file_idx}/{total_files}] {file_name}: 第 {attempt} 次验证...")
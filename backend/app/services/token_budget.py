@@ -0,0 +1,222 @@
+"""Token 预算模块
+
+统一计量提示词的 token 数，根据预期输出大小选择 max_tokens，
+并在输入超出模型上下文窗口时对函数体做摘要裁剪
+"""
+
+from functools import lru_cache
+from typing import Dict, Optional
+from loguru import logger
+
+from app.config import get_settings
+from app.services.test_case_strategy import get_test_case_strategy
+
+
+# 常见模型的上下文窗口（按模型名前缀匹配，越具体的前缀越靠前）
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'deepseek': 128000,
+    'claude': 200000,
+    'codellama': 16384,
+    'qwen': 32768,
+}
+
+# 默认上下文窗口（未知模型）
+DEFAULT_CONTEXT_WINDOW = 32768
+
+
+@lru_cache(maxsize=16)
+def _get_encoding(model: str):
+    """获取 tiktoken 编码器（未知模型回退到 cl100k_base；tiktoken 不可用时返回 None）"""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"⚠️ tiktoken 不可用，使用字符数估算 token: {e}")
+        return None
+
+
+class TokenBudget:
+    """Token 预算计算器"""
+
+    def __init__(self, model: str):
+        """
+        初始化 Token 预算计算器
+
+        Args:
+            model: 模型名称（用于选择编码器和上下文窗口）
+        """
+        self.settings = get_settings()
+        self.model = model or ""
+        self.context_window = self.settings.llm_context_window or self._lookup_context_window(self.model)
+        self.max_output_tokens = self.settings.llm_max_output_tokens
+
+        # 单个测试用例的平均输出 token 数，以及文件级固定开销（package/import/Describe骨架）
+        self.tokens_per_test_case = self.settings.llm_tokens_per_test_case
+        self.output_overhead_tokens = 400
+
+        # 最小输出 token 数，以及为消息格式预留的安全余量
+        self.min_output_tokens = 1024
+        self.safety_margin = 256
+
+    def _lookup_context_window(self, model: str) -> int:
+        """根据模型名称查找上下文窗口"""
+        model = model.lower()
+        for prefix, window in MODEL_CONTEXT_WINDOWS.items():
+            if model.startswith(prefix):
+                return window
+        return DEFAULT_CONTEXT_WINDOW
+
+    def count(self, text: Optional[str]) -> int:
+        """计算文本的 token 数"""
+        if not text:
+            return 0
+
+        encoding = _get_encoding(self.model)
+        if encoding is None:
+            # 粗略估算：中英混合文本约 3 个字符 1 个 token
+            return len(text) // 3 + 1
+
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def estimate_test_output_tokens(self, file_analysis: Dict) -> int:
+        """
+        根据测试用例策略估算生成测试代码所需的输出 token 数
+
+        Args:
+            file_analysis: 文件分析结果（包含 functions 列表）
+
+        Returns:
+            预期输出 token 数
+        """
+        strategy = get_test_case_strategy().calculate_for_file(file_analysis)
+        function_count = len(file_analysis.get('functions', []))
+
+        return (
+            self.output_overhead_tokens
+            + function_count * 80  # 每个函数的 Describe/Context 骨架
+            + strategy['total_test_cases'] * self.tokens_per_test_case
+        )
+
+    def estimate_fix_output_tokens(self, test_code: str) -> int:
+        """估算修复测试代码所需的输出 token 数（需要重新输出完整代码，并预留补全空间）"""
+        return int(self.count(test_code) * 1.2) + 256
+
+    def input_budget(self, expected_output_tokens: int = 0) -> int:
+        """计算在预留输出空间后，输入可用的 token 数"""
+        reserved = min(
+            max(expected_output_tokens, self.min_output_tokens),
+            self.max_output_tokens
+        )
+        return max(0, self.context_window - reserved - self.safety_margin)
+
+    def pick_max_tokens(self, prompt_tokens: int, expected_output_tokens: Optional[int] = None) -> int:
+        """
+        根据预期输出大小选择 max_tokens
+
+        - 预期输出乘以 1.5 倍余量，避免截断
+        - 不超过模型输出上限，也不超过上下文窗口剩余空间
+
+        Args:
+            prompt_tokens: 提示词 token 数
+            expected_output_tokens: 预期输出 token 数（None 表示未知，使用输出上限）
+
+        Returns:
+            max_tokens
+        """
+        available = self.context_window - prompt_tokens - self.safety_margin
+
+        if expected_output_tokens is None:
+            max_tokens = self.max_output_tokens
+        else:
+            max_tokens = max(self.min_output_tokens, int(expected_output_tokens * 1.5))
+
+        max_tokens = min(max_tokens, self.max_output_tokens, available)
+
+        if max_tokens < self.min_output_tokens:
+            logger.warning(f"⚠️ 提示词 ({prompt_tokens} tokens) 接近上下文上限 ({self.context_window})，输出空间仅剩 {max(available, 0)} tokens")
+            max_tokens = max(available, 256)
+
+        return max_tokens
+
+    def body_budget(self, file_analysis: Dict, fixed_prompt_tokens: int = 2500) -> int:
+        """
+        计算每个函数体在提示词中可占用的 token 数
+
+        Args:
+            file_analysis: 文件分析结果
+            fixed_prompt_tokens: 提示词模板本身的固定开销
+
+        Returns:
+            每个函数体的 token 预算
+        """
+        function_count = max(1, len(file_analysis.get('functions', [])))
+        expected_output = self.estimate_test_output_tokens(file_analysis)
+        available = self.input_budget(expected_output) - fixed_prompt_tokens
+        return max(200, available // function_count)
+
+    def fits_in_context(self, file_analysis: Dict, fixed_prompt_tokens: int = 2500) -> bool:
+        """判断文件的全部函数体能否在一次请求中完整放入上下文"""
+        functions = file_analysis.get('functions', [])
+        body_tokens = sum(self.count(func.get('body', '')) for func in functions)
+        expected_output = self.estimate_test_output_tokens(file_analysis)
+        return body_tokens + fixed_prompt_tokens <= self.input_budget(expected_output)
+
+    def summarize_body(self, body: str, max_tokens: int) -> str:
+        """
+        对超出预算的函数体做摘要：保留开头和结尾，省略中间部分
+
+        Args:
+            body: 函数体源代码
+            max_tokens: 允许的最大 token 数
+
+        Returns:
+            摘要后的函数体
+        """
+        if self.count(body) <= max_tokens:
+            return body
+
+        lines = body.split('\n')
+        head, tail = [], []
+        used = 0
+        # 开头占 2/3 预算（通常包含参数校验和主要分支），结尾占 1/3（返回值）
+        head_budget = max_tokens * 2 // 3
+
+        for line in lines:
+            line_tokens = self.count(line) + 1
+            if used + line_tokens > head_budget:
+                break
+            head.append(line)
+            used += line_tokens
+
+        for line in reversed(lines[len(head):]):
+            line_tokens = self.count(line) + 1
+            if used + line_tokens > max_tokens:
+                break
+            tail.insert(0, line)
+            used += line_tokens
+
+        omitted = len(lines) - len(head) - len(tail)
+        if omitted <= 0:
+            return body
+
+        return '\n'.join(head + [f"    // ... 省略 {omitted} 行 ..."] + tail)
+
+
+# 按模型缓存的预算计算器
+_token_budgets: Dict[str, TokenBudget] = {}
+
+
+def get_token_budget(model: str) -> TokenBudget:
+    """获取指定模型的 Token 预算计算器"""
+    if model not in _token_budgets:
+        _token_budgets[model] = TokenBudget(model)
+    return _token_budgets[model]
@@ -0,0 +1,303 @@
+"""分布式追踪模块（OpenTelemetry）
+
+把一次任务从 API 请求、Celery 任务到 Agent 各阶段、单个源文件、单次 LLM 请求和子进程
+（go test / go mod tidy / gofmt / git 等）串成同一条 trace：
+- API 请求和 Celery 任务之间通过消息头（W3C traceparent）传递上下文
+- 线程池中执行的同步代码通过 bind_context 继承调用方的上下文
+- 导出到本地 JSONL 文件或 OTLP 收集器（TRACING_EXPORTER=file / otlp，默认关闭）
+
+查看本地 trace 文件（按耗时展开某个任务的调用树）:
+    python -m app.services.tracing /app/logs/traces.jsonl --trace-id <trace_id>
+"""
+
+import argparse
+import json
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence
+from loguru import logger
+
+from opentelemetry import context as otel_context
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import Status, StatusCode
+
+from app.config import get_settings
+
+
+TRACER_NAME = "aitest-agent"
+
+# span 属性值的最大长度（命令行、文件路径等）
+MAX_ATTRIBUTE_LENGTH = 512
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+class JsonlSpanExporter(SpanExporter):
+    """把 span 逐行写入本地 JSONL 文件（多个进程可追加写同一个文件）"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _to_dict(span: ReadableSpan) -> Dict:
+        parent = span.parent
+        return {
+            'trace_id': format(span.context.trace_id, '032x'),
+            'span_id': format(span.context.span_id, '016x'),
+            'parent_span_id': format(parent.span_id, '016x') if parent else None,
+            'name': span.name,
+            'service': span.resource.attributes.get('service.name'),
+            'start_time': span.start_time,
+            'end_time': span.end_time,
+            'duration_ms': round((span.end_time - span.start_time) / 1e6, 3),
+            'status': span.status.status_code.name,
+            'attributes': dict(span.attributes or {}),
+            'events': [
+                {'name': event.name, 'attributes': dict(event.attributes or {})}
+                for event in span.events
+            ]
+        }
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(json.dumps(self._to_dict(span), ensure_ascii=False, default=str) + "\n" for span in spans)
+        try:
+            with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+        except OSError as e:
+            logger.warning(f"写入 trace 文件失败: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def init_tracing(service_name: str):
+    """
+    初始化进程级追踪（重复调用无副作用）
+
+    Celery prefork 子进程必须在 fork 之后初始化（导出线程不能跨 fork），
+    因此 worker 在任务开始时调用
+
+    Args:
+        service_name: 服务名（aitest-api / aitest-worker）
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        _initialized = True
+
+        settings = get_settings()
+        exporter_name = settings.tracing_exporter
+        if exporter_name == "none":
+            return
+
+        if exporter_name == "file":
+            exporter = JsonlSpanExporter(settings.tracing_file)
+            target = settings.tracing_file
+        elif exporter_name == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            exporter = OTLPSpanExporter(endpoint=settings.tracing_otlp_endpoint)
+            target = settings.tracing_otlp_endpoint
+        else:
+            raise ValueError(f"不支持的 trace 导出方式: {exporter_name}（可选: none, file, otlp）")
+
+        provider = TracerProvider(
+            resource=Resource.create({'service.name': service_name}),
+            sampler=ParentBased(TraceIdRatioBased(settings.tracing_sample_ratio))
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        logger.info(f"🔗 分布式追踪已启用: {service_name} -> {target}")
+
+
+def _clean_attributes(attributes: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """去掉空值，过长的字符串截断（span 属性只支持基本类型）"""
+    cleaned = {}
+    for key, value in (attributes or {}).items():
+        if value is None:
+            continue
+        if not isinstance(value, (bool, int, float)):
+            value = str(value)[:MAX_ATTRIBUTE_LENGTH]
+        cleaned[key] = value
+    return cleaned
+
+
+@contextmanager
+def start_span(name: str, attributes: Optional[Dict[str, Any]] = None, context=None):
+    """
+    在当前上下文下开启一个 span（可包裹 await 语句；异常会记录到 span 并标记为错误）
+
+    用法:
+        with start_span("llm.request", {'llm.provider': provider}) as span:
+            ...
+            span.set_attribute('llm.completion_tokens', n)
+
+    Args:
+        name: span 名称
+        attributes: span 属性
+        context: 父上下文（为空时使用当前上下文）
+    """
+    tracer = trace.get_tracer(TRACER_NAME)
+    with tracer.start_as_current_span(name, context=context, attributes=_clean_attributes(attributes)) as span:
+        yield span
+
+
+def set_span_attributes(span, attributes: Dict[str, Any]):
+    """批量设置 span 属性（忽略空值）"""
+    if span.is_recording():
+        span.set_attributes(_clean_attributes(attributes))
+
+
+def mark_span_error(span, message: str):
+    """把 span 标记为失败（没有抛出异常的失败，如任务结果 success=False）"""
+    span.set_status(Status(StatusCode.ERROR, message))
+
+
+def current_trace_id() -> Optional[str]:
+    """当前 trace 的 ID（未启用追踪时返回 None）"""
+    span_context = trace.get_current_span().get_span_context()
+    if not span_context.is_valid:
+        return None
+    return format(span_context.trace_id, '032x')
+
+
+def inject_headers(headers: Optional[Dict] = None) -> Dict:
+    """把当前上下文写入消息头/HTTP 头（W3C traceparent）"""
+    carrier = headers if headers is not None else {}
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract_context(headers: Dict):
+    """从消息头/HTTP 头中恢复上下文"""
+    return propagate.extract(headers)
+
+
+def bind_context(func: Callable) -> Callable:
+    """
+    让函数在调用方的追踪上下文中执行（用于 run_in_executor / 线程池）
+
+    线程池不会继承 contextvars，不绑定时其中的 span 会变成新的 trace
+    """
+    ctx = otel_context.get_current()
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = otel_context.attach(ctx)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            otel_context.detach(token)
+
+    return wrapper
+
+
+# Celery 任务的 span（task_prerun 开启，task_postrun 结束）
+_task_spans: Dict[str, tuple] = {}
+_task_spans_lock = threading.Lock()
+
+
+def start_task_span(task_id: str, task_name: str, request):
+    """
+    开启 Celery 任务的 span，父上下文取自消息头
+
+    Args:
+        task_id: Celery 任务 ID
+        task_name: 任务名
+        request: Celery 任务请求（消息头中的 traceparent 是它的属性）
+    """
+    init_tracing("aitest-worker")
+    carrier = {
+        key: getattr(request, key)
+        for key in ('traceparent', 'tracestate')
+        if getattr(request, key, None)
+    }
+    span = trace.get_tracer(TRACER_NAME).start_span(
+        f"celery.task/{task_name}",
+        context=extract_context(carrier),
+        kind=trace.SpanKind.CONSUMER,
+        attributes={'celery.task_id': task_id, 'celery.task_name': task_name}
+    )
+    token = otel_context.attach(trace.set_span_in_context(span))
+    with _task_spans_lock:
+        _task_spans[task_id] = (span, token)
+
+
+def end_task_span(task_id: str, state: Optional[str] = None):
+    """结束 Celery 任务的 span"""
+    with _task_spans_lock:
+        entry = _task_spans.pop(task_id, None)
+    if entry is None:
+        return
+    span, token = entry
+    if state:
+        span.set_attribute('celery.state', state)
+        if state == "FAILURE":
+            span.set_status(Status(StatusCode.ERROR))
+    otel_context.detach(token)
+    span.end()
+
+    # prefork 子进程可能随时被回收（worker_max_tasks_per_child），任务结束时立即导出
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, 'force_flush'):
+        provider.force_flush()
+
+
+def _print_trace(spans: Sequence[Dict], min_ms: float):
+    """按父子关系缩进打印一条 trace，兄弟节点按开始时间排序"""
+    children = defaultdict(list)
+    ids = {span['span_id'] for span in spans}
+    for span in spans:
+        parent = span['parent_span_id'] if span['parent_span_id'] in ids else None
+        children[parent].append(span)
+
+    def walk(parent, depth):
+        for span in sorted(children.get(parent, []), key=lambda s: s['start_time']):
+            if span['duration_ms'] >= min_ms:
+                attrs = ", ".join(f"{k}={v}" for k, v in span['attributes'].items())
+                flag = " ❌" if span['status'] == "ERROR" else ""
+                print(f"{'  ' * depth}{span['duration_ms']:>10.1f}ms  {span['name']}{flag}  {attrs}")
+            walk(span['span_id'], depth + 1)
+
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看本地 JSONL trace 文件")
+    parser.add_argument("path", help="trace 文件路径（TRACING_FILE）")
+    parser.add_argument("--trace-id", default="", help="只显示指定 trace（默认列出所有 trace）")
+    parser.add_argument("--min-ms", type=float, default=0, help="只显示耗时不低于该值的 span")
+    args = parser.parse_args()
+
+    traces = defaultdict(list)
+    with open(args.path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                traces[span['trace_id']].append(span)
+
+    if args.trace_id:
+        _print_trace(traces.get(args.trace_id, []), args.min_ms)
+        return
+
+    for trace_id, spans in traces.items():
+        roots = [span for span in spans if not span['parent_span_id']]
+        root = min(roots or spans, key=lambda s: s['start_time'])
+        duration = (max(s['end_time'] for s in spans) - min(s['start_time'] for s in spans)) / 1e6
+        print(f"{trace_id}  {duration:>10.1f}ms  {len(spans):>5} spans  {root['name']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,44 @@
 """Celery Worker配置"""
-from celery import Celery
+from celery import Celery, chord
+from celery.signals import (
+    before_task_publish,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_shutdown
+)
+from kombu.utils.json import register_type
 from loguru import logger
 import asyncio
+import os
 from datetime import datetime
+from pathlib import Path
 
 from app.config import get_settings
 from app.database import AsyncSessionLocal, Task, TaskLog, CoverageReport, Project, TaskStatus
 from app.agent.test_agent import TestGenerationAgent
+from app.services.analysis_model import FunctionInfo
+from app.services.artifact_store import ArtifactStore
+from app.services.checkpoints import (
+    STAGE_GENERATE,
+    STAGE_PREPARE,
+    clear_checkpoints,
+    load_checkpoint,
+    save_checkpoint
+)
+from app.services.fix_jobs import FixJobReporter, load_fix_job
+from app.services.llm_batch import create_batch, load_batch, process_batches
+from app.services.scheduler import collect_due_projects, create_scheduled_task
+from app.services.task_routing import (
+    PRIORITY_SEPARATOR,
+    PRIORITY_STEPS,
+    QUEUE_BULK,
+    TASK_ROUTES,
+    dispatch_generation_task,
+    stage_queues
+)
+from app.services.metrics import clear_multiprocess_dir, mark_process_dead, start_metrics_server
+from app.services.tracing import end_task_span, inject_headers, start_task_span
 from uuid import uuid4
 
 
@@ -30,164 +62,635 @@ celery_app.conf.update(
     task_time_limit=7200,  # 2小时超时（适合大项目）
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=50,
+    # 按类型和规模分队列（见 task_routing），各队列由独立的 worker 消费
+    task_default_queue=QUEUE_BULK,
+    task_routes=TASK_ROUTES,
+    task_create_missing_queues=True,
+    # 队列内按优先级出队（小任务优先）
+    broker_transport_options={
+        'priority_steps': PRIORITY_STEPS,
+        'sep': PRIORITY_SEPARATOR,
+        'queue_order_strategy': 'priority',
+        # 分阶段执行的子任务在执行完成后才确认（acks_late），超过该时间未确认的消息会重新投递
+        'visibility_timeout': settings.celery_bulk_time_limit + 600,
+    },
 )
 
+# 任务参数和结果中的函数分析结果只传递函数体的字节区间
+register_type(FunctionInfo, 'function_info', FunctionInfo.to_json, FunctionInfo.from_json)
+
+
+@worker_init.connect
+def _start_worker_metrics(**kwargs):
+    """worker 主进程启动时（prefork 子进程创建前）启动指标服务"""
+    if settings.metrics_worker_port:
+        clear_multiprocess_dir()
+        start_metrics_server(settings.metrics_worker_port)
+
+
+@worker_process_shutdown.connect
+def _cleanup_worker_metrics(pid=None, **kwargs):
+    """prefork 子进程退出时清理其进行中请求数等仪表数据"""
+    mark_process_dead(pid or os.getpid())
+
+
+@before_task_publish.connect
+def _inject_trace_context(headers=None, **kwargs):
+    """投递任务时把当前 trace 上下文写入消息头（在 API 进程中执行）"""
+    if headers is not None:
+        inject_headers(headers)
+
+
+@task_prerun.connect
+def _start_task_trace(task_id=None, task=None, **kwargs):
+    """任务开始时接续投递方的 trace"""
+    start_task_span(task_id, task.name, task.request)
+
+
+@task_postrun.connect
+def _end_task_trace(task_id=None, state=None, **kwargs):
+    end_task_span(task_id, state)
+
 
 @celery_app.task(bind=True, name="run_test_generation_task")
-def run_test_generation_task(self, task_id: str):
+def run_test_generation_task(self, task_id: str, batch_mode: bool = False, batch_id: str = None):
     """
     执行测试生成任务
     
+    分阶段执行（celery_staged_pipeline）时本任务只执行准备阶段，之后的阶段拆成子任务（见 _prepare_stage）
+    
     Args:
         task_id: 任务ID
+        batch_mode: 是否使用批处理模式（生成请求通过提供商的批处理接口提交）
+        batch_id: 批处理记录ID（批次结束后恢复执行时传入）
     """
-    logger.info(f"🚀 开始执行任务: {task_id}")
+    logger.info(f"🚀 开始执行任务: {task_id}" + (f" (批处理恢复: {batch_id})" if batch_id else ""))
     
     # 在事件循环中运行异步任务
     loop = asyncio.get_event_loop()
-    result = loop.run_until_complete(_execute_task(task_id, self))
+    if settings.celery_staged_pipeline:
+        queue = (self.request.delivery_info or {}).get('routing_key') or QUEUE_BULK
+        result = loop.run_until_complete(_prepare_stage(task_id, self, queue, batch_mode, batch_id))
+    else:
+        result = loop.run_until_complete(_execute_task(task_id, self, batch_mode, batch_id))
     
     return result
 
 
-async def _execute_task(task_id: str, celery_task):
+async def _load_task(db, task_id: str):
+    """读取任务及其项目（不存在时返回 None）"""
+    from sqlalchemy import select
+    
+    result = await db.execute(
+        select(Task).where(Task.id == task_id)
+    )
+    task = result.scalar_one_or_none()
+    
+    if not task:
+        logger.error(f"任务不存在: {task_id}")
+        return None, None
+    
+    # 获取项目配置
+    result = await db.execute(
+        select(Project).where(Project.id == task.project_id)
+    )
+    project = result.scalar_one_or_none()
+    
+    if not project:
+        logger.error(f"项目不存在: {task.project_id}")
+        return task, None
+    
+    return task, project
+
+
+async def _build_project_config(db, task, project, batch_mode: bool = False, batch_id: str = None) -> dict:
+    """组装 Agent 使用的项目配置"""
+    from sqlalchemy import select
+    
+    # 获取上一次任务的覆盖率报告（用于覆盖率引导生成）
+    previous_files_coverage = None
+    if settings.coverage_guided_generation:
+        result = await db.execute(
+            select(CoverageReport)
+            .where(
+                CoverageReport.project_id == project.id,
+                CoverageReport.task_id != task.id
+            )
+            .order_by(CoverageReport.created_at.desc())
+            .limit(1)
+        )
+        previous_report = result.scalar_one_or_none()
+        if previous_report:
+            previous_files_coverage = previous_report.files_coverage
+            logger.info(f"📈 使用任务 {previous_report.task_id} 的覆盖率报告引导生成")
+    
+    # 批处理恢复：使用批次结果，并固定到收集请求时的 commit
+    batch_results = None
+    pinned_commit = None
+    if batch_id:
+        batch = await load_batch(db, batch_id)
+        if batch:
+            batch_results = batch.results or {}
+            pinned_commit = batch.commit_hash
+        else:
+            logger.warning(f"⚠️ 批处理记录不存在: {batch_id}，改为实时调用")
+    
+    return {
+        'git_url': project.git_url,
+        'git_branch': project.git_branch,
+        'language': project.language.value,
+        'test_framework': project.test_framework.value,
+        'source_directory': project.source_directory,
+        'test_directory': project.test_directory,
+        'auto_commit': project.auto_commit,
+        'create_pr': project.create_pr,
+        'ai_provider': settings.ai_provider,
+        'max_test_fix_retries': settings.max_test_fix_retries,
+        'enable_auto_fix': settings.enable_auto_fix,
+        'max_concurrent_generations': settings.max_concurrent_generations,
+        'max_concurrent_fixes': settings.max_concurrent_fixes,
+        'failure_clustering': settings.failure_clustering,
+        'skip_existing_tests': settings.skip_existing_tests,
+        'coverage_guided_generation': settings.coverage_guided_generation,
+        'coverage_threshold': project.coverage_threshold,
+        'previous_files_coverage': previous_files_coverage,
+        'batch_mode': not batch_id and (batch_mode or settings.llm_batch_mode),
+        'batch_results': batch_results,
+        'pinned_commit': pinned_commit
+    }
+
+
+def _progress_callback(db, task, celery_task):
+    """创建进度回调（更新任务进度、写任务日志、更新 Celery 任务状态）"""
+    async def progress_callback(progress: int, status: str, message: str):
+        # 更新任务进度
+        task.progress = progress
+        task.status = TaskStatus[status] if status in TaskStatus.__members__ else task.status
+        
+        # 添加日志
+        log = TaskLog(
+            id=str(uuid4()),
+            task_id=task.id,
+            level="INFO",
+            message=message
+        )
+        db.add(log)
+        await db.commit()
+        
+        # 更新Celery任务状态
+        if celery_task is not None:
+            celery_task.update_state(
+                state='PROGRESS',
+                meta={'progress': progress, 'status': status, 'message': message}
+            )
+    
+    return progress_callback
+
+
+async def _save_task_result(db, task, result: dict) -> dict:
+    """把 Agent 的执行结果写回任务（批处理模式下保存收集到的请求）"""
+    task_id = task.id
+    
+    # 批处理模式：请求已收集，任务保持 GENERATING 状态等待批次结果
+    if result['batch']:
+        batch_id = await create_batch(db, task_id, result['commit_hash'], result['batch'])
+        return {
+            'task_id': task_id,
+            'success': False,
+            'batch_id': batch_id,
+            'test_files': [],
+            'coverage': {}
+        }
+    
+    # 记录分析的源文件，供下一次任务估算规模
+    if result.get('source_files') is not None:
+        task.target_files = result['source_files']
+    
+    # 更新任务结果
+    if result['success']:
+        task.status = TaskStatus.COMPLETED
+        task.commit_hash = result['commit_hash']
+        task.generated_tests = result['test_files']
+        task.total_tests = result['test_results'].get('total', 0)
+        task.passed_tests = result['test_results'].get('passed_count', 0)
+        task.failed_tests = result['test_results'].get('failed_count', 0)
+        task.line_coverage = result['coverage'].get('line_coverage')
+        task.branch_coverage = result['coverage'].get('branch_coverage')
+        task.function_coverage = result['coverage'].get('function_coverage')
+        task.coverage_data = result['coverage']
+        task.completed_at = datetime.utcnow()
+        
+        # 保存覆盖率报告
+        if result['coverage']:
+            coverage_report = CoverageReport(
+                id=str(uuid4()),
+                task_id=task_id,
+                project_id=task.project_id,
+                total_lines=0,  # 需要从coverage_data中提取
+                covered_lines=0,
+                line_coverage=result['coverage'].get('line_coverage', 0.0),
+                total_branches=0,
+                covered_branches=0,
+                branch_coverage=result['coverage'].get('branch_coverage', 0.0),
+                total_functions=0,
+                covered_functions=0,
+                function_coverage=result['coverage'].get('function_coverage', 0.0),
+                files_coverage=result['coverage'].get('files_coverage', {})
+            )
+            db.add(coverage_report)
+        
+        logger.info(f"✅ 任务完成: {task_id}")
+    else:
+        task.status = TaskStatus.FAILED
+        task.error_message = result.get('error')
+        task.completed_at = datetime.utcnow()
+        
+        logger.error(f"❌ 任务失败: {task_id}")
+    
+    await db.commit()
+    
+    return {
+        'task_id': task_id,
+        'success': result['success'],
+        'test_files': result['test_files'],
+        'coverage': result['coverage']
+    }
+
+
+async def _mark_failed(db, task, error: Exception) -> dict:
+    logger.error(f"任务执行异常: {error}")
+    
+    # 更新任务为失败状态
+    if task is not None:
+        task.status = TaskStatus.FAILED
+        task.error_message = str(error)
+        task.completed_at = datetime.utcnow()
+        await db.commit()
+    
+    return {"error": str(error)}
+
+
+async def _execute_task(task_id: str, celery_task, batch_mode: bool = False, batch_id: str = None):
     """执行任务的异步函数"""
     async with AsyncSessionLocal() as db:
+        task = None
         try:
-            # 获取任务信息
-            from sqlalchemy import select
-            
-            result = await db.execute(
-                select(Task).where(Task.id == task_id)
-            )
-            task = result.scalar_one_or_none()
-            
+            task, project = await _load_task(db, task_id)
             if not task:
-                logger.error(f"任务不存在: {task_id}")
                 return {"error": "Task not found"}
-            
-            # 获取项目配置
-            result = await db.execute(
-                select(Project).where(Project.id == task.project_id)
-            )
-            project = result.scalar_one_or_none()
-            
             if not project:
-                logger.error(f"项目不存在: {task.project_id}")
                 return {"error": "Project not found"}
             
+            project_config = await _build_project_config(db, task, project, batch_mode, batch_id)
+            
             # 更新任务状态
             task.status = TaskStatus.CLONING
-            task.started_at = datetime.utcnow()
+            if not batch_id:
+                task.started_at = datetime.utcnow()
             await db.commit()
             
-            # 创建进度回调
-            async def progress_callback(progress: int, status: str, message: str):
-                # 更新任务进度
-                task.progress = progress
-                task.status = TaskStatus[status] if status in TaskStatus.__members__ else task.status
-                
-                # 添加日志
-                log = TaskLog(
-                    id=str(uuid4()),
-                    task_id=task_id,
-                    level="INFO",
-                    message=message
-                )
-                db.add(log)
-                await db.commit()
-                
-                # 更新Celery任务状态
-                celery_task.update_state(
-                    state='PROGRESS',
-                    meta={'progress': progress, 'status': status, 'message': message}
-                )
-            
             # 执行测试生成
             agent = TestGenerationAgent()
-            
-            project_config = {
-                'git_url': project.git_url,
-                'git_branch': project.git_branch,
-                'language': project.language.value,
-                'test_framework': project.test_framework.value,
-                'source_directory': project.source_directory,
-                'test_directory': project.test_directory,
-                'auto_commit': project.auto_commit,
-                'create_pr': project.create_pr,
-                'ai_provider': settings.ai_provider,
-                'max_test_fix_retries': settings.max_test_fix_retries,
-                'enable_auto_fix': settings.enable_auto_fix,
-                'max_concurrent_generations': settings.max_concurrent_generations,
-                'skip_existing_tests': settings.skip_existing_tests
-            }
-            
             result = await agent.execute(
                 task.project_id,
                 project_config,
                 task_id,
-                progress_callback
+                _progress_callback(db, task, celery_task),
+                ArtifactStore(db, task_id)
             )
             
-            # 更新任务结果
-            if result['success']:
-                task.status = TaskStatus.COMPLETED
-                task.commit_hash = result['commit_hash']
-                task.generated_tests = result['test_files']
-                task.total_tests = result['test_results'].get('total', 0)
-                task.passed_tests = result['test_results'].get('passed_count', 0)
-                task.failed_tests = result['test_results'].get('failed_count', 0)
-                task.line_coverage = result['coverage'].get('line_coverage')
-                task.branch_coverage = result['coverage'].get('branch_coverage')
-                task.function_coverage = result['coverage'].get('function_coverage')
-                task.coverage_data = result['coverage']
-                task.completed_at = datetime.utcnow()
-                
-                # 保存覆盖率报告
-                if result['coverage']:
-                    coverage_report = CoverageReport(
-                        id=str(uuid4()),
-                        task_id=task_id,
-                        project_id=task.project_id,
-                        total_lines=0,  # 需要从coverage_data中提取
-                        covered_lines=0,
-                        line_coverage=result['coverage'].get('line_coverage', 0.0),
-                        total_branches=0,
-                        covered_branches=0,
-                        branch_coverage=result['coverage'].get('branch_coverage', 0.0),
-                        total_functions=0,
-                        covered_functions=0,
-                        function_coverage=result['coverage'].get('function_coverage', 0.0),
-                        files_coverage=result['coverage'].get('files_coverage', {})
-                    )
-                    db.add(coverage_report)
-                
-                logger.info(f"✅ 任务完成: {task_id}")
-            else:
-                task.status = TaskStatus.FAILED
-                task.error_message = result.get('error')
-                task.completed_at = datetime.utcnow()
-                
-                logger.error(f"❌ 任务失败: {task_id}")
+            return await _save_task_result(db, task, result)
+        
+        except Exception as e:
+            return await _mark_failed(db, task, e)
+
+
+async def _prepare_stage(task_id: str, celery_task, queue: str, batch_mode: bool = False, batch_id: str = None):
+    """
+    分阶段执行的准备阶段：克隆、分析，然后把逐文件生成子任务和测试提交子任务组成 chord 投递
+    
+    已有检查点时从检查点继续：已有 generate 检查点直接投递测试提交子任务；
+    已有 prepare 检查点（重试或批处理恢复）时跳过分析，固定到检查点的 commit 后重新投递生成子任务
+    """
+    async with AsyncSessionLocal() as db:
+        task = None
+        try:
+            task, project = await _load_task(db, task_id)
+            if not task:
+                return {"error": "Task not found"}
+            if not project:
+                return {"error": "Project not found"}
+            
+            project_config = await _build_project_config(db, task, project, batch_mode, batch_id)
+            progress_callback = _progress_callback(db, task, celery_task)
+            queues = stage_queues(queue)
             
+            task.status = TaskStatus.CLONING
+            if not batch_id and not task.started_at:
+                task.started_at = datetime.utcnow()
             await db.commit()
             
-            return {
-                'task_id': task_id,
-                'success': result['success'],
-                'test_files': result['test_files'],
-                'coverage': result['coverage']
-            }
+            if not batch_id and await load_checkpoint(db, task_id, STAGE_GENERATE) is not None:
+                logger.info(f"♻️ 任务 {task_id} 从 generate 检查点继续")
+                pipeline_finish.apply_async((None, task_id), queue=queues['finish'])
+                return {'task_id': task_id, 'stage': STAGE_GENERATE, 'resumed': True}
+            
+            agent = TestGenerationAgent()
+            language = project_config['language']
+            plan = await load_checkpoint(db, task_id, STAGE_PREPARE)
+            if plan is not None:
+                logger.info(f"♻️ 任务 {task_id} 从 prepare 检查点继续 (commit {plan['commit_hash'][:8]})")
+                await agent.git_service.clone_or_pull(project.id, project.git_url, project.git_branch)
+                await agent.git_service.pin_commit(plan['repo_path'], plan['commit_hash'])
+            else:
+                try:
+                    plan = await agent.prepare(project.id, project_config, progress_callback, ArtifactStore(db, task_id))
+                except Exception as e:
+                    result = await agent.fail(agent.new_result(), language, e, progress_callback)
+                    return await _save_task_result(db, task, result)
+                await save_checkpoint(db, task_id, STAGE_PREPARE, plan)
+            
+            task.target_files = plan['source_files']
+            total_files = len(plan['test_tasks'])
+            await progress_callback(50, "GENERATING", f"开始生成测试代码: 0/{total_files} 个文件")
+            
+            finish = pipeline_finish.s(task_id, batch_mode, batch_id).set(queue=queues['finish'])
+            # 子任务因 worker 丢失等原因失败时 chord 不会执行 pipeline_finish，由错误回调把任务标记为失败
+            finish.on_error(pipeline_failed.s(task_id).set(queue=queues['finish']))
+            if total_files:
+                header = [
+                    pipeline_generate_file.s(task_id, index, batch_mode, batch_id).set(queue=queues['generate'])
+                    for index in range(total_files)
+                ]
+                chord(header)(finish)
+            else:
+                finish.apply_async(([],))
+            
+            logger.info(f"📤 任务 {task_id} 投递 {total_files} 个生成子任务 ({queues['generate']} 队列)")
+            return {'task_id': task_id, 'stage': STAGE_PREPARE, 'files': total_files}
         
         except Exception as e:
-            logger.error(f"任务执行异常: {e}")
+            return await _mark_failed(db, task, e)
+
+
+@celery_app.task(
+    bind=True,
+    name="pipeline_generate_file",
+    acks_late=True,
+    reject_on_worker_lost=True,
+    soft_time_limit=settings.celery_interactive_time_limit
+)
+def pipeline_generate_file(self, task_id: str, index: int, batch_mode: bool = False, batch_id: str = None):
+    """
+    分阶段执行的生成子任务：为执行计划中的一个源文件生成测试
+    
+    Args:
+        task_id: 任务ID
+        index: 源文件在执行计划 test_tasks 中的位置
+        batch_mode: 是否使用批处理模式（只收集生成请求）
+        batch_id: 批处理记录ID（批次结束后恢复执行时传入）
+    
+    Returns:
+        可序列化的生成结果（chord 汇总后交给 pipeline_finish）
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        return loop.run_until_complete(_generate_file_stage(task_id, index, batch_mode, batch_id))
+    except Exception as e:
+        # 子任务抛出异常（超时、数据库或检查点错误）会使整个 chord 失败，pipeline_finish 不会执行，
+        # 这里记为该文件生成失败，由 pipeline_finish 照常汇总
+        logger.error(f"❌ 任务 {task_id} 第 {index} 个文件生成异常: {type(e).__name__}: {e}")
+        return {'index': index, 'success': False, 'error': f"{type(e).__name__}: {e}"}
+
+
+async def _generate_file_stage(task_id: str, index: int, batch_mode: bool = False, batch_id: str = None):
+    async with AsyncSessionLocal() as db:
+        task, project = await _load_task(db, task_id)
+        if not task or not project or task.status == TaskStatus.CANCELLED:
+            return {'index': index, 'success': False, 'error': "任务不存在或已取消"}
+        
+        plan = await load_checkpoint(db, task_id, STAGE_PREPARE)
+        if plan is None:
+            return {'index': index, 'success': False, 'error': "缺少 prepare 检查点"}
+        project_config = await _build_project_config(db, task, project, batch_mode, batch_id)
+        
+        # 子任务重新投递或任务重试时，已验证通过的文件直接复用
+        artifact_store = ArtifactStore(db, task_id)
+        await artifact_store.load(plan['repo_path'])
+        
+        agent = TestGenerationAgent()
+        test_generator = agent.create_test_generator(plan['repo_path'], project_config)
+        generated = await agent.generate(
+            [plan['test_tasks'][index]],
+            test_generator,
+            Path(plan['test_dir']),
+            project_config,
+            artifact_store=artifact_store
+        )
+        item = generated[0]
+    
+    result = {
+        'index': index,
+        'success': item['success'],
+        'test_file': item.get('test_file'),
+        'test_code': item.get('test_code'),
+        'error': item.get('error'),
+        'llm_usage': dict(test_generator.usage)
+    }
+    batch_session = test_generator.batch_session
+    if batch_session is not None and batch_session.collecting:
+        result['batch_requests'] = batch_session.pending_requests()
+    elif batch_session is not None:
+        result['batch_hits'] = batch_session.hits
+        result['batch_misses'] = batch_session.misses
+    return result
+
+
+@celery_app.task(
+    bind=True,
+    name="pipeline_finish",
+    acks_late=True,
+    reject_on_worker_lost=True
+)
+def pipeline_finish(self, generated: list, task_id: str, batch_mode: bool = False, batch_id: str = None):
+    """
+    分阶段执行的测试提交子任务：汇总生成结果，执行测试、修复、收集覆盖率、提交
+    
+    Args:
+        generated: 各生成子任务的结果（从 generate 检查点继续时为 None）
+        task_id: 任务ID
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(_finish_stage(generated, task_id, self, batch_mode, batch_id))
+
+
+async def _finish_stage(generated, task_id: str, celery_task, batch_mode: bool = False, batch_id: str = None):
+    async with AsyncSessionLocal() as db:
+        task = None
+        try:
+            task, project = await _load_task(db, task_id)
+            if not task:
+                return {"error": "Task not found"}
+            if not project:
+                return {"error": "Project not found"}
+            if task.status == TaskStatus.CANCELLED:
+                logger.info(f"⏹️ 任务已取消: {task_id}")
+                return {'task_id': task_id, 'cancelled': True}
             
-            # 更新任务为失败状态
-            task.status = TaskStatus.FAILED
-            task.error_message = str(e)
-            task.completed_at = datetime.utcnow()
-            await db.commit()
+            plan = await load_checkpoint(db, task_id, STAGE_PREPARE)
+            if plan is None:
+                raise RuntimeError("缺少 prepare 检查点")
+            project_config = await _build_project_config(db, task, project, batch_mode, batch_id)
+            progress_callback = _progress_callback(db, task, celery_task)
             
+            agent = TestGenerationAgent()
+            language = project_config['language']
+            result = agent.new_result()
+            result['commit_hash'] = plan['commit_hash']
+            result['source_files'] = plan['source_files']
+            
+            if generated is None:
+                generated = await load_checkpoint(db, task_id, STAGE_GENERATE) or []
+            generated = sorted(generated, key=lambda item: item['index'])
+            
+            # 批处理模式：合并各子任务收集到的请求（相同请求只保留一个）
+            batch_requests = {}
+            for item in generated:
+                for request in item.get('batch_requests') or []:
+                    batch_requests[request['custom_id']] = request
+            if batch_requests:
+                test_generator = agent.create_test_generator(plan['repo_path'], project_config)
+                result = await agent.defer_to_batch(
+                    result,
+                    test_generator.ai_provider,
+                    test_generator.model,
+                    list(batch_requests.values()),
+                    progress_callback
+                )
+                return await _save_task_result(db, task, result)
+            
+            await save_checkpoint(db, task_id, STAGE_GENERATE, generated)
+            
+            if batch_id:
+                hits = sum(item.get('batch_hits', 0) for item in generated)
+                misses = sum(item.get('batch_misses', 0) for item in generated)
+                logger.info(f"📥 批处理结果: 命中 {hits} 个请求，实时调用 {misses} 个")
+            
+            # 汇总各子任务的 LLM 用量
+            usage = {}
+            for item in generated:
+                for key, value in (item.get('llm_usage') or {}).items():
+                    usage[key] = usage.get(key, 0) + value
+            
+            generated_results = []
+            for item in generated:
+                result_item = {**item, 'file_analysis': plan['test_tasks'][item['index']]['file_analysis']}
+                # 子任务在其他机器上执行且工作目录未共享时，按检查点中的代码重新写入测试文件
+                if item['success'] and not Path(item['test_file']).exists():
+                    Path(item['test_file']).parent.mkdir(parents=True, exist_ok=True)
+                    Path(item['test_file']).write_text(item['test_code'], encoding='utf-8')
+                generated_results.append(result_item)
+            
+            test_generator = agent.create_test_generator(plan['repo_path'], project_config, use_batch=False)
+            try:
+                result = await agent.finish(
+                    task.project_id,
+                    project_config,
+                    task_id,
+                    plan,
+                    generated_results,
+                    result,
+                    test_generator,
+                    progress_callback
+                )
+            except Exception as e:
+                result = await agent.fail(result, language, e, progress_callback)
+            
+            # 修复阶段的调用计入用量
+            for key, value in test_generator.usage.items():
+                usage[key] = usage.get(key, 0) + value
+            result['llm_usage'] = usage
+            agent.log_llm_usage(usage)
+            
+            response = await _save_task_result(db, task, result)
+            if result['success']:
+                await clear_checkpoints(db, task_id)
+            return response
+        
+        except Exception as e:
+            return await _mark_failed(db, task, e)
+
+
+@celery_app.task(name="pipeline_failed")
+def pipeline_failed(request, exc, traceback, task_id: str):
+    """
+    分阶段执行的错误回调：chord 失败（pipeline_finish 未执行）时把任务标记为失败
+    
+    Args:
+        request: 失败子任务的请求上下文
+        exc: 失败原因
+        traceback: 异常堆栈
+        task_id: 任务ID
+    """
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(_fail_pipeline(task_id, exc))
+
+
+async def _fail_pipeline(task_id: str, error: Exception):
+    async with AsyncSessionLocal() as db:
+        task, _ = await _load_task(db, task_id)
+        if not task or task.status in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED):
+            return {'task_id': task_id, 'skipped': True}
+        return await _mark_failed(db, task, error)
+
+
+@celery_app.task(name="run_fix_tests_job")
+def run_fix_tests_job(job_id: str):
+    """
+    执行测试修复任务（POST /api/tasks/fix-tests 创建）
+    
+    Args:
+        job_id: 修复任务ID
+    """
+    logger.info(f"🔧 开始执行修复任务: {job_id}")
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(_run_fix_tests_job(job_id))
+
+
+async def _run_fix_tests_job(job_id: str):
+    from app.services.test_fixer import TestFixer
+    
+    async with AsyncSessionLocal() as db:
+        job = await load_fix_job(db, job_id)
+        if not job:
+            logger.error(f"修复任务不存在: {job_id}")
+            return {"error": "Fix job not found"}
+        
+        reporter = FixJobReporter(db, job)
+        await reporter.start()
+        request = job.request
+        try:
+            fixer = TestFixer(
+                language=request['language'],
+                test_framework=request['test_framework']
+            )
+            result = await fixer.fix_tests_in_directory_async(
+                workspace_path=request['workspace_path'],
+                test_directory=request['test_directory'],
+                max_fix_attempts=request['max_fix_attempts'],
+                max_concurrent=settings.max_concurrent_generations,  # 文件级并发；LLM 请求另受全局限流器约束
+                auto_git_commit=request['auto_git_commit'],
+                git_username=request['git_username'],
+                git_branch_name=request.get('git_branch_name'),
+                git_commit_message=request.get('git_commit_message'),
+                on_event=reporter
+            )
+            await reporter.complete(result)
+            return {'job_id': job_id, 'success': result['success'], 'message': result['message']}
+        
+        except Exception as e:
+            logger.error(f"❌ 测试修复失败: {e}")
+            await reporter.fail(e)
             return {"error": str(e)}
 
 
@@ -199,11 +702,83 @@ def cleanup_old_tasks():
     return {"message": "Cleanup completed"}
 
 
+@celery_app.task(name="process_llm_batches")
+def process_llm_batches():
+    """提交收集窗口到期的批处理请求、查询已提交的批次，批次结束后恢复对应任务（定时任务）"""
+    loop = asyncio.get_event_loop()
+    ready = loop.run_until_complete(_process_llm_batches())
+    
+    return {"resumed": len(ready)}
+
+
+async def _process_llm_batches():
+    from sqlalchemy import select
+    
+    async with AsyncSessionLocal() as db:
+        ready = await process_batches(db)
+        for item in ready:
+            result = await db.execute(select(Task.project_id).where(Task.id == item['task_id']))
+            project_id = result.scalar_one_or_none()
+            if project_id:
+                await dispatch_generation_task(db, item['task_id'], project_id, batch_id=item['batch_id'])
+        return ready
+
+
+@celery_app.task(name="schedule_projects")
+def schedule_projects():
+    """按项目的 schedule_cron 触发任务，同时触发的项目错峰启动（定时任务）"""
+    loop = asyncio.get_event_loop()
+    due = loop.run_until_complete(_collect_due_projects())
+    
+    for item in due:
+        start_scheduled_project.apply_async((item['project_id'], item['fire_time']), countdown=item['delay'])
+    
+    return {"scheduled": len(due)}
+
+
+async def _collect_due_projects():
+    async with AsyncSessionLocal() as db:
+        return await collect_due_projects(db)
+
+
+@celery_app.task(name="start_scheduled_project")
+def start_scheduled_project(project_id: str, fire_time: str):
+    """
+    启动定时触发的项目（远端分支没有新提交时跳过）
+    
+    Args:
+        project_id: 项目ID
+        fire_time: cron 触发时间（UTC，用于日志）
+    """
+    loop = asyncio.get_event_loop()
+    task_id = loop.run_until_complete(_create_scheduled_task(project_id))
+    
+    return {"project_id": project_id, "fire_time": fire_time, "task_id": task_id}
+
+
+async def _create_scheduled_task(project_id: str):
+    async with AsyncSessionLocal() as db:
+        task_id = await create_scheduled_task(db, project_id)
+        if task_id:
+            await dispatch_generation_task(db, task_id, project_id, interactive=False)
+        return task_id
+
+
 # 定时任务配置
 celery_app.conf.beat_schedule = {
     'cleanup-every-day': {
         'task': 'cleanup_old_tasks',
         'schedule': 86400.0,  # 每天执行一次
     },
+    'schedule-projects': {
+        'task': 'schedule_projects',
+        'schedule': float(settings.scheduler_tick_seconds),
+        'options': {'expires': settings.scheduler_tick_seconds},
+    },
+    'process-llm-batches': {
+        'task': 'process_llm_batches',
+        'schedule': float(settings.llm_batch_poll_interval),
+        'options': {'expires': settings.llm_batch_poll_interval},  # 积压的轮询不再执行
+    },
 }
 
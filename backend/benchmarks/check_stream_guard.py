@@ -0,0 +1,102 @@
+"""流式输出守卫回归检查
+
+把合法的多 KB Go 测试文件按小块流式喂给 StreamGuard（开启增量语法检查），确认：
+- tree-sitter 可用，且首次解析、增量解析都实际执行过
+- 合法代码不会被中止，代码块闭合时正常结束
+
+用法（在 backend 目录下）:
+    python benchmarks/check_stream_guard.py
+    python benchmarks/check_stream_guard.py --functions 200 --chunk-size 7
+
+检查失败时进程以非零状态退出，可直接用于部署前检查
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def build_go_file(functions: int) -> str:
+    """生成一个包含 functions 个表驱动测试函数的合法 Go 测试文件"""
+    parts = [
+        "package calc\n",
+        "import (\n\t\"testing\"\n)\n",
+    ]
+    for i in range(functions):
+        parts.append(
+            f"// TestAdd{i} 累加第 {i} 组用例\n"
+            f"func TestAdd{i}(t *testing.T) {{\n"
+            "\ttests := []struct {\n"
+            "\t\tname string\n"
+            "\t\tin   int\n"
+            "\t\twant int\n"
+            "\t}{\n"
+            f"\t\t{{\"positive\", {i}, {i + 1}}},\n"
+            f"\t\t{{\"negative\", -{i}, {1 - i}}},\n"
+            "\t}\n"
+            "\tfor _, tt := range tests {\n"
+            "\t\tt.Run(tt.name, func(t *testing.T) {\n"
+            "\t\t\tc := NewCalculator(1)\n"
+            "\t\t\tif got := c.Add(tt.in); got != tt.want {\n"
+            "\t\t\t\tt.Errorf(\"Add(%d) = %d, want %d\", tt.in, got, tt.want)\n"
+            "\t\t\t}\n"
+            "\t\t})\n"
+            "\t}\n"
+            "}\n"
+        )
+    return "\n".join(parts)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="AI Test Agent 流式输出守卫回归检查")
+    parser.add_argument("--functions", type=int, default=60, help="生成的测试函数个数（默认约 30KB 代码）")
+    parser.add_argument("--chunk-size", type=int, default=13, help="每次喂入的字符数（模拟流式增量）")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    sys.path.insert(0, str(BACKEND_DIR))
+    from app.services.stream_guard import StreamAborted, StreamGuard
+
+    code = build_go_file(args.functions)
+    text = f"```go\n{code}```\n"
+    guard = StreamGuard('golang', syntax_check=True)
+    if guard._parser is None:
+        print("❌ tree-sitter 不可用，无法检查增量语法检查")
+        return 1
+
+    checks = 0
+    parsed_len = 0
+    finished = False
+    try:
+        for start in range(0, len(text), args.chunk_size):
+            if guard.feed(text[start:start + args.chunk_size]):
+                finished = True
+                break
+            if guard._parsed_len != parsed_len:
+                parsed_len = guard._parsed_len
+                checks += 1
+    except StreamAborted as e:
+        print(f"❌ 合法代码被中止: {e}")
+        return 1
+    except Exception as e:
+        print(f"❌ 流式语法检查出错: {type(e).__name__}: {e}")
+        return 1
+
+    if not finished:
+        print("❌ 代码块闭合后没有结束接收")
+        return 1
+    if checks < 2:
+        print(f"❌ 语法检查只执行了 {checks} 次，未覆盖增量解析（代码 {len(code)} 字符）")
+        return 1
+
+    print(f"✅ {len(code)} 字符的 Go 代码流式通过，语法检查 {checks} 次")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
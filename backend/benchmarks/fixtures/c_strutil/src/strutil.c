@@ -0,0 +1,40 @@
+#include <string.h>
+#include "strutil.h"
+
+size_t count_char(const char *s, char c) {
+    size_t count = 0;
+    if (s == NULL) {
+        return 0;
+    }
+    for (; *s; s++) {
+        if (*s == c) {
+            count++;
+        }
+    }
+    return count;
+}
+
+void reverse(char *s) {
+    if (s == NULL) {
+        return;
+    }
+    size_t len = strlen(s);
+    for (size_t i = 0; i < len / 2; i++) {
+        char tmp = s[i];
+        s[i] = s[len - 1 - i];
+        s[len - 1 - i] = tmp;
+    }
+}
+
+int is_palindrome(const char *s) {
+    if (s == NULL) {
+        return 0;
+    }
+    size_t len = strlen(s);
+    for (size_t i = 0; i < len / 2; i++) {
+        if (s[i] != s[len - 1 - i]) {
+            return 0;
+        }
+    }
+    return 1;
+}
@@ -0,0 +1,10 @@
+#ifndef STRUTIL_H
+#define STRUTIL_H
+
+#include <stddef.h>
+
+size_t count_char(const char *s, char c);
+void reverse(char *s);
+int is_palindrome(const char *s);
+
+#endif
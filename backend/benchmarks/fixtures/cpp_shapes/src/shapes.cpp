@@ -0,0 +1,22 @@
+#include "shapes.h"
+
+Rectangle::Rectangle(double width, double height) : width_(width), height_(height) {}
+
+double Rectangle::area() const {
+    return width_ * height_;
+}
+
+double Rectangle::perimeter() const {
+    return 2 * (width_ + height_);
+}
+
+bool Rectangle::isSquare() const {
+    return width_ == height_;
+}
+
+double circleArea(double radius) {
+    if (radius < 0) {
+        return 0;
+    }
+    return 3.14159265358979 * radius * radius;
+}
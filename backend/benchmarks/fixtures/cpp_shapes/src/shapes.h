@@ -0,0 +1,15 @@
+#pragma once
+
+class Rectangle {
+public:
+    Rectangle(double width, double height);
+    double area() const;
+    double perimeter() const;
+    bool isSquare() const;
+
+private:
+    double width_;
+    double height_;
+};
+
+double circleArea(double radius);
@@ -0,0 +1,49 @@
+package calc
+
+import "errors"
+
+// ErrDivideByZero 除数为零
+var ErrDivideByZero = errors.New("divide by zero")
+
+// Calculator 带累加器的计算器
+type Calculator struct {
+	Total   int
+	History []int
+}
+
+// NewCalculator 创建计算器
+func NewCalculator(initial int) *Calculator {
+	return &Calculator{Total: initial}
+}
+
+// Add 累加
+func (c *Calculator) Add(n int) int {
+	c.Total += n
+	c.History = append(c.History, n)
+	return c.Total
+}
+
+// Reset 清零
+func (c *Calculator) Reset() {
+	c.Total = 0
+	c.History = nil
+}
+
+// Divide 整数除法
+func Divide(a, b int) (int, error) {
+	if b == 0 {
+		return 0, ErrDivideByZero
+	}
+	return a / b, nil
+}
+
+// Clamp 将 v 限制在 [lo, hi] 区间内
+func Clamp(v, lo, hi int) int {
+	if v < lo {
+		return lo
+	}
+	if v > hi {
+		return hi
+	}
+	return v
+}
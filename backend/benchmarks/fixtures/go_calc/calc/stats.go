@@ -0,0 +1,27 @@
+package calc
+
+// Mean 计算平均值，空切片返回 0
+func Mean(values []float64) float64 {
+	if len(values) == 0 {
+		return 0
+	}
+	sum := 0.0
+	for _, v := range values {
+		sum += v
+	}
+	return sum / float64(len(values))
+}
+
+// Max 返回最大值，空切片返回 false
+func Max(values []int) (int, bool) {
+	if len(values) == 0 {
+		return 0, false
+	}
+	max := values[0]
+	for _, v := range values[1:] {
+		if v > max {
+			max = v
+		}
+	}
+	return max, true
+}
@@ -0,0 +1,369 @@
+"""端到端流水线基准测试
+
+使用模拟 LLM 提供商（AI_PROVIDER=mock）在固定的 Go/C/C++ 示例仓库上运行完整的
+TestGenerationAgent.execute 流程（克隆 → 分析 → 生成/校验 → 执行 → 修复 → 覆盖率），
+不产生 API 费用，报告：
+- 各阶段耗时（按进度回调的状态切换计时）
+- 吞吐量（生成的测试文件数/分钟）
+- 峰值 RSS（本进程和子进程，如 go test / g++）
+- LLM 调用次数和 token 用量
+
+用法（在 backend 目录下）:
+    python benchmarks/run_pipeline_benchmark.py
+    python benchmarks/run_pipeline_benchmark.py --languages golang --iterations 3 --latency-ms 300 --tokens-per-second 150
+    python benchmarks/run_pipeline_benchmark.py --mock-mode replay --cassette benchmarks/cassettes/golang.jsonl
+    python benchmarks/run_pipeline_benchmark.py --output result.json --baseline baseline.json --max-regression 0.2
+
+任何一次运行没有生成测试文件或没有执行任何测试（如测试编译失败）时进程以非零状态退出；
+指定 --baseline 时，吞吐量比基线下降超过 --max-regression 的语言也会使进程以非零状态退出，
+可直接用于部署前检查
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+# 各语言的示例仓库及项目配置
+FIXTURES = {
+    'golang': {
+        'fixture': 'go_calc',
+        'test_framework': 'go_test',
+        'source_directory': 'calc',
+        'test_directory': 'calc'
+    },
+    'cpp': {
+        'fixture': 'cpp_shapes',
+        'test_framework': 'google_test',
+        'source_directory': 'src',
+        'test_directory': 'tests'
+    },
+    'c': {
+        'fixture': 'c_strutil',
+        'test_framework': 'cunit',
+        'source_directory': 'src',
+        'test_directory': 'tests'
+    }
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="AI Test Agent 端到端流水线基准测试")
+    parser.add_argument("--languages", default="golang,cpp,c", help="逗号分隔的语言列表")
+    parser.add_argument("--iterations", type=int, default=1, help="每种语言运行次数（取中位数）")
+    parser.add_argument("--mock-mode", default="synthetic", choices=["synthetic", "record", "replay"])
+    parser.add_argument("--cassette", default="", help="录制文件路径（record / replay 模式）")
+    parser.add_argument("--latency-ms", type=float, default=0, help="合成回复的首 token 延迟（毫秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="合成回复的输出速度")
+    parser.add_argument("--no-auto-fix", action="store_true", help="关闭测试失败后的自动修复")
+    parser.add_argument("--output", default="", help="结果输出文件（JSON）")
+    parser.add_argument("--baseline", default="", help="基线结果文件（JSON），用于回归检查")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的吞吐量下降比例")
+    parser.add_argument("--keep-workspace", action="store_true", help="保留临时工作目录")
+    # 内部参数：在独立子进程中运行一次（峰值 RSS 只统计该次运行）
+    parser.add_argument("--run-one", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--work-root", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", default="", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace, work_root: Path):
+    """在导入 app 之前设置环境变量（配置是进程级单例）"""
+    os.environ['WORKSPACE_DIR'] = str(work_root / "workspace")
+    os.environ['REPORTS_DIR'] = str(work_root / "reports")
+    os.environ['AI_PROVIDER'] = "mock"
+    os.environ['MOCK_LLM_MODE'] = args.mock_mode
+    os.environ['MOCK_LLM_CASSETTE'] = args.cassette
+    os.environ['MOCK_LLM_LATENCY_MS'] = str(args.latency_ms)
+    os.environ['MOCK_LLM_TOKENS_PER_SECOND'] = str(args.tokens_per_second)
+    os.environ.setdefault('LOG_LEVEL', "WARNING")
+    sys.path.insert(0, str(BACKEND_DIR))
+
+
+def prepare_fixture_repo(language: str, work_root: Path) -> Path:
+    """把示例仓库复制到临时目录并初始化为 git 仓库（供 clone_or_pull 克隆）"""
+    fixture = FIXTURES[language]['fixture']
+    repo_dir = work_root / "origins" / fixture
+    if repo_dir.exists():
+        return repo_dir
+
+    shutil.copytree(FIXTURES_DIR / fixture, repo_dir)
+    git = ["git", "-c", "user.name=benchmark", "-c", "user.email=benchmark@localhost"]
+    subprocess.run(git + ["init", "-q", "-b", "main"], cwd=repo_dir, check=True)
+    subprocess.run(git + ["add", "-A"], cwd=repo_dir, check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "fixture"], cwd=repo_dir, check=True)
+    return repo_dir
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """
+    本进程和已结束子进程的峰值 RSS（MB，Linux 下 ru_maxrss 单位为 KB）
+
+    ru_maxrss 是整个进程生命周期的峰值，因此每次运行都在独立的子进程中执行（见 run_isolated）
+    """
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    }
+
+
+async def run_once(language: str, iteration: int, args: argparse.Namespace, work_root: Path) -> Dict:
+    """运行一次完整流水线"""
+    from app.agent.test_agent import TestGenerationAgent
+    from app.services.mock_llm import get_mock_llm_client
+
+    repo_dir = prepare_fixture_repo(language, work_root)
+    fixture = FIXTURES[language]
+    project_config = {
+        'git_url': str(repo_dir),
+        'git_branch': 'main',
+        'language': language,
+        'test_framework': fixture['test_framework'],
+        'source_directory': fixture['source_directory'],
+        'test_directory': fixture['test_directory'],
+        'ai_provider': 'mock',
+        'auto_commit': False,
+        'enable_auto_fix': not args.no_auto_fix,
+        'skip_existing_tests': False
+    }
+
+    # 按状态切换记录各阶段耗时
+    stage_times: Dict[str, float] = {}
+    current = {'stage': None, 'started': time.perf_counter()}
+
+    async def progress_callback(progress: int, status: str, message: str):
+        now = time.perf_counter()
+        if status != current['stage']:
+            if current['stage'] is not None:
+                stage_times[current['stage']] = stage_times.get(current['stage'], 0) + now - current['started']
+            current['stage'] = status
+            current['started'] = now
+
+    mock_client = get_mock_llm_client()
+    calls_before = dict(mock_client.stats)
+
+    started = time.perf_counter()
+    result = await TestGenerationAgent().execute(
+        project_id=f"bench-{language}-{iteration}-{int(time.time() * 1000)}",
+        project_config=project_config,
+        task_id=f"bench-{language}-{iteration}",
+        progress_callback=progress_callback
+    )
+    wall_time = time.perf_counter() - started
+    if current['stage'] not in (None, "COMPLETED", "FAILED"):
+        stage_times[current['stage']] = stage_times.get(current['stage'], 0) + time.perf_counter() - current['started']
+
+    generated = len(result.get('test_files', []))
+    llm_calls = {key: mock_client.stats[key] - calls_before.get(key, 0) for key in mock_client.stats}
+    test_results = result.get('test_results', {})
+
+    # 生成了测试文件但没有执行任何测试（编译失败、缺少测试框架头文件等）也算失败，
+    # 否则这类回归会被报告为成功率 100%
+    success = result['success'] and test_results.get('total', 0) > 0
+    error = result.get('error')
+    if not error and not success:
+        error = "没有执行任何测试（编译失败或未发现测试）"
+
+    return {
+        'success': success,
+        'error': error,
+        'wall_time': round(wall_time, 3),
+        'stages': {stage: round(seconds, 3) for stage, seconds in stage_times.items()},
+        'test_files': generated,
+        'files_per_minute': round(generated / wall_time * 60, 2) if wall_time > 0 else 0,
+        'llm_calls': llm_calls,
+        'llm_usage': result.get('llm_usage', {}),
+        'tests_passed': test_results.get('passed_count', 0),
+        'tests_total': test_results.get('total', 0),
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def run_isolated(language: str, iteration: int, args: argparse.Namespace, work_root: Path) -> Dict:
+    """在独立的子进程中运行一次完整流水线，峰值 RSS 不受之前运行的影响"""
+    result_file = work_root / f"result-{language}-{iteration}.json"
+    cmd = [
+        sys.executable, str(Path(__file__).resolve()), *sys.argv[1:],
+        "--run-one", f"{language}:{iteration}",
+        "--work-root", str(work_root),
+        "--result-file", str(result_file)
+    ]
+    process = subprocess.run(cmd, cwd=BACKEND_DIR)
+    if process.returncode == 0 and result_file.exists():
+        with open(result_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    return {
+        'success': False,
+        'error': f"基准子进程退出码 {process.returncode}",
+        'wall_time': 0,
+        'stages': {},
+        'test_files': 0,
+        'files_per_minute': 0,
+        'llm_calls': {},
+        'llm_usage': {},
+        'tests_passed': 0,
+        'tests_total': 0,
+        'peak_rss_mb': {'self': 0, 'children': 0}
+    }
+
+
+def run_child(args: argparse.Namespace) -> int:
+    """子进程入口：运行一次并把结果写入 --result-file"""
+    language, iteration = args.run_one.split(":")
+    work_root = Path(args.work_root)
+    configure_environment(args, work_root)
+    run = asyncio.run(run_once(language, int(iteration), args, work_root))
+    with open(args.result_file, 'w', encoding='utf-8') as f:
+        json.dump(run, f, ensure_ascii=False)
+    return 0
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    """多次运行取中位数"""
+    stages = sorted({stage for run in runs for stage in run['stages']})
+    return {
+        'iterations': len(runs),
+        'success_rate': sum(1 for run in runs if run['success']) / len(runs),
+        'runs_without_tests': sum(1 for run in runs if not run['tests_total']),
+        'wall_time': round(statistics.median(run['wall_time'] for run in runs), 3),
+        'files_per_minute': round(statistics.median(run['files_per_minute'] for run in runs), 2),
+        'stages': {
+            stage: round(statistics.median(run['stages'].get(stage, 0) for run in runs), 3)
+            for stage in stages
+        },
+        'llm_calls': round(statistics.median(run['llm_calls'].get('calls', 0) for run in runs), 1),
+        'peak_rss_mb': max(run['peak_rss_mb']['self'] for run in runs),
+        'peak_child_rss_mb': max(run['peak_rss_mb']['children'] for run in runs),
+        'runs': runs
+    }
+
+
+def print_report(results: Dict[str, Dict]):
+    print("\n" + "=" * 72)
+    print("流水线基准测试结果")
+    print("=" * 72)
+    for language, summary in results.items():
+        print(f"\n[{language}] 运行 {summary['iterations']} 次，成功率 {summary['success_rate'] * 100:.0f}%")
+        if summary['runs_without_tests']:
+            print(f"  ❌ {summary['runs_without_tests']} 次运行没有执行任何测试，吞吐量不可信")
+        print(f"  总耗时(中位数): {summary['wall_time']:.2f}s   吞吐量: {summary['files_per_minute']:.2f} 文件/分钟")
+        print(f"  LLM 调用: {summary['llm_calls']:.0f} 次   峰值 RSS: {summary['peak_rss_mb']:.1f} MB (子进程 {summary['peak_child_rss_mb']:.1f} MB)")
+        for stage, seconds in summary['stages'].items():
+            print(f"    {stage:<22}{seconds:>8.3f}s")
+        errors = {run['error'] for run in summary['runs'] if run['error']}
+        for error in errors:
+            print(f"  ⚠️ {error}")
+
+
+def check_regressions(results: Dict[str, Dict], baseline_path: str, max_regression: float) -> List[str]:
+    """与基线比较吞吐量，返回回归说明列表"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for language, summary in results.items():
+        base = baseline.get('results', {}).get(language)
+        if not base:
+            continue
+        # 吞吐量为 0 的基线说明基线本身是一次失败的运行，不能用来比较
+        if not base.get('files_per_minute'):
+            regressions.append(f"{language}: 基线吞吐量为 0，请重新生成基线")
+            continue
+        if base.get('runs_without_tests'):
+            regressions.append(f"{language}: 基线中有没有执行任何测试的运行，请重新生成基线")
+            continue
+        ratio = summary['files_per_minute'] / base['files_per_minute']
+        if ratio < 1 - max_regression:
+            regressions.append(
+                f"{language}: 吞吐量 {summary['files_per_minute']:.2f} 文件/分钟，"
+                f"基线 {base['files_per_minute']:.2f}（下降 {(1 - ratio) * 100:.0f}%）"
+            )
+    return regressions
+
+
+def main() -> int:
+    args = parse_args()
+    if args.run_one:
+        return run_child(args)
+
+    languages = [lang.strip() for lang in args.languages.split(',') if lang.strip()]
+    for language in languages:
+        if language not in FIXTURES:
+            print(f"不支持的语言: {language}（可选: {', '.join(FIXTURES)}）")
+            return 2
+
+    work_root = Path(tempfile.mkdtemp(prefix="aitest-bench-"))
+
+    try:
+        results = {}
+        for language in languages:
+            runs = [run_isolated(language, iteration, args, work_root) for iteration in range(args.iterations)]
+            results[language] = summarize(runs)
+
+        print_report(results)
+
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {
+                'mock_mode': args.mock_mode,
+                'latency_ms': args.latency_ms,
+                'tokens_per_second': args.tokens_per_second,
+                'iterations': args.iterations
+            },
+            'results': results
+        }
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已保存: {args.output}")
+
+        # 没有生成测试文件或没有执行任何测试的运行视为失败（如模拟回复与语言不匹配、测试编译失败），
+        # 吞吐量没有意义
+        empty = [
+            f"{language} 第 {index + 1} 次运行" for language, summary in results.items()
+            for index, run in enumerate(summary['runs']) if not run['test_files']
+        ]
+        if empty:
+            print(f"\n❌ 以下运行没有生成测试文件: {', '.join(empty)}")
+            return 1
+        no_tests = [
+            f"{language} 第 {index + 1} 次运行" for language, summary in results.items()
+            for index, run in enumerate(summary['runs']) if not run['tests_total']
+        ]
+        if no_tests:
+            print(f"\n❌ 以下运行没有执行任何测试（编译失败或未发现测试）: {', '.join(no_tests)}")
+            return 1
+
+        if args.baseline:
+            regressions = check_regressions(results, args.baseline, args.max_regression)
+            if regressions:
+                print("\n❌ 检测到性能回归:")
+                for line in regressions:
+                    print(f"  - {line}")
+                return 1
+            print("\n✅ 未检测到性能回归")
+
+        return 0
+    finally:
+        if args.keep_workspace:
+            print(f"工作目录: {work_root}")
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
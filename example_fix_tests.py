@@ -5,6 +5,7 @@ AI Test Agent - 测试修复（非交互式并发模式）
 自动使用并发模式修复测试文件，支持命令行参数。
 """
 
+import json
 import requests
 import time
 import sys
@@ -12,6 +13,59 @@ import subprocess
 import argparse
 
 
+def run_fix_job(api_base, fix_config, show_files=True):
+    """
+    提交修复任务并通过 NDJSON 流实时接收逐文件结果，任务结束后返回完整修复结果
+    
+    修复在后台 worker 中执行，HTTP 连接断开不影响修复；重新连接时从已收到的事件之后继续
+    """
+    response = requests.post(f"{api_base}/tasks/fix-tests", json=fix_config, timeout=30)
+    response.raise_for_status()
+    job_id = response.json()['id']
+    print(f"📬 修复任务已提交: {job_id}")
+    print()
+    
+    offset = 0
+    while True:
+        try:
+            with requests.get(
+                f"{api_base}/tasks/fix-jobs/{job_id}/stream",
+                params={"offset": offset},
+                stream=True,
+                timeout=(10, 300)  # 读取超时只针对两条事件之间的间隔
+            ) as stream:
+                stream.raise_for_status()
+                for line in stream.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    offset += 1
+                    
+                    if event['type'] == 'started':
+                        print(f"📝 找到 {event['total_files']} 个测试文件")
+                    elif event['type'] == 'file' and show_files:
+                        file_result = event['result']
+                        file_name = file_result['file_path'].split('/')[-1]
+                        if not file_result['success']:
+                            status = "❌ 失败"
+                        elif file_result['fixed']:
+                            status = "✅ 已修复"
+                        else:
+                            status = "⏭️  无需修复"
+                        print(f"   [{event['index']}/{event['total_files']}] {status} {file_name}")
+                    elif event['type'] == 'failed':
+                        raise RuntimeError(f"修复任务失败: {event['error']}")
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
+            print("⚠️  事件流中断，重新连接...")
+            time.sleep(2)
+    
+    job = requests.get(f"{api_base}/tasks/fix-jobs/{job_id}", timeout=30).json()
+    if job['status'] != 'completed':
+        raise RuntimeError(f"修复任务失败: {job.get('error')}")
+    return job['result']
+
+
 def rerun_tests_and_show_pass_rate(workspace_path, test_framework="ginkgo"):
     """修复后重新运行测试并显示通过率"""
     print()
@@ -267,13 +321,7 @@ def scenario_1_quick_fix():
     try:
         print("🚀 开始修复...")
         
-        response = requests.post(
-            f"{API_BASE}/tasks/fix-tests",
-            json=fix_config,
-            timeout=600
-        )
-        response.raise_for_status()
-        result = response.json()
+        result = run_fix_job(API_BASE, fix_config)
         
         print()
         print("=" * 70)
@@ -415,13 +463,7 @@ def scenario_2_async_fix():
         # 记录开始时间
         start_time = time.time()
         
-        response = requests.post(
-            f"{API_BASE}/tasks/fix-tests",
-            json=fix_config,
-            timeout=(60, 1800)  # 连接60秒，读取30分钟
-        )
-        response.raise_for_status()
-        result = response.json()
+        result = run_fix_job(API_BASE, fix_config)
         
         # 计算耗时
         duration = time.time() - start_time
@@ -501,7 +543,7 @@ def scenario_2_async_fix():
         
     except requests.exceptions.Timeout:
         print("❌ 请求超时")
-        print("   建议: 增加 timeout 参数或减少文件数量")
+        print("   建议: 检查 API 服务是否可用（修复在后台执行，可通过 /api/tasks/fix-jobs/{job_id} 查询结果）")
         return False
         
     except Exception as e:
@@ -559,13 +601,7 @@ def scenario_3_async_with_git():
         
         start_time = time.time()
         
-        response = requests.post(
-            f"{API_BASE}/tasks/fix-tests",
-            json=fix_config,
-            timeout=(60, 1800)
-        )
-        response.raise_for_status()
-        result = response.json()
+        result = run_fix_job(API_BASE, fix_config)
         
         duration = time.time() - start_time
         
@@ -704,13 +740,7 @@ def async_fix_tests(workspace_path, test_directory="internal/biz",
         
         start_time = time.time()
         
-        response = requests.post(
-            f"{API_BASE}/tasks/fix-tests",
-            json=fix_config,
-            timeout=(60, 1800)
-        )
-        response.raise_for_status()
-        result = response.json()
+        result = run_fix_job(API_BASE, fix_config)
         
         duration = time.time() - start_time
         